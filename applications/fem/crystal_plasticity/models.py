@@ -48,6 +48,9 @@ get_rot_mat_vmap = jax.vmap(get_rot_mat)
 
 
 class CrystalPlasticity(Mechanics):
+    # The time step is reassigned at every step by the scripts
+    kernel_state_attrs = ('dt',)
+
     def custom_init(self, quat, cell_ori_inds):
         r = 1.
         self.gss_initial = 60.8 
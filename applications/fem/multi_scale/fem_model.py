@@ -12,6 +12,8 @@ from applications.fem.multi_scale.utils import tensor_to_flat
 class HyperElasticity(Mechanics):
     """Three modes: rve, dns, nn
     """
+    kernel_state_attrs = ('H_bar',)
+
     def custom_init(self, mode, dns_info):
         self.mode = mode
         self.dns_info = dns_info
@@ -77,7 +77,6 @@ def rve_problem(data_dir):
     periodic_bc_info = [location_fns_A, location_fns_B, mappings, vecs]
     problem = HyperElasticity(jax_mesh, vec=3, dim=3, dirichlet_bc_info=dirichlet_bc_info, 
         periodic_bc_info=periodic_bc_info, additional_info=('rve', None))
-    problem.p_num_eps = 1e2 # For numerical stability of imposing periodic B.C.
     return problem
 
 
@@ -137,7 +136,7 @@ def check_one_rve():
 def solve_rve_problem(problem, sample_H_bar):
     base_H_bar = flat_to_tensor(sample_H_bar)
     problem.H_bar = base_H_bar
-    sol_fluc = solver(problem)
+    sol_fluc = solver(problem, reduced=True)
     energy = problem.compute_energy(sol_fluc)
     ratios = [0.25, 0.5, 0.75, 0.9, 1.]
     if np.any(np.isnan(energy)):
@@ -145,7 +144,7 @@ def solve_rve_problem(problem, sample_H_bar):
         sol_fluc = np.zeros((problem.num_total_nodes, problem.vec))
         for ratio in ratios:
             problem.H_bar = ratio * base_H_bar
-            sol_fluc = solver(problem)
+            sol_fluc = solver(problem, reduced=True)
         energy = problem.compute_energy(sol_fluc)
 
     return sol_fluc, np.hstack((sample_H_bar, energy))
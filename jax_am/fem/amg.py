@@ -0,0 +1,287 @@
+"""Smoothed aggregation algebraic multigrid (AMG) preconditioner.
+
+The hierarchy is set up on the host with scipy.sparse: nodes are grouped into
+aggregates on the matrix graph, the near-nullspace (rigid body modes for
+elasticity) is fitted on each aggregate to build the tentative prolongator,
+which is then smoothed with a Jacobi step. The V-cycle only uses BCOO
+matrix-vector products and runs in JAX.
+
+The aggregation and the tentative prolongators only depend on the sparsity
+pattern of the matrix, so they are cached on the problem and reused by later
+Newton iterations. Only the smoothed prolongators and the Galerkin coarse
+matrices are recomputed.
+
+Reference: Vanek, Mandel and Brezina, "Algebraic multigrid by smoothed
+aggregation for second and fourth order elliptic problems", Computing, 1996.
+"""
+import jax.numpy as np
+import numpy as onp
+import scipy
+from jax.experimental.sparse import BCOO
+
+from jax_am import logger
+
+
+def get_near_nullspace(problem):
+    """Near-nullspace of the operator at the finest level.
+    Rigid body modes if vec == dim (mechanics), constants per component
+    otherwise.
+
+    Returns
+    -------
+    B : onp.ndarray
+        (num_total_dofs, num_modes)
+    """
+    num_nodes, vec, dim = problem.num_total_nodes, problem.vec, problem.dim
+    if vec == dim and dim in (2, 3):
+        x = onp.asarray(problem.points)[:, :dim]
+        x = x - onp.mean(x, axis=0)
+        num_modes = 3 if dim == 2 else 6
+        B = onp.zeros((num_nodes, vec, num_modes))
+        for i in range(dim):
+            B[:, i, i] = 1.
+        if dim == 2:
+            B[:, 0, 2], B[:, 1, 2] = -x[:, 1], x[:, 0]
+        else:
+            B[:, 1, 3], B[:, 2, 3] = -x[:, 2], x[:, 1]
+            B[:, 0, 4], B[:, 2, 4] = x[:, 2], -x[:, 0]
+            B[:, 0, 5], B[:, 1, 5] = -x[:, 1], x[:, 0]
+    else:
+        B = onp.tile(onp.eye(vec), (num_nodes, 1, 1))
+    return B.reshape(num_nodes * vec, -1)
+
+
+def neighbor_max(graph, values):
+    """Largest value over the neighbors of each node, -1 if none"""
+    out = -onp.ones(graph.shape[0], dtype=values.dtype)
+    nonempty = onp.diff(graph.indptr) > 0
+    if onp.any(nonempty):
+        out[nonempty] = onp.maximum.reduceat(values[graph.indices],
+                                             graph.indptr[:-1][nonempty])
+    return out
+
+
+def standard_aggregation(graph, seed=0):
+    """Aggregation of the nodes of a graph (as in PyAMG).
+
+    The roots of the aggregates are a maximal independent set of the
+    distance-2 graph, found with Luby's algorithm in vectorized rounds, so
+    that the aggregates (a root and its neighbors) do not overlap. The other
+    nodes then join a neighboring aggregate.
+
+    Parameters
+    ----------
+    graph : scipy.sparse.csr_array
+        (num_nodes, num_nodes) only the pattern is used
+    seed : int
+        Seed of the random priorities of the nodes
+
+    Returns
+    -------
+    aggregates : onp.ndarray
+        (num_nodes,) aggregate index of each node
+    num_aggs : int
+    """
+    num_nodes = graph.shape[0]
+    pattern = scipy.sparse.csr_array(
+        scipy.sparse.csr_array(
+            (onp.ones(len(graph.indices)), graph.indices, graph.indptr),
+            shape=graph.shape) +
+        scipy.sparse.csr_array(scipy.sparse.identity(num_nodes)))
+    pattern_2 = scipy.sparse.csr_array(pattern @ pattern)
+
+    # Pass 1: roots with the highest priority in their distance-2
+    # neighborhood seed an aggregate, until all nodes are covered
+    priority = onp.random.default_rng(seed).permutation(num_nodes)
+    is_root = onp.zeros(num_nodes, dtype=bool)
+    free = onp.ones(num_nodes, dtype=bool)
+    while onp.any(free):
+        free_priority = onp.where(free, priority, -1)
+        new_roots = free & (neighbor_max(pattern_2, free_priority) == priority)
+        is_root |= new_roots
+        free &= neighbor_max(pattern_2, new_roots.astype(onp.int64)) <= 0
+    roots = onp.flatnonzero(is_root)
+    num_aggs = len(roots)
+    root_aggs = -onp.ones(num_nodes, dtype=onp.int64)
+    root_aggs[roots] = onp.arange(num_aggs)
+    aggregates = neighbor_max(pattern, root_aggs)
+
+    # Pass 2: free nodes join a neighboring aggregate
+    seeded = neighbor_max(pattern, aggregates)
+    aggregates = onp.where(aggregates < 0, seeded, aggregates)
+
+    return aggregates, num_aggs
+
+
+def fit_candidates(aggregates, num_aggs, B, block_size):
+    """Tentative prolongator: the near-nullspace restricted to each aggregate
+    is orthonormalized with a QR decomposition.
+
+    Returns
+    -------
+    T : scipy.sparse.csr_array
+        (num_dofs, num_aggs*num_modes)
+    B_coarse : onp.ndarray
+        (num_aggs*num_modes, num_modes)
+    """
+    num_modes = B.shape[1]
+    B_nodes = B.reshape(-1, block_size, num_modes)
+    order = onp.argsort(aggregates, kind='stable')
+    sizes = onp.bincount(aggregates, minlength=num_aggs)
+    starts = onp.concatenate((onp.array([0]), onp.cumsum(sizes)[:-1]))
+    B_coarse = onp.zeros((num_aggs, num_modes, num_modes))
+    rows, cols, vals = [], [], []
+    # Aggregates of the same size are orthonormalized together
+    for size in onp.unique(sizes):
+        aggs = onp.flatnonzero(sizes == size)
+        nodes = order[starts[aggs][:, None] + onp.arange(size)[None, :]]
+        local_B = B_nodes[nodes].reshape(len(aggs), size * block_size,
+                                         num_modes)
+        num_rows = size * block_size
+        # Pad small aggregates so that the QR decomposition is square
+        num_pads = max(num_modes - num_rows, 0)
+        local_B = onp.concatenate(
+            (local_B, onp.zeros((len(aggs), num_pads, num_modes))), axis=1)
+        Q, R = onp.linalg.qr(local_B)
+        B_coarse[aggs] = R
+        dofs = (block_size * nodes[:, :, None] +
+                onp.arange(block_size)[None, None, :]).reshape(len(aggs), -1)
+        rows.append(onp.repeat(dofs[:, :, None], num_modes,
+                               axis=2).reshape(-1))
+        cols.append(onp.repeat((num_modes * aggs[:, None] +
+                                onp.arange(num_modes)[None, :])[:, None, :],
+                               num_rows, axis=1).reshape(-1))
+        vals.append(Q[:, :num_rows, :].reshape(-1))
+
+    T = scipy.sparse.csr_array(
+        (onp.hstack(vals), (onp.hstack(rows), onp.hstack(cols))),
+        shape=(len(B), num_aggs * num_modes))
+    return T, B_coarse.reshape(-1, num_modes)
+
+
+def estimate_spectral_radius(A, D_inv, num_iters=15):
+    """Power iteration on D^{-1}A."""
+    x = onp.random.default_rng(0).random(A.shape[0])
+    rho = 1.
+    for i in range(num_iters):
+        y = D_inv * (A @ x)
+        rho = onp.linalg.norm(y) / onp.linalg.norm(x)
+        x = y / onp.linalg.norm(y)
+    return rho
+
+
+def apply_bc_to_matrix(A, bc_rows):
+    """Replace Dirichlet rows and columns by the identity, so that the
+    matrix used by AMG stays symmetric."""
+    mask = onp.ones(A.shape[0])
+    mask[bc_rows] = 0.
+    M = scipy.sparse.diags(mask)
+    A = M @ A @ M + scipy.sparse.diags(1. - mask)
+    A = scipy.sparse.csr_array(A)
+    A.eliminate_zeros()
+    return A
+
+
+def setup_hierarchy(A, B, block_size, cache, max_coarse=500, max_levels=10):
+    """Smoothed aggregation hierarchy.
+
+    Parameters
+    ----------
+    A : scipy.sparse.csr_array
+        (num_dofs, num_dofs) finest matrix
+    B : onp.ndarray
+        (num_dofs, num_modes) near-nullspace
+    block_size : int
+        Number of dofs per node at the finest level
+    cache : list
+        Tentative prolongators of each level, filled at the first call and
+        reused afterwards
+
+    Returns
+    -------
+    levels : list
+        (A, P, D_inv, omega) of each level but the coarsest
+    A_coarse : scipy.sparse.csr_array
+    """
+    levels = []
+    for l in range(max_levels - 1):
+        if A.shape[0] <= max_coarse:
+            break
+        if l == len(cache):
+            bsr = scipy.sparse.bsr_matrix(A,
+                                          blocksize=(block_size, block_size))
+            graph = scipy.sparse.csr_array(
+                (onp.ones(len(bsr.indices)), bsr.indices, bsr.indptr),
+                shape=(bsr.shape[0] // block_size,) * 2)
+            aggregates, num_aggs = standard_aggregation(graph)
+            T, B = fit_candidates(aggregates, num_aggs, B, block_size)
+            if T.shape[1] >= A.shape[0]:
+                break
+            cache.append(T)
+        T = cache[l]
+        block_size = B.shape[1]
+        D = A.diagonal()
+        D_inv = onp.where(D != 0., 1. / onp.where(D != 0., D, 1.), 0.)
+        omega = 4. / 3. / estimate_spectral_radius(A, D_inv)
+        P = scipy.sparse.csr_array(
+            T - omega * (scipy.sparse.diags(D_inv) @ (A @ T)))
+        levels.append((A, P, D_inv, omega))
+        A = scipy.sparse.csr_array(P.T @ A @ P)
+    return levels, A
+
+
+def get_amg_precond(problem):
+    """Smoothed aggregation AMG preconditioner (one V-cycle) of the
+    assembled matrix problem.A_sp_scipy, with Dirichlet rows eliminated.
+
+    Returns
+    -------
+    amg_precond : Callable
+        (num_total_dofs,) -> (num_total_dofs,)
+    """
+    bc_rows = onp.hstack([onp.array(node_inds) * problem.vec + vec_inds
+                          for node_inds, vec_inds in zip(
+                              problem.node_inds_list, problem.vec_inds_list)]
+                         + [onp.array([], dtype=onp.int64)]).astype(onp.int64)
+    if not hasattr(problem, 'amg_cache') or not onp.array_equal(
+            problem.amg_cache['bc_rows'], bc_rows):
+        logger.debug(f"Computing AMG aggregates...")
+        problem.amg_cache = {'bc_rows': bc_rows, 'tentatives': []}
+
+    A = apply_bc_to_matrix(problem.A_sp_scipy, bc_rows)
+    levels, A_coarse = setup_hierarchy(A, get_near_nullspace(problem),
+                                       problem.vec,
+                                       problem.amg_cache['tentatives'])
+    logger.debug(f"AMG hierarchy with {len(levels) + 1} levels, coarsest "
+                 f"size = {A_coarse.shape[0]}")
+
+    def to_bcoo(M):
+        M = scipy.sparse.csr_array(M)
+        M.sort_indices()
+        rows = onp.repeat(onp.arange(M.shape[0]), onp.diff(M.indptr))
+        return BCOO((np.array(M.data), np.array(onp.stack((rows, M.indices),
+                                                          axis=1))),
+                    shape=M.shape, indices_sorted=True, unique_indices=True)
+
+    jax_levels = [(to_bcoo(A), to_bcoo(P), to_bcoo(P.T), np.array(D_inv),
+                   omega)
+                  for A, P, D_inv, omega in levels]
+    coarse_inv = np.array(onp.linalg.pinv(A_coarse.toarray()))
+
+    def v_cycle(l, b):
+        if l == len(jax_levels):
+            return coarse_inv @ b
+        A, P, R, D_inv, omega = jax_levels[l]
+        # Jacobi pre-smoothing from a zero initial guess
+        x = omega * D_inv * b
+        x = x + omega * D_inv * (b - A @ x)
+        x = x + P @ v_cycle(l + 1, R @ (b - A @ x))
+        # Jacobi post-smoothing
+        x = x + omega * D_inv * (b - A @ x)
+        x = x + omega * D_inv * (b - A @ x)
+        return x
+
+    def amg_precond(x):
+        return v_cycle(0, x)
+
+    return amg_precond
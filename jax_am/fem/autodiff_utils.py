@@ -14,10 +14,8 @@ jax_array_list_to_numpy_diff_jvp
     JVP of jax_array_list_to_numpy_diff
 
 Todo:
-1. Make PETSc work for backward solve
-2. Working with sparsity [Might be important]
-3. Use saved tangent matrices for backward solve
-4. Create Primitive for all external calls
+1. Working with sparsity [Might be important]
+2. Create Primitive for all external calls
 """
 #                                                                       Modules
 # =============================================================================
@@ -29,14 +27,13 @@ import jax
 from jax import Array
 import numpy as onp
 # Local
-from jax_am.fem.solver import (apply_bc, get_flatten_fn, solver,
-                               jax_solve,
-                               get_jacobi_precond, jacobi_preconditioner)
+from jax_am.fem.solver import (apply_bc, get_flatten_fn, solver, get_A_fn,
+                               Linearization, get_linearization)
 # =============================================================================
 
 
 def ad_wrapper_jvp(problem, linear: bool = False,
-                   use_petsc: bool = True) -> callable:
+                   use_petsc: bool = True, precond=True) -> callable:
     """Wrapper for forward solve with a custom JVP rule.
     Both forward and backward autodiffs are supported.
     Works well to find Hessian-vector products as well
@@ -50,7 +47,9 @@ def ad_wrapper_jvp(problem, linear: bool = False,
         If True, use linear solver. Otherwise, use nonlinear solver
     use_petsc
         If True, use PETSc solver. Otherwise, use JAX solver
-        Note: PETSc solvers are not supported for backward solve
+    precond
+        Preconditioner or direct solver of the forward and tangent solves,
+        see jax_am.fem.solver.solver
 
     Returns
     -------
@@ -60,7 +59,8 @@ def ad_wrapper_jvp(problem, linear: bool = False,
     def forward_solve(params):
         problem.set_params(params)
         # solver is not JITTable
-        sol = solver(problem, linear=linear, use_petsc=use_petsc)
+        sol = solver(problem, linear=linear, precond=precond,
+                     use_petsc=use_petsc)
         return sol
 
     @forward_solve.defjvp
@@ -68,20 +68,23 @@ def ad_wrapper_jvp(problem, linear: bool = False,
         params, = primals
         params_dot, = tangents
         sol = forward_solve(params)
+        # None if the forward solve did not assemble the tangent at sol
+        linearization = get_linearization(problem, precond, use_petsc)
         sol_dot = implicit_jvp_helper(
-            problem, sol, params, params_dot)
+            problem, sol, params, params_dot, linearization)
         return sol.reshape(sol.shape), sol_dot.reshape(sol.shape)
 
     return forward_solve
 
 
 def implicit_jvp_helper(problem, sol0: Array,
-                        params0: Array, params_dot0: Array) -> Array:
+                        params0: Array, params_dot0: Array,
+                        linearization: Linearization = None) -> Array:
     """Helper function to compute JVP of FEA forward solve.
 
-    The forward solve is setup such that it can use either
-    PETSc or JAX solvers. However, the backward solve is setup such
-    that only JAX solvers can be used.
+    The linear solves use the matrix, preconditioner or factorization
+    of the forward solve kept in linearization, with PETSc or JAX
+    solvers alike.
 
     Parameters
     ----------
@@ -93,6 +96,8 @@ def implicit_jvp_helper(problem, sol0: Array,
         Parameters of the forward solve
     params_dot0
         Parameters of the backward solve
+    linearization
+        Tangent at sol0 of the forward solve. Assembled again if None
 
     Returns
     -------
@@ -110,9 +115,12 @@ def implicit_jvp_helper(problem, sol0: Array,
         res_fn = apply_bc(res_fn, problem)
         return res_fn(dofs)
 
-    # For time-dependent problems
-    problem.set_params(params0)
-    problem.newton_update(sol0)
+    if linearization is None:
+        # For time-dependent problems
+        problem.set_params(params0)
+        problem.newton_update(sol0)
+        get_A_fn(problem, use_petsc=False)
+        linearization = Linearization(problem)
     # Construct terms for JVP calculation
     partial_fn_of_params = partial(residual, sol0)  # r(u=sol, p)
 
@@ -125,18 +133,15 @@ def implicit_jvp_helper(problem, sol0: Array,
     # dr/drho . v --> need a negative sign here - will provide later
     _, backward_rhs = jax.jvp(partial_fn_of_params,
                               (params0, ), (params_dot0, ))
-    # Call a JAX solver
-    precond_matrix = get_jacobi_precond(jacobi_preconditioner(problem))
-
-    def jax_solver_modified(matvec, v): return jax_solve(problem, matvec,
-                                                         v.reshape(-1), None,
-                                                         False,
-                                                         precond_matrix)
-    chosen_bb_solver = jax_solver_modified
+    # Solve with the saved tangent (matvec stays differentiable in u and p)
+    def solve(matvec, v): return linearization.solve(v.reshape(-1))
+
+    def transpose_solve(matvec, v): return linearization.solve(v.reshape(-1),
+                                                               transpose=True)
     # Find adjoint value
     tangent_out = jax.lax.custom_linear_solve(backward_matvec, -1*backward_rhs,
-                                              chosen_bb_solver,
-                                              transpose_solve=chosen_bb_solver)
+                                              solve,
+                                              transpose_solve=transpose_solve)
     return tangent_out
 
 
@@ -93,6 +93,95 @@ def get_elements(ele_type):
     return element_family, basix_ele, basix_face_ele, gauss_order, degree, re_order
 
 
+def get_gauss_order(ele_type, quadrature='default', mass=False):
+    """Order of the quadrature rule (the polynomial degree it integrates
+    exactly, as in basix.make_quadrature).
+
+    Parameters
+    ----------
+    ele_type : str
+    quadrature : str or int
+        'default': the order of get_elements
+        'exact': the minimal order that integrates the weak form exactly
+        on affine cells. For tensor product cells (u, v) and (grad_u, grad_v)
+        both need 2*degree, for simplices (grad_u, grad_v) only needs
+        2*(degree - 1) unless there is a mass term.
+        'reduced': one point less per direction than 'exact'
+        int: the order itself
+    mass : bool
+        If the weak form has a mass term
+
+    Returns
+    -------
+    gauss_order : int
+    """
+    (element_family, basix_ele, basix_face_ele, gauss_order, degree,
+     re_order) = get_elements(ele_type)
+    if quadrature == 'default':
+        return gauss_order
+    if isinstance(quadrature, (int, onp.integer)):
+        return int(quadrature)
+    simplex = basix_ele in [basix.CellType.triangle,
+                            basix.CellType.tetrahedron]
+    exact_order = 2*(degree - 1) if simplex and not mass else 2*degree
+    if quadrature == 'exact':
+        return exact_order
+    if quadrature == 'reduced':
+        return max(exact_order - 2, 0)
+    raise NotImplementedError(f"Unknown quadrature {quadrature}")
+
+
+def get_tensor_product_tables(ele_type, gauss_order=None):
+    """1D tables of a tensor product element for sum factorization.
+    The shape functions are products of 1D shape functions and the quadrature
+    rule is a product of 1D Gauss rules, so that the cell tables are never
+    formed.
+
+    Parameters
+    ----------
+    ele_type : str
+        'QUAD4', 'HEX8' or 'HEX27'
+    gauss_order : int
+        Order of the quadrature rule, the one of get_elements if None
+
+    Returns
+    -------
+    shape_vals_1d : ndarray
+        (num_quads_1d, num_nodes_1d)
+    shape_grads_1d : ndarray
+        (num_quads_1d, num_nodes_1d)
+    node_inds : ndarray
+        (num_nodes, dim) multi-index of each node in the tensor of nodes
+    quad_inds : ndarray
+        (num_quads, dim) multi-index of each quad point in the tensor of quad
+        points
+    """
+    assert ele_type in ['QUAD4', 'HEX8', 'HEX27'], \
+        f"{ele_type} is not a tensor product element"
+    (element_family, basix_ele, basix_face_ele, default_order, degree,
+     re_order) = get_elements(ele_type)
+    gauss_order = default_order if gauss_order is None else gauss_order
+    element = basix.create_element(element_family, basix_ele, degree)
+    element_1d = basix.create_element(element_family,
+                                      basix.CellType.interval, degree)
+    quad_points, _ = basix.make_quadrature(basix_ele, gauss_order)
+    quad_points_1d, _ = basix.make_quadrature(basix.CellType.interval,
+                                              gauss_order)
+
+    def get_multi_inds(points, points_1d):
+        # (num_points, dim, 1) - (1, 1, num_points_1d) -> (num_points, dim)
+        inds = onp.argmin(onp.abs(points[:, :, None] -
+                                  points_1d[None, None, :, 0]), axis=2)
+        assert onp.allclose(points_1d[inds, 0], points)
+        return inds
+
+    node_inds = get_multi_inds(element.points[re_order], element_1d.points)
+    quad_inds = get_multi_inds(quad_points, quad_points_1d)
+    vals_and_grads = element_1d.tabulate(1, quad_points_1d)
+    return (vals_and_grads[0, :, :, 0], vals_and_grads[1, :, :, 0],
+            node_inds, quad_inds)
+
+
 def reorder_inds(inds, re_order):
     new_inds = []
     for ind in inds.reshape(-1):
@@ -101,9 +190,15 @@ def reorder_inds(inds, re_order):
     return new_inds
 
 
-def get_shape_vals_and_grads(ele_type):
+def get_shape_vals_and_grads(ele_type, gauss_order=None):
     """TODO: Add comments
 
+    Parameters
+    ----------
+    ele_type : str
+    gauss_order : int
+        Order of the quadrature rule, the one of get_elements if None
+
     Returns
     -------
     shape_values: ndarray
@@ -113,7 +208,9 @@ def get_shape_vals_and_grads(ele_type):
     weights: ndarray
         (8,) = (num_quads,)
     """
-    element_family, basix_ele, basix_face_ele, gauss_order, degree, re_order = get_elements(ele_type)
+    (element_family, basix_ele, basix_face_ele, default_order, degree,
+     re_order) = get_elements(ele_type)
+    gauss_order = default_order if gauss_order is None else gauss_order
     quad_points, weights = basix.make_quadrature(basix_ele, gauss_order)
     element = basix.create_element(element_family, basix_ele, degree)
     vals_and_grads = element.tabulate(1, quad_points)[:, :, re_order, :]
@@ -123,9 +220,15 @@ def get_shape_vals_and_grads(ele_type):
     return shape_values, shape_grads_ref, weights
 
 
-def get_face_shape_vals_and_grads(ele_type):
+def get_face_shape_vals_and_grads(ele_type, gauss_order=None):
     """TODO: Add comments
 
+    Parameters
+    ----------
+    ele_type : str
+    gauss_order : int
+        Order of the face quadrature rule, the one of get_elements if None
+
     Returns
     -------
     face_shape_vals: ndarray
@@ -139,7 +242,9 @@ def get_face_shape_vals_and_grads(ele_type):
     face_inds: ndarray
         (6, 4) = (num_faces, num_face_vertices)
     """
-    element_family, basix_ele, basix_face_ele, gauss_order, degree, re_order = get_elements(ele_type)
+    (element_family, basix_ele, basix_face_ele, default_order, degree,
+     re_order) = get_elements(ele_type)
+    gauss_order = default_order if gauss_order is None else gauss_order
 
     # TODO: Check if this is correct.
     points, weights = basix.make_quadrature(basix_face_ele, gauss_order)
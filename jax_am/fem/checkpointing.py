@@ -0,0 +1,233 @@
+"""Reverse-mode differentiation of time stepping with binomial (revolve)
+checkpointing.
+
+get_checkpointed_rollout wraps a step function, e.g., one load or time step
+of a plasticity or thermal-mechanical simulation calling ad_wrapper, into a
+rollout with a custom VJP. The forward pass only keeps the states of a few
+steps (the checkpoints). The backward pass recomputes the states it needs
+from the closest checkpoint, placing new checkpoints on the way, so that n
+steps are reversed with s slots and about t forward recomputations per step
+whenever n <= binomial(s + t, s) (Griewank, Algorithm 799: revolve). With
+s ~ log2(n), the memory goes from O(n) to O(log n) states.
+
+Checkpoints are kept in memory up to num_memory_slots, further ones are
+written to disk. The disk checkpoints are removed by the backward pass, or
+when the store is garbage collected if the VJP is never pulled.
+"""
+import os
+import tempfile
+import weakref
+from math import comb
+
+import jax
+import jax.numpy as np
+import numpy as onp
+
+from jax_am import logger
+
+
+def num_repetitions(num_steps, num_slots):
+    """Smallest t with binomial(num_slots + t, t) >= num_steps"""
+    if num_slots == 0:
+        return max(num_steps - 1, 0)
+    t = 0
+    while comb(num_slots + t, t) < num_steps:
+        t += 1
+    return t
+
+
+def get_split(num_steps, num_slots):
+    """Number of steps to advance before placing the next checkpoint, so
+    that the remaining steps are reversed with num_slots - 1 slots and the
+    advanced ones with num_slots, both with the fewest repetitions.
+    """
+    t = num_repetitions(num_steps, num_slots)
+    num_right = min(comb(num_slots - 1 + t, t), num_steps - 1)
+    return num_steps - num_right
+
+
+def remove_disk_checkpoints(disk, temp_dirs):
+    """Delete the checkpoint files and the temporary directories holding
+    them. Also the finalizer of CheckpointStore, so it must not refer to the
+    store.
+    """
+    for file_path, _ in disk.values():
+        if os.path.exists(file_path):
+            os.remove(file_path)
+    disk.clear()
+    for temp_dir in temp_dirs:
+        if os.path.isdir(temp_dir):
+            os.rmdir(temp_dir)
+    temp_dirs.clear()
+
+
+@jax.tree_util.register_pytree_node_class
+class CheckpointStore:
+    """States of the rollout by step, in memory or on disk.
+
+    It is an opaque pytree without leaves, so that it can be a residual of
+    jax.custom_vjp.
+
+    Parameters
+    ----------
+    num_memory_slots : int
+        Checkpoints kept in memory, further ones are saved in disk_dir
+    disk_dir : str
+        Directory of the checkpoints on disk, a temporary one if None
+    """
+
+    def __init__(self, num_memory_slots, disk_dir=None):
+        self.num_memory_slots = num_memory_slots
+        self.disk_dir = disk_dir
+        self.memory = {}
+        self.disk = {}
+        self.temp_dirs = []
+        self.max_num_stored = 0
+        # The disk and temp_dirs containers are only mutated in place, so the
+        # finalizer sees the files left when the store is collected
+        weakref.finalize(self, remove_disk_checkpoints, self.disk,
+                         self.temp_dirs)
+
+    def tree_flatten(self):
+        return (), self
+
+    @classmethod
+    def tree_unflatten(cls, aux_data, children):
+        return aux_data
+
+    def __contains__(self, step):
+        return step in self.memory or step in self.disk
+
+    def __len__(self):
+        return len(self.memory) + len(self.disk)
+
+    def save(self, step, state):
+        if len(self.memory) < self.num_memory_slots:
+            self.memory[step] = state
+        else:
+            if self.disk_dir is None:
+                self.disk_dir = tempfile.mkdtemp(prefix='jax_am_checkpoints_')
+                self.temp_dirs.append(self.disk_dir)
+            leaves, treedef = jax.tree_util.tree_flatten(state)
+            file_path = os.path.join(self.disk_dir, f"step_{step:06d}.npz")
+            onp.savez(file_path, *[onp.asarray(x) for x in leaves])
+            self.disk[step] = (file_path, treedef)
+            logger.debug(f"Checkpoint of step {step} saved to {file_path}")
+        self.max_num_stored = max(self.max_num_stored, len(self))
+
+    def load(self, step):
+        if step in self.memory:
+            return self.memory[step]
+        file_path, treedef = self.disk[step]
+        with onp.load(file_path) as data:
+            leaves = [np.asarray(data[f"arr_{i}"])
+                      for i in range(len(data.files))]
+        return jax.tree_util.tree_unflatten(treedef, leaves)
+
+    def delete(self, step):
+        if step in self.memory:
+            del self.memory[step]
+        else:
+            file_path, _ = self.disk.pop(step)
+            os.remove(file_path)
+
+    def clear(self):
+        self.memory = {}
+        if self.disk_dir in self.temp_dirs:
+            self.disk_dir = None
+        remove_disk_checkpoints(self.disk, self.temp_dirs)
+
+
+def get_checkpointed_rollout(step_fn, num_steps, num_slots=None,
+                             num_memory_slots=None, disk_dir=None):
+    """Rollout of num_steps steps, reverse-mode differentiable with
+    binomial checkpointing.
+
+    Parameters
+    ----------
+    step_fn : Callable
+        step_fn(state, params, step) -> state, where state and params are
+        pytrees of arrays. Must be differentiable with jax.vjp, but is
+        called eagerly, so it may run FEM solves (e.g., through ad_wrapper).
+        Objectives summed over the steps can be accumulated in the state.
+    num_slots : int
+        Checkpoints stored at the same time, besides the initial state.
+        Defaults to ceil(log2(num_steps)).
+    num_memory_slots : int
+        Checkpoints kept in memory, the others are saved on disk. Defaults
+        to num_slots (all in memory).
+    disk_dir : str
+        Directory of the checkpoints on disk
+
+    Returns
+    -------
+    rollout : Callable
+        rollout(state, params) -> state after num_steps steps
+    """
+    if num_slots is None:
+        num_slots = max(1, int(onp.ceil(onp.log2(max(num_steps, 2)))))
+    if num_memory_slots is None:
+        num_memory_slots = num_slots
+    logger.debug(f"Checkpointed rollout of {num_steps} steps with {num_slots} "
+                 f"slots, {num_repetitions(num_steps, num_slots)} repetitions")
+
+    def advance(state, params, start, end):
+        for step in range(start, end):
+            state = step_fn(state, params, step)
+        return state
+
+    @jax.custom_vjp
+    def rollout(state, params):
+        return advance(state, params, 0, num_steps)
+
+    def rollout_fwd(state, params):
+        # The forward sweep places the first checkpoints of the reversal
+        store = CheckpointStore(num_memory_slots + 1, disk_dir)
+        store.save(0, state)
+        start, slots = 0, num_slots
+        while num_steps - start > 1 and slots > 0:
+            mid = start + get_split(num_steps - start, slots)
+            state = advance(state, params, start, mid)
+            store.save(mid, state)
+            start, slots = mid, slots - 1
+        state = advance(state, params, start, num_steps)
+        return state, (params, store)
+
+    def rollout_bwd(res, ct_state):
+        params, store = res
+        ct_params = jax.tree_util.tree_map(np.zeros_like, params)
+
+        def reverse(start, end, slots, ct_state, ct_params):
+            """Backpropagate ct_state through steps [start, end), the state
+            of step start being in the store.
+            """
+            while end - start > 1 and slots > 0:
+                mid = start + get_split(end - start, slots)
+                if mid not in store:
+                    store.save(mid, advance(store.load(start), params,
+                                            start, mid))
+                ct_state, ct_params = reverse(mid, end, slots - 1, ct_state,
+                                              ct_params)
+                store.delete(mid)
+                end = mid
+            # No slot left: recompute each state from the start of the segment
+            for step in reversed(range(start, end)):
+                state = advance(store.load(start), params, start, step)
+                _, step_vjp = jax.vjp(lambda s, p: step_fn(s, p, step),
+                                      state, params)
+                ct_state, ct_params_step = step_vjp(ct_state)
+                ct_params = jax.tree_util.tree_map(lambda x, y: x + y,
+                                                   ct_params, ct_params_step)
+            return ct_state, ct_params
+
+        try:
+            ct_state, ct_params = reverse(0, num_steps, num_slots, ct_state,
+                                          ct_params)
+        finally:
+            logger.debug(f"At most {store.max_num_stored - 1} checkpoints "
+                         f"were stored besides the initial state")
+            store.clear()
+        return ct_state, ct_params
+
+    rollout.defvjp(rollout_fwd, rollout_bwd)
+    return rollout
@@ -6,11 +6,15 @@ import time
 import functools
 from dataclasses import dataclass
 from typing import Any, Callable, Optional, List, Union
+from scipy.spatial import cKDTree
 
 from jax_am.common import timeit
 from jax_am.fem.generate_mesh import Mesh
-from jax_am.fem.basis import get_face_shape_vals_and_grads, get_shape_vals_and_grads
+from jax_am.fem.basis import (get_face_shape_vals_and_grads,
+                              get_shape_vals_and_grads, get_gauss_order,
+                              get_tensor_product_tables)
 from jax_am.fem.autodiff_utils import jax_array_list_to_numpy_diff
+from jax_am.fem import kernel_registry
 from jax.config import config
 from jax_am import logger
 
@@ -79,6 +83,51 @@ class FEM:
         A function that inputs a point and returns the body force at this point
     additional_info : Any
         Other information that the FEM solver should know
+    batch_memory_budget : float
+        Approximate memory [bytes] used by one batch of cell kernel
+        evaluations. Small problems run in a single batch, large ones are
+        split so that the cell Jacobians do not run out of memory.
+    geometry_mode : str
+        Storage of the geometric factors of the cell kernel, from most memory
+        to most recomputation:
+        'full': shape_grads and v_grads_JxW at every quadrature point
+        'jacobian': inverse Jacobians and JxW, the physical shape function
+        gradients are recomputed in the kernel
+        'points': nothing, the kernel recomputes everything from the cell
+        coordinates
+        'unique': one 'full' copy per distinct cell shape (up to a
+        translation), for structured meshes such as those of box_mesh
+        JxW is kept in every mode. shape_grads and v_grads_JxW stay available
+        as attributes and are built on first access if they are not stored.
+    quadrature : str or int
+        Quadrature rule of cells and faces, see basis.get_gauss_order:
+        'default', 'exact' (minimal order exact for the weak form), 'reduced'
+        or an explicit order. Faces use the order of a weak form with a mass
+        term, which Neumann and Cauchy terms are. 'default' keeps the orders
+        of basis.get_elements. For selective integration, a child class can
+        define get_reduced_tensor_map (u_grad -> stress, no internal
+        variables), whose term is integrated with the 'reduced' rule and added
+        to the one of get_tensor_map, e.g., the volumetric part of the stress
+        of a nearly incompressible material.
+    assembly_backend : str
+        How cell contributions are summed into nodal vectors:
+        'scatter': scatter-add over the connectivity
+        'gather': gather with a node-to-(cell, local node) table computed once
+        per connectivity, padded to the largest number of cells per node,
+        then a sum over the table rows. No scatter (atomic adds on GPU) is
+        involved and the summation order is fixed by the table, so
+        residuals are bit-reproducible from run to run.
+    sum_factorization : bool
+        Evaluate the laplace term of tensor product elements (QUAD4, HEX8,
+        HEX27) with sum factorization: gradients at the quad points are
+        contracted one direction at a time with 1D tables, in O(p^(dim+1))
+        instead of O(p^(2*dim)) per cell. Requires geometry_mode 'jacobian'
+        or 'points'.
+    external_faces_only : bool
+        Search the faces of Neumann and Cauchy B.C. among the external faces
+        of the mesh only (see Mesh.get_external_faces) instead of every face
+        of every cell. Faster, but location functions can no longer select
+        internal interfaces, e.g., between two materials.
     """
     mesh: Mesh
     vec: int
@@ -90,6 +139,28 @@ class FEM:
     cauchy_bc_info: Optional[List[Union[List[Callable], List[Callable]]]] = None
     source_info: Callable = None
     additional_info: Any = ()
+    batch_memory_budget: float = 2.**30
+    geometry_mode: str = 'full'
+    quadrature: Union[str, int] = 'default'
+    assembly_backend: str = 'scatter'
+    sum_factorization: bool = False
+    external_faces_only: bool = False
+
+    # If True, jitted kernels are shared with other instances of the same class
+    # through jax_am.fem.kernel_registry. Only safe if get_tensor_map and
+    # get_mass_map read no instance arrays other than through internal_vars.
+    # Not inherited: a subclass must set it again after checking its own maps.
+    # Kernels keyed on arrays of kernel_state_attrs stay on the instance.
+    share_kernels = False
+
+    # Attributes read by the kernels from their closure (e.g., in
+    # get_tensor_map) that may be reassigned after the first solve, e.g.,
+    # ('H_bar',) or ('dt',). They are part of the kernel cache key, see
+    # get_kernel_cache_key. Other attributes are assumed constant.
+    kernel_state_attrs = ()
+
+    # Jitted kernels kept on an instance, the oldest one is dropped first
+    max_kernel_cache_size = 16
 
     def __post_init__(self):
         self.points = self.mesh.points
@@ -101,25 +172,26 @@ class FEM:
         start = time.time()
         logger.debug(f"Computing shape function values, gradients, etc.")
 
+        self.gauss_order = get_gauss_order(self.ele_type, self.quadrature,
+                                           hasattr(self, 'get_mass_map'))
         self.shape_vals, self.shape_grads_ref, self.quad_weights = get_shape_vals_and_grads(
-            self.ele_type)
+            self.ele_type, self.gauss_order)
+        # Neumann and Cauchy terms are mass-like: (traction, v) * ds
+        self.face_gauss_order = get_gauss_order(self.ele_type,
+                                                self.quadrature, True)
         self.face_shape_vals, self.face_shape_grads_ref, self.face_quad_weights, self.face_normals, self.face_inds \
-        = get_face_shape_vals_and_grads(self.ele_type)
+        = get_face_shape_vals_and_grads(self.ele_type, self.face_gauss_order)
         self.num_quads = self.shape_vals.shape[0]
         self.num_nodes = self.shape_vals.shape[1]
         self.num_faces = self.face_shape_vals.shape[0]
-        self.shape_grads, self.JxW = self.get_shape_grads()
+        self.compute_geometry_storage()
+        self.compute_reduced_geometry()
 
         self.node_inds_list, self.vec_inds_list, self.vals_list = self.Dirichlet_boundary_conditions(
             self.dirichlet_bc_info)
         self.p_node_inds_list_A, self.p_node_inds_list_B, self.p_vec_inds_list = self.periodic_boundary_conditions(
         )
 
-        # (num_cells, num_quads, num_nodes, 1, dim)
-        self.v_grads_JxW = self.shape_grads[:, :, :,
-                                            None, :] * self.JxW[:, :, None,
-                                                                None, None]
-
         end = time.time()
         compute_time = end - start
 
@@ -138,26 +210,39 @@ class FEM:
         """
         pass
 
-    def get_shape_grads(self):
+    def get_cell_geometry(self, physical_coos, shape_grads_ref=None,
+                          quad_weights=None):
         """Compute shape function gradient value
         The gradient is w.r.t physical coordinates.
         See Hughes, Thomas JR. The finite element method: linear static and dynamic finite element analysis. Courier Corporation, 2012.
         Page 147, Eq. (3.9.3)
 
+        Parameters
+        ----------
+        physical_coos : onp.ndarray
+            (num_selected_cells, num_nodes, dim)
+        shape_grads_ref : onp.ndarray
+            (num_quads, num_nodes, dim) of another quadrature rule, the one of
+            the problem if None
+        quad_weights : onp.ndarray
+            (num_quads,) weights of that rule
+
         Returns
         -------
         shape_grads_physical : onp.ndarray
-            (num_cells, num_quads, num_nodes, dim)
+            (num_selected_cells, num_quads, num_nodes, dim)
         JxW : onp.ndarray
-            (num_cells, num_quads)
+            (num_selected_cells, num_quads)
+        jacobian_deta_dx : onp.ndarray
+            (num_selected_cells, num_quads, dim, dim)
         """
-        assert self.shape_grads_ref.shape == (self.num_quads, self.num_nodes,
-                                              self.dim)
-        physical_coos = onp.take(self.points, self.cells,
-                                 axis=0)  # (num_cells, num_nodes, dim)
+        if shape_grads_ref is None:
+            shape_grads_ref = self.shape_grads_ref
+            quad_weights = self.quad_weights
+        assert shape_grads_ref.shape[1:] == (self.num_nodes, self.dim)
         # (num_cells, num_quads, num_nodes, dim, dim) -> (num_cells, num_quads, 1, dim, dim)
         jacobian_dx_deta = onp.sum(physical_coos[:, None, :, :, None] *
-                                   self.shape_grads_ref[None, :, :, None, :],
+                                   shape_grads_ref[None, :, :, None, :],
                                    axis=2,
                                    keepdims=True)
         jacobian_det = onp.linalg.det(
@@ -165,11 +250,230 @@ class FEM:
         jacobian_deta_dx = onp.linalg.inv(jacobian_dx_deta)
         # (1, num_quads, num_nodes, 1, dim) @ (num_cells, num_quads, 1, dim, dim)
         # (num_cells, num_quads, num_nodes, 1, dim) -> (num_cells, num_quads, num_nodes, dim)
-        shape_grads_physical = (self.shape_grads_ref[None, :, :, None, :]
+        shape_grads_physical = (shape_grads_ref[None, :, :, None, :]
                                 @ jacobian_deta_dx)[:, :, :, 0, :]
-        JxW = jacobian_det * self.quad_weights[None, :]
+        JxW = jacobian_det * quad_weights[None, :]
+        return shape_grads_physical, JxW, jacobian_deta_dx[:, :, 0, :, :]
+
+    def get_shape_grads(self):
+        """Shape function gradients w.r.t. physical coordinates of all cells
+
+        Returns
+        -------
+        shape_grads_physical : onp.ndarray
+            (num_cells, num_quads, num_nodes, dim)
+        JxW : onp.ndarray
+            (num_cells, num_quads)
+        """
+        physical_coos = onp.take(self.points, self.cells,
+                                 axis=0)  # (num_cells, num_nodes, dim)
+        shape_grads_physical, JxW, _ = self.get_cell_geometry(physical_coos)
         return shape_grads_physical, JxW
 
+    def compute_geometry_storage(self):
+        """Compute the geometric factors kept for the cell kernel, according
+        to self.geometry_mode.
+
+        Sets
+        ----
+        JxW : onp.ndarray
+            (num_cells, num_quads)
+        geometry_storage : List[onp.ndarray]
+            'full': [shape_grads, JxW, v_grads_JxW] of all cells
+            'jacobian': [jacobian_deta_dx, JxW] of all cells
+            'points': []
+            'unique': [shape_grads, JxW, v_grads_JxW] of the distinct cell
+            shapes, with cell_shape_ids (num_cells,) pointing into them
+        geometry_cache : dict
+            Emptied, see get_full_geometry
+        """
+        assert self.geometry_mode in ('full', 'jacobian', 'points',
+                                      'unique'), \
+            f"Unknown geometry_mode {self.geometry_mode}"
+        assert (not self.sum_factorization or
+                self.geometry_mode in ('jacobian', 'points')), \
+            f"sum_factorization requires geometry_mode 'jacobian' or 'points'"
+        physical_coos = onp.take(self.points, self.cells,
+                                 axis=0)  # (num_cells, num_nodes, dim)
+        self.geometry_cache = {}
+        if self.geometry_mode == 'unique':
+            # Cells are compared after moving their first node to the origin
+            rel_coos = physical_coos - physical_coos[:, :1, :]
+            scale = max(onp.max(onp.abs(rel_coos)), onp.finfo(float).tiny)
+            keys = onp.round(rel_coos / scale * 1e8).reshape(self.num_cells,
+                                                             -1)
+            _, rep_inds, self.cell_shape_ids = onp.unique(
+                keys, axis=0, return_index=True, return_inverse=True)
+            self.cell_shape_ids = self.cell_shape_ids.reshape(-1)
+            logger.debug(f"{len(rep_inds)} distinct cell shapes")
+            physical_coos = physical_coos[rep_inds]
+
+        shape_grads, JxW, jacobian_deta_dx = self.get_cell_geometry(
+            physical_coos)
+        if self.geometry_mode in ('full', 'unique'):
+            # (num_cells, num_quads, num_nodes, 1, dim)
+            v_grads_JxW = shape_grads[:, :, :, None, :] * JxW[:, :, None,
+                                                              None, None]
+            self.geometry_storage = [shape_grads, JxW, v_grads_JxW]
+        elif self.geometry_mode == 'jacobian':
+            self.geometry_storage = [jacobian_deta_dx, JxW]
+        else:
+            self.geometry_storage = []
+
+        if self.geometry_mode == 'unique':
+            JxW = JxW[self.cell_shape_ids]
+        self.JxW = JxW
+
+    def compute_reduced_geometry(self):
+        """Geometric factors of the 'reduced' quadrature rule, used by the
+        selective integration of get_reduced_tensor_map. They are kept per
+        cell whatever the geometry_mode.
+
+        Sets
+        ----
+        reduced_geometry : List[onp.ndarray]
+            [shape_grads (num_cells, num_reduced_quads, num_nodes, dim),
+            v_grads_JxW (num_cells, num_reduced_quads, num_nodes, 1, dim)],
+            empty without get_reduced_tensor_map
+        """
+        self.reduced_geometry = []
+        if hasattr(self, 'get_reduced_tensor_map'):
+            _, shape_grads_ref, quad_weights = get_shape_vals_and_grads(
+                self.ele_type, get_gauss_order(self.ele_type, 'reduced'))
+            physical_coos = onp.take(self.points, self.cells, axis=0)
+            shape_grads, JxW, _ = self.get_cell_geometry(
+                physical_coos, shape_grads_ref, quad_weights)
+            v_grads_JxW = shape_grads[:, :, :, None, :] * JxW[:, :, None, None,
+                                                              None]
+            self.reduced_geometry = [shape_grads, v_grads_JxW]
+            logger.debug(f"Selective integration with {len(quad_weights)} "
+                         f"reduced quad points")
+
+    def get_geometry_inputs(self, inds):
+        """Geometry inputs of the cell kernel for a subset of cells.
+        Arrays not stored by the current geometry_mode are built for these
+        cells only.
+
+        Parameters
+        ----------
+        inds : slice or onp.ndarray
+            Cell indices
+
+        Returns
+        -------
+        geometry_inputs : List[onp.ndarray]
+            Arrays with a leading cell axis, see get_cell_geometry_fn,
+            followed by those of reduced_geometry
+        """
+        reduced_inputs = [x[inds] for x in self.reduced_geometry]
+        if self.geometry_mode == 'unique':
+            shape_ids = self.cell_shape_ids[inds]
+            return ([x[shape_ids] for x in self.geometry_storage] +
+                    reduced_inputs)
+        if self.geometry_mode == 'points':
+            return ([onp.take(self.points, self.cells[inds], axis=0)] +
+                    reduced_inputs)
+        return [x[inds] for x in self.geometry_storage] + reduced_inputs
+
+    def get_cell_geometry_fn(self):
+        """Map the geometry inputs of one cell to (cell_shape_grads, cell_JxW,
+        cell_v_grads_JxW) inside the kernel.
+
+        Returns
+        -------
+        geometry_fn : Callable
+        """
+
+        if self.sum_factorization:
+            ref_grad_fn, _ = self.get_sum_factorization_fns()
+
+            def from_inverse_jacobians(jacobian_deta_dx, JxW):
+                # The sum factorized laplace kernel only needs the inverse
+                # Jacobians
+                return jacobian_deta_dx, JxW, None
+        else:
+            def from_inverse_jacobians(jacobian_deta_dx, JxW):
+                # (num_quads, num_nodes, 1, dim) @ (num_quads, 1, dim, dim)
+                # -> (num_quads, num_nodes, dim)
+                shape_grads = (self.shape_grads_ref[:, :, None, :]
+                               @ jacobian_deta_dx[:, None, :, :])[:, :, 0, :]
+                v_grads_JxW = (shape_grads[:, :, None, :] *
+                               JxW[:, None, None, None])
+                return shape_grads, JxW, v_grads_JxW
+
+        def from_coos(cell_coos):
+            if self.sum_factorization:
+                jacobian_dx_deta = ref_grad_fn(cell_coos)
+            else:
+                # (1, num_nodes, dim, 1) * (num_quads, num_nodes, 1, dim)
+                # -> (num_quads, dim, dim)
+                jacobian_dx_deta = np.sum(cell_coos[None, :, :, None] *
+                                          self.shape_grads_ref[:, :, None, :],
+                                          axis=1)
+            JxW = np.linalg.det(jacobian_dx_deta) * self.quad_weights
+            return from_inverse_jacobians(np.linalg.inv(jacobian_dx_deta), JxW)
+
+        if self.geometry_mode == 'jacobian':
+            return from_inverse_jacobians
+        if self.geometry_mode == 'points':
+            return from_coos
+        return lambda *geometry_inputs: tuple(geometry_inputs)
+
+    def get_full_geometry(self, name):
+        """shape_grads or v_grads_JxW of all cells for the compact geometry
+        modes. Built on first access and kept in geometry_cache for the
+        current geometry_mode, so that repeated accesses (e.g., in
+        post-processing) do not rebuild them, at the memory cost of the
+        'full' mode.
+        """
+        key = (self.geometry_mode, name)
+        if key not in self.geometry_cache:
+            logger.debug(f"Building {name} of all cells for geometry_mode "
+                         f"{self.geometry_mode}")
+            if name == 'shape_grads' and self.geometry_mode == 'unique':
+                val = self.geometry_storage[0][self.cell_shape_ids]
+            elif name == 'shape_grads' and self.geometry_mode == 'jacobian':
+                jacobian_deta_dx = self.geometry_storage[0]
+                val = (self.shape_grads_ref[None, :, :, None, :]
+                       @ jacobian_deta_dx[:, :, None, :, :])[:, :, :, 0, :]
+            elif name == 'shape_grads':
+                val = self.get_shape_grads()[0]
+            elif self.geometry_mode == 'unique':
+                val = self.geometry_storage[2][self.cell_shape_ids]
+            else:
+                val = self.shape_grads[:, :, :, None, :] * self.JxW[:, :, None,
+                                                                    None, None]
+            self.geometry_cache[key] = val
+        return self.geometry_cache[key]
+
+    @property
+    def shape_grads(self):
+        """(num_cells, num_quads, num_nodes, dim) physical shape function
+        gradients, see get_full_geometry unless geometry_mode is 'full'.
+        """
+        if self.geometry_mode == 'full':
+            return self.geometry_storage[0]
+        return self.get_full_geometry('shape_grads')
+
+    @shape_grads.setter
+    def shape_grads(self, val):
+        raise AttributeError(f"shape_grads is derived from geometry_storage "
+                             f"and cannot be assigned")
+
+    @property
+    def v_grads_JxW(self):
+        """(num_cells, num_quads, num_nodes, 1, dim), see get_full_geometry
+        unless geometry_mode is 'full'.
+        """
+        if self.geometry_mode == 'full':
+            return self.geometry_storage[2]
+        return self.get_full_geometry('v_grads_JxW')
+
+    @v_grads_JxW.setter
+    def v_grads_JxW(self, val):
+        raise AttributeError(f"v_grads_JxW is derived from geometry_storage "
+                             f"and cannot be assigned")
+
     def get_face_shape_grads(self, boundary_inds):
         """Face shape function gradients and JxW (for surface integral)
         Nanson's formula is used to map physical surface ingetral to reference domain
@@ -266,6 +570,121 @@ class FEM:
             axis=2)
         return physical_surface_quad_points
 
+    def get_face_geometry(self, boundary_inds, cache_key):
+        """Geometry of a subset of boundary faces. It only depends on the mesh,
+        so it is computed once and reused by every residual and Jacobian
+        evaluation. The entry is recomputed if the subset stored under
+        cache_key is replaced by a different array (e.g., a moving boundary).
+
+        Parameters
+        ----------
+        boundary_inds : onp.ndarray
+            (num_selected_faces, 2)
+        cache_key : tuple
+            e.g., ('neumann', i) for the ith Neumann subset
+
+        Returns
+        -------
+        face_geo : dict
+            'quad_points': (num_selected_faces, num_face_quads, dim)
+            'nanson_scale': (num_selected_faces, num_face_quads)
+            'shape_vals': (num_selected_faces, num_face_quads, num_nodes)
+            'cells': (num_selected_faces, num_nodes)
+        """
+        if not hasattr(self, 'face_geometry_cache'):
+            self.face_geometry_cache = {}
+        face_geo = self.face_geometry_cache.get(cache_key)
+        if face_geo is None or face_geo['boundary_inds'] is not boundary_inds:
+            logger.debug(f"Computing face geometry of {cache_key}...")
+            _, nanson_scale = self.get_face_shape_grads(boundary_inds)
+            face_geo = {
+                'boundary_inds': boundary_inds,
+                'quad_points':
+                self.get_physical_surface_quad_points(boundary_inds),
+                'nanson_scale': nanson_scale,
+                'shape_vals': self.face_shape_vals[boundary_inds[:, 1]],
+                'cells': self.cells[boundary_inds[:, 0]]
+            }
+            self.face_geometry_cache[cache_key] = face_geo
+        return face_geo
+
+    def get_gather_table(self, cells, cache_key):
+        """Node-to-(cell, local node) incidence table of a connectivity array,
+        padded to the largest number of cells sharing a node. Cached like
+        get_face_geometry.
+
+        Parameters
+        ----------
+        cells : onp.ndarray
+            (num_selected_cells, num_nodes)
+        cache_key : Any
+            e.g., 'cells' or ('neumann', i)
+
+        Returns
+        -------
+        table : onp.ndarray
+            (num_total_nodes, max_valence) positions in cells.reshape(-1) of
+            each node, in increasing order. Padding entries are
+            num_selected_cells*num_nodes, the position of a zero row.
+        """
+        if not hasattr(self, 'gather_tables'):
+            self.gather_tables = {}
+        entry = self.gather_tables.get(cache_key)
+        if entry is None or (entry['cells'] is not cells and
+                             not onp.array_equal(entry['cells'], cells)):
+            logger.debug(f"Computing gather table of {cache_key}...")
+            flat_cells = onp.asarray(cells).reshape(-1)
+            order = onp.argsort(flat_cells, kind='stable')
+            counts = onp.bincount(flat_cells, minlength=self.num_total_nodes)
+            starts = onp.cumsum(counts) - counts
+            node_inds = flat_cells[order]
+            ranks = onp.arange(len(order)) - starts[node_inds]
+            table = onp.full((self.num_total_nodes, max(counts.max(), 1)),
+                             len(order))
+            table[node_inds, ranks] = order
+            entry = {'cells': cells, 'table': table}
+            self.gather_tables[cache_key] = entry
+        return entry['table']
+
+    def assemble_nodal(self, vals, cells, cache_key='cells'):
+        """Sum cell contributions into a nodal vector.
+
+        Parameters
+        ----------
+        vals : np.DeviceArray
+            (num_selected_cells, num_nodes, vec) or
+            (num_selected_cells*num_nodes, vec)
+        cells : onp.ndarray
+            (num_selected_cells, num_nodes)
+        cache_key : Any
+            Key of the gather table of cells
+
+        Returns
+        -------
+        nodal_vals : np.DeviceArray
+            (num_total_nodes, vec)
+        """
+        vals = vals.reshape(-1, self.vec)
+        if self.assembly_backend == 'gather':
+            table = self.get_gather_table(cells, cache_key)
+            vals = np.concatenate((vals, np.zeros((1, self.vec),
+                                                  dtype=vals.dtype)))
+            # (num_total_nodes, max_valence, vec) -> (num_total_nodes, vec)
+            return np.sum(vals[table], axis=1)
+        assert self.assembly_backend == 'scatter', \
+            f"Unknown assembly_backend {self.assembly_backend}"
+        nodal_vals = np.zeros((self.num_total_nodes, self.vec),
+                              dtype=vals.dtype)
+        return nodal_vals.at[cells.reshape(-1)].add(vals)
+
+    def get_cauchy_boundary_inds_list(self):
+        """Faces of the Cauchy B.C., located once and cached."""
+        if not hasattr(self, 'cauchy_boundary_inds_list'):
+            location_fns, _ = self.cauchy_bc_info
+            self.cauchy_boundary_inds_list = self.get_boundary_conditions_inds(
+                location_fns)
+        return self.cauchy_boundary_inds_list
+
     def Dirichlet_boundary_conditions(self, dirichlet_bc_info):
         """Indices and values for Dirichlet B.C.
 
@@ -313,6 +732,18 @@ class FEM:
             dirichlet_bc_info)
 
     def periodic_boundary_conditions(self):
+        """Pair the nodes of each periodic boundary A with their images on B.
+        All nodes of A are mapped at once and looked up in a k-d tree built
+        on the nodes of B.
+
+        Returns
+        -------
+        p_node_inds_list_A, p_node_inds_list_B : List[onp.ndarray]
+            (num_selected_nodes,) node p_node_inds_list_A[k][j] is mapped to
+            node p_node_inds_list_B[k][j]
+        p_vec_inds_list : List[onp.ndarray]
+            (num_selected_nodes,)
+        """
         p_node_inds_list_A = []
         p_node_inds_list_B = []
         p_vec_inds_list = []
@@ -327,30 +758,45 @@ class FEM:
                 points_set_B = self.mesh.points[node_inds_B]
 
                 EPS = 1e-5
-                node_inds_B_ordered = []
-                for node_ind in node_inds_A:
-                    point_A = self.mesh.points[node_ind]
-                    dist = onp.linalg.norm(mappings[i](point_A)[None, :] -
-                                           points_set_B,
-                                           axis=-1)
-                    node_ind_B_ordered = node_inds_B[onp.argwhere(
-                        dist < EPS)].reshape(-1)
-                    node_inds_B_ordered.append(node_ind_B_ordered)
-
-                node_inds_B_ordered = onp.array(node_inds_B_ordered).reshape(
-                    -1)
+                mapped_points_A = onp.array(
+                    jax.vmap(mappings[i])(points_set_A))
+                dist, inds = cKDTree(points_set_B).query(
+                    mapped_points_A, distance_upper_bound=EPS)
+
+                unmatched = onp.isinf(dist)
+                assert not onp.any(unmatched), \
+                    (f"Periodic B.C. {i}: {onp.sum(unmatched)} of "
+                     f"{len(node_inds_A)} nodes on boundary A have no image "
+                     f"on boundary B within "
+                     f"{EPS}, e.g., node {node_inds_A[unmatched][0]} at "
+                     f"{points_set_A[unmatched][0]} is mapped to "
+                     f"{mapped_points_A[unmatched][0]}")
+                unique_inds, counts = onp.unique(inds, return_counts=True)
+                assert onp.all(counts == 1), \
+                    (f"Periodic B.C. {i}: {onp.sum(counts > 1)} nodes on "
+                     f"boundary B are the image of several nodes on boundary "
+                     f"A, e.g., node "
+                     f"{node_inds_B[unique_inds[counts > 1][0]]}")
+                if len(node_inds_B) != len(node_inds_A):
+                    logger.warning(
+                        f"Periodic B.C. {i}: "
+                        f"{len(node_inds_B) - len(node_inds_A)} nodes on "
+                        f"boundary B are not the image of any node on "
+                        f"boundary A")
+
+                node_inds_B_ordered = node_inds_B[inds]
                 vec_inds = onp.ones_like(node_inds_A,
                                          dtype=onp.int32) * vecs[i]
 
                 p_node_inds_list_A.append(node_inds_A)
                 p_node_inds_list_B.append(node_inds_B_ordered)
                 p_vec_inds_list.append(vec_inds)
-                assert len(node_inds_A) == len(node_inds_B_ordered)
 
         return p_node_inds_list_A, p_node_inds_list_B, p_vec_inds_list
 
     def get_boundary_conditions_inds(self, location_fns):
         """Given location functions, compute which faces satisfy the condition.
+        With external_faces_only, only the external faces are tested.
 
         Parameters
         ----------
@@ -365,11 +811,19 @@ class FEM:
             boundary_inds_list[k][i, 0] returns the global cell index of the ith selected face of boundary subset k
             boundary_inds_list[k][i, 1] returns the local face index of the ith selected face of boundary subset k
         """
-        cell_points = onp.take(self.points, self.cells,
-                               axis=0)  # (num_cells, num_nodes, dim)
-        cell_face_points = onp.take(
-            cell_points, self.face_inds,
-            axis=1)  # (num_cells, num_faces, num_face_nodes, dim)
+        if self.external_faces_only:
+            faces = self.mesh.get_external_faces(
+                self.ele_type)  # (num_external_faces, 2)
+        else:
+            # (num_cells*num_faces, 2)
+            faces = onp.argwhere(onp.ones((self.num_cells, self.num_faces),
+                                          dtype=bool))
+        face_nodes = onp.asarray(self.cells)[
+            faces[:, 0][:, None],
+            self.face_inds[faces[:, 1]]]  # (num_tested_faces, num_face_nodes)
+        face_points = onp.take(
+            self.points, face_nodes,
+            axis=0)  # (num_tested_faces, num_face_nodes, dim)
         boundary_inds_list = []
         for i in range(len(location_fns)):
             vmap_location_fn = jax.vmap(location_fns[i])
@@ -378,10 +832,12 @@ class FEM:
                 boundary_flag = vmap_location_fn(cell_points)
                 return onp.all(boundary_flag)
 
-            vvmap_on_boundary = jax.vmap(jax.vmap(on_boundary))
-            boundary_flags = vvmap_on_boundary(cell_face_points)
-            boundary_inds = onp.argwhere(
-                boundary_flags)  # (num_selected_faces, 2)
+            # The flags only depend on the mesh, evaluate them eagerly even
+            # when called from a jitted solver.
+            with jax.ensure_compile_time_eval():
+                boundary_flags = jax.vmap(on_boundary)(face_points)
+            boundary_inds = faces[onp.asarray(
+                boundary_flags)]  # (num_selected_faces, 2)
             boundary_inds_list.append(boundary_inds)
         return boundary_inds_list
 
@@ -400,31 +856,26 @@ class FEM:
                     int_vars = internal_vars['neumann'][i]
                 else:
                     int_vars = ()
-                # (num_cells, num_faces, num_face_quads, dim) -> (num_selected_faces, num_face_quads, dim)
-                subset_quad_points = self.get_physical_surface_quad_points(
-                    boundary_inds)
+                face_geo = self.get_face_geometry(boundary_inds,
+                                                  ('neumann', i))
                 # int_vars = [x[i] for x in internal_vars]
                 traction = jax.vmap(jax.vmap(self.neumann_value_fns[i]))(
-                    subset_quad_points,
+                    face_geo['quad_points'],
                     *int_vars)  # (num_selected_faces, num_face_quads, vec)
                 assert len(traction.shape) == 3
-                _, nanson_scale = self.get_face_shape_grads(
-                    boundary_inds)  # (num_selected_faces, num_face_quads)
-                # (num_faces, num_face_quads, num_nodes) ->  (num_selected_faces, num_face_quads, num_nodes)
-                v_vals = np.take(self.face_shape_vals,
-                                 boundary_inds[:, 1],
-                                 axis=0)
-                v_vals = np.repeat(
-                    v_vals[:, :, :, None], self.vec, axis=-1
-                )  # (num_selected_faces, num_face_quads, num_nodes, vec)
-                subset_cells = np.take(
-                    self.cells, boundary_inds[:, 0],
-                    axis=0)  # (num_selected_faces, num_nodes)
-                # (num_selected_faces, num_nodes, vec) -> (num_selected_faces*num_nodes, vec)
-                int_vals = np.sum(v_vals * traction[:, :, None, :] *
-                                  nanson_scale[:, :, None, None],
+                # (num_selected_faces, num_face_quads, num_nodes, 1)
+                # * (num_selected_faces, num_face_quads, 1, vec)
+                # * (num_selected_faces, num_face_quads, 1, 1)
+                # -> (num_selected_faces, num_nodes, vec)
+                # -> (num_selected_faces*num_nodes, vec)
+                int_vals = np.sum(face_geo['shape_vals'][:, :, :, None] *
+                                  traction[:, :, None, :] *
+                                  face_geo['nanson_scale'][:, :, None, None],
                                   axis=1).reshape(-1, self.vec)
-                integral = integral.at[subset_cells.reshape(-1)].add(int_vals)
+                # (num_selected_faces, num_nodes)
+                subset_cells = face_geo['cells']
+                integral = integral + self.assemble_nodal(
+                    int_vals, subset_cells, ('neumann', i))
         return integral
 
     def compute_Neumann_boundary_inds(self):
@@ -462,7 +913,7 @@ class FEM:
             rhs_vals = np.sum(v_vals * body_force[:, :, None, :] *
                               self.JxW[:, :, None, None],
                               axis=1).reshape(-1, self.vec)
-            rhs = rhs.at[self.cells.reshape(-1)].add(rhs_vals)
+            rhs = self.assemble_nodal(rhs_vals, self.cells)
         return rhs
 
     def compute_body_force_by_sol(self, sol, mass_map):
@@ -485,8 +936,7 @@ class FEM:
         val = jax.vmap(mass_kernel)(cells_sol,
                                     self.JxW)  # (num_cells, num_nodes, vec)
         val = val.reshape(-1, self.vec)  # (num_cells*num_nodes, vec)
-        body_force = np.zeros_like(sol)
-        body_force = body_force.at[self.cells.reshape(-1)].add(val)
+        body_force = self.assemble_nodal(val, self.cells)
         return body_force
 
     def get_laplace_kernel(self, tensor_map):
@@ -509,6 +959,80 @@ class FEM:
 
         return laplace_kernel
 
+    def get_sum_factorization_fns(self):
+        """Sum factorized gradients in reference coordinates and their
+        transpose, see basis.get_tensor_product_tables.
+
+        Returns
+        -------
+        ref_grad_fn : Callable
+            (num_nodes, vec) -> (num_quads, vec, dim)
+            cell_sol -> gradients w.r.t. the reference coordinates
+        ref_grad_transpose_fn : Callable
+            (num_quads, vec, dim) -> (num_nodes, vec)
+            flux -> sum over quad points of flux : reference shape function
+            gradients
+        """
+        (shape_vals_1d, shape_grads_1d, node_inds,
+         quad_inds) = get_tensor_product_tables(self.ele_type,
+                                                self.gauss_order)
+        num_quads_1d, num_nodes_1d = shape_vals_1d.shape
+        # Position of each node and quad point in the flattened tensors
+        node_lex = onp.ravel_multi_index(node_inds.T,
+                                         (num_nodes_1d,) * self.dim)
+        quad_lex = onp.ravel_multi_index(quad_inds.T,
+                                         (num_quads_1d,) * self.dim)
+        node_order, quad_order = onp.argsort(node_lex), onp.argsort(quad_lex)
+
+        def contract(x, tables):
+            # Apply one 1D table per direction to the leading axes of x
+            for axis, table in enumerate(tables):
+                x = np.moveaxis(np.tensordot(table, x, axes=(1, axis)), 0,
+                                axis)
+            return x
+
+        def get_tables(direction, transpose):
+            tables = [shape_grads_1d if axis == direction else shape_vals_1d
+                      for axis in range(self.dim)]
+            return [table.T for table in tables] if transpose else tables
+
+        def ref_grad_fn(cell_sol):
+            # (num_nodes_1d, ..., num_nodes_1d, vec)
+            u = cell_sol[node_order].reshape((num_nodes_1d,) * self.dim +
+                                             (-1,))
+            # (num_quads_1d, ..., num_quads_1d, vec, dim)
+            u_grads = np.stack([contract(u, get_tables(r, False))
+                                for r in range(self.dim)], axis=-1)
+            return u_grads.reshape(num_quads_1d**self.dim, -1,
+                                   self.dim)[quad_lex]
+
+        def ref_grad_transpose_fn(flux):
+            flux = flux[quad_order].reshape((num_quads_1d,) * self.dim +
+                                            flux.shape[1:])
+            # (num_nodes_1d, ..., num_nodes_1d, vec)
+            val = sum([contract(flux[..., r], get_tables(r, True))
+                       for r in range(self.dim)])
+            return val.reshape(num_nodes_1d**self.dim, -1)[node_lex]
+
+        return ref_grad_fn, ref_grad_transpose_fn
+
+    def get_sum_factorized_laplace_kernel(self, tensor_map):
+        ref_grad_fn, ref_grad_transpose_fn = self.get_sum_factorization_fns()
+
+        def laplace_kernel(cell_sol, cell_jacobian_deta_dx, cell_JxW,
+                           *cell_internal_vars):
+            # (num_quads, vec, dim) @ (num_quads, dim, dim)
+            # -> (num_quads, vec, dim)
+            u_grads = ref_grad_fn(cell_sol) @ cell_jacobian_deta_dx
+            u_physics = jax.vmap(tensor_map)(
+                u_grads, *cell_internal_vars).reshape(u_grads.shape)
+            # Pull back to reference coordinates, (num_quads, vec, dim)
+            flux = u_physics @ np.swapaxes(cell_jacobian_deta_dx, 1,
+                                           2) * cell_JxW[:, None, None]
+            return ref_grad_transpose_fn(flux)
+
+        return laplace_kernel
+
     def get_mass_kernel(self, mass_map):
 
         def mass_kernel(cell_sol, cell_JxW, *cell_internal_vars):
@@ -552,17 +1076,121 @@ class FEM:
 
         return [mass_internal_vars, laplace_internal_vars]
 
-    @timeit
-    def split_and_compute_cell(self, cells_sol, np_version, jac_flag,
-                               **internal_vars):
+    def get_cell_kernel(self):
+        """Cell kernel that sums the mass and laplace contributions.
 
-        def value_and_jacrev(f, x):
-            y, pullback = jax.vjp(f, x)
-            basis = np.eye(len(y.reshape(-1)),
-                           dtype=y.dtype).reshape(-1, *y.shape)
-            jac, = jax.vmap(pullback)(basis)
-            return y, jac.reshape(self.num_nodes, self.vec, self.num_nodes,
-                                  self.vec)
+        Returns
+        -------
+        kernel : Callable
+            (cell_sol, cell_shape_grads, cell_JxW, cell_v_grads_JxW,
+            cell_mass_internal_vars, cell_laplace_internal_vars)
+            -> (num_nodes, vec)
+            With sum_factorization, cell_shape_grads are the inverse Jacobians
+            (num_quads, dim, dim) and cell_v_grads_JxW is None.
+        """
+
+        def kernel(cell_sol, cell_shape_grads, cell_JxW, cell_v_grads_JxW,
+                   cell_mass_internal_vars, cell_laplace_internal_vars):
+            if hasattr(self, 'get_mass_map'):
+                mass_kernel = self.get_mass_kernel(self.get_mass_map())
+                mass_val = mass_kernel(cell_sol, cell_JxW,
+                                       *cell_mass_internal_vars)
+            else:
+                mass_val = 0.
+
+            if hasattr(self, 'get_tensor_map') and self.sum_factorization:
+                laplace_kernel = self.get_sum_factorized_laplace_kernel(
+                    self.get_tensor_map())
+                laplace_val = laplace_kernel(cell_sol, cell_shape_grads,
+                                             cell_JxW,
+                                             *cell_laplace_internal_vars)
+            elif hasattr(self, 'get_tensor_map'):
+                laplace_kernel = self.get_laplace_kernel(
+                    self.get_tensor_map())
+                laplace_val = laplace_kernel(cell_sol, cell_shape_grads,
+                                             cell_v_grads_JxW,
+                                             *cell_laplace_internal_vars)
+            else:
+                laplace_val = 0.
+
+            return laplace_val + mass_val
+
+        return kernel
+
+    def get_kernel_cache_key(self):
+        """Snapshot of the instance state a traced kernel may have baked in.
+        Kernels read things like self.dim, self.dt or a macroscopic strain
+        self.H_bar from their closure, and jit turns them into compile-time
+        constants. The key holds the options of FEM that shape the kernels
+        and the attributes named in kernel_state_attrs, by value for Python
+        scalars and None, by identity otherwise. Reassigning one of them
+        re-traces the kernel, updating an array in place (which jax arrays
+        do not allow) would not. Anything passed through internal_vars is an
+        argument of the kernel and is not part of the key.
+
+        Returns
+        -------
+        key : tuple
+        refs : list
+            Objects identified by id in the key. They are kept alive together
+            with the cached kernel so that their ids cannot be reused.
+        """
+        names = (('vec', 'dim', 'ele_type', 'gauss_order', 'quadrature',
+                  'geometry_mode', 'sum_factorization') +
+                 tuple(self.kernel_state_attrs))
+        key = []
+        refs = []
+        for name in names:
+            val = getattr(self, name, None)
+            if val is None or isinstance(val,
+                                         (bool, int, float, complex, str)):
+                key.append((name, val))
+            else:
+                key.append((name, id(val)))
+                refs.append(val)
+        return tuple(key), refs
+
+    def get_cached_kernel(self, kernel_key, get_fn, kernel_refs=()):
+        """Jitted kernel, cached so that repeated calls (e.g., Newton
+        iterations) do not re-trace it. The cache lives on the instance, or in
+        the shared kernel registry if the class sets share_kernels.
+
+        Parameters
+        ----------
+        kernel_key : tuple
+            Identifies the kernel within the problem, e.g., ('cell', jac_flag)
+        get_fn : Callable
+            Returns the function to be jitted
+        kernel_refs : tuple
+            Objects identified by id in kernel_key
+
+        Returns
+        -------
+        fn : Callable
+        """
+        state_key, refs = self.get_kernel_cache_key()
+        refs = tuple(refs) + tuple(kernel_refs)
+        share_kernels = type(self).__dict__.get('share_kernels', False)
+        if share_kernels and len(refs) == len(kernel_refs):
+            key = (type(self), self.ele_type, self.num_quads, self.num_nodes,
+                   self.vec, self.dim, state_key, kernel_key)
+            return kernel_registry.get_kernel(key, get_fn, refs)
+
+        if not hasattr(self, 'kernel_cache'):
+            self.kernel_cache = {}
+        key = (state_key, kernel_key)
+        if key not in self.kernel_cache:
+            logger.debug(f"Tracing kernel {kernel_key}")
+            # Attributes reassigned in a loop (e.g., a load continuation)
+            # would otherwise keep all their past kernels alive
+            if len(self.kernel_cache) >= self.max_kernel_cache_size:
+                self.kernel_cache.pop(next(iter(self.kernel_cache)))
+            self.kernel_cache[key] = (jax.jit(get_fn()), refs)
+        return self.kernel_cache[key][0]
+
+    def get_vmap_cell_fn(self, jac_flag):
+        """Jitted, vmapped cell kernel (or kernel and its Jacobian).
+        """
 
         def value_and_jacfwd(f, x):
             pushfwd = functools.partial(jax.jvp, f, (x, ))
@@ -574,25 +1202,28 @@ class FEM:
 
         def get_kernel_fn_cell():
 
-            def kernel(cell_sol, cell_shape_grads, cell_JxW, cell_v_grads_JxW,
-                       cell_mass_internal_vars, cell_laplace_internal_vars):
-                if hasattr(self, 'get_mass_map'):
-                    mass_kernel = self.get_mass_kernel(self.get_mass_map())
-                    mass_val = mass_kernel(cell_sol, cell_JxW,
-                                           *cell_mass_internal_vars)
-                else:
-                    mass_val = 0.
-
-                if hasattr(self, 'get_tensor_map'):
-                    laplace_kernel = self.get_laplace_kernel(
-                        self.get_tensor_map())
-                    laplace_val = laplace_kernel(cell_sol, cell_shape_grads,
-                                                 cell_v_grads_JxW,
-                                                 *cell_laplace_internal_vars)
-                else:
-                    laplace_val = 0.
-
-                return laplace_val + mass_val
+            cell_kernel = self.get_cell_kernel()
+            geometry_fn = self.get_cell_geometry_fn()
+
+            num_reduced = len(self.reduced_geometry)
+            if num_reduced > 0:
+                reduced_kernel = self.get_laplace_kernel(
+                    self.get_reduced_tensor_map())
+
+            def kernel(cell_sol, *args):
+                # args: geometry inputs, reduced geometry inputs, mass and
+                # laplace internal variables
+                (*geometry_inputs, cell_mass_internal_vars,
+                 cell_laplace_internal_vars) = args
+                num_inputs = len(geometry_inputs) - num_reduced
+                val = cell_kernel(cell_sol,
+                                  *geometry_fn(*geometry_inputs[:num_inputs]),
+                                  cell_mass_internal_vars,
+                                  cell_laplace_internal_vars)
+                if num_reduced > 0:
+                    val = val + reduced_kernel(cell_sol,
+                                               *geometry_inputs[num_inputs:])
+                return val
 
             def kernel_jac(cell_sol, *args):
                 kernel_partial = lambda cell_sol: kernel(cell_sol, *args)
@@ -602,35 +1233,90 @@ class FEM:
 
             return kernel, kernel_jac
 
-        kernel, kernel_jac = get_kernel_fn_cell()
-        fn = kernel_jac if jac_flag else kernel
-        vmap_fn = jax.jit(jax.vmap(fn))
+        def get_fn():
+            kernel, kernel_jac = get_kernel_fn_cell()
+            fn = kernel_jac if jac_flag else kernel
+            return jax.vmap(fn)
+
+        return self.get_cached_kernel(('cell', jac_flag), get_fn)
+
+    def get_batch_size(self, jac_flag):
+        """Number of cells evaluated together by split_and_compute_cell.
+        Estimated from self.batch_memory_budget and the per-cell footprint of
+        the largest intermediate of the kernel,
+        (num_quads, num_nodes, vec, dim), which jacfwd further multiplies by
+        the number of local dofs.
+
+        Returns
+        -------
+        batch_size : int
+        """
+        itemsize = onp.dtype(np.zeros(()).dtype).itemsize
+        cell_bytes = (self.num_quads * self.num_nodes * self.vec * self.dim *
+                      itemsize)
+        if jac_flag:
+            cell_bytes *= self.num_nodes * self.vec
+        batch_size = int(self.batch_memory_budget // cell_bytes)
+        return max(1, min(batch_size, self.num_cells))
+
+    @timeit
+    def split_and_compute_cell(self, cells_sol, np_version, jac_flag,
+                               **internal_vars):
+        """Evaluate the cell kernel (and its Jacobian if jac_flag) in batches.
+        The batch size comes from get_batch_size. The last batch is padded by
+        repeating its final cell, so every batch has the same shape and the
+        kernel is compiled only once.
+        """
+        return self.compute_cells(None, cells_sol, np_version, jac_flag,
+                                  **internal_vars)
+
+    def compute_cells(self, cell_inds, cells_sol, np_version, jac_flag,
+                      **internal_vars):
+        """split_and_compute_cell restricted to a subset of cells, e.g., the
+        cells owned by an MPI rank.
+
+        Parameters
+        ----------
+        cell_inds : onp.ndarray or None
+            (num_selected_cells,) all cells if None
+        cells_sol : np.DeviceArray
+            (num_selected_cells, num_nodes, vec)
+        """
+        vmap_fn = self.get_vmap_cell_fn(jac_flag)
         kernal_vars = self.unpack_kernels_vars(**internal_vars)
-        num_cuts = 20
-        if num_cuts > len(self.cells):
-            num_cuts = len(self.cells)
-        batch_size = len(self.cells) // num_cuts
-        input_collection = [
-            cells_sol, self.shape_grads, self.JxW, self.v_grads_JxW,
-            *kernal_vars
-        ]
+        num_cells = len(cells_sol)
+        batch_size = self.get_batch_size(jac_flag)
+        num_cuts = -(-num_cells // batch_size)
+        logger.debug(f"Cell kernel evaluated in {num_cuts} batch(es) of "
+                     f"{batch_size} cells")
+
+        def get_input_col(i):
+            stop = (i + 1) * batch_size
+            if stop <= num_cells:
+                inds = slice(i * batch_size, stop)
+            else:
+                inds = onp.minimum(onp.arange(i * batch_size, stop),
+                                   num_cells - 1)
+            global_inds = inds if cell_inds is None else cell_inds[inds]
+
+            def take(x):
+                return x[global_inds]
+
+            return [
+                cells_sol[inds], *self.get_geometry_inputs(global_inds),
+                *jax.tree_map(take, kernal_vars)
+            ]
+
+        num_valid = [min(batch_size, num_cells - i * batch_size)
+                     for i in range(num_cuts)]
 
         if jac_flag:
             values = []
             jacs = []
             for i in range(num_cuts):
-                if i < num_cuts - 1:
-                    input_col = jax.tree_map(
-                        lambda x: x[i * batch_size:(i + 1) * batch_size],
-                        input_collection)
-                else:
-                    input_col = jax.tree_map(lambda x: x[i * batch_size:],
-                                             input_collection)
-
-                val, jac = vmap_fn(*input_col)
-
-                values.append(val)
-                jacs.append(jac)
+                val, jac = vmap_fn(*get_input_col(i))
+                values.append(val[:num_valid[i]])
+                jacs.append(jac[:num_valid[i]])
 
             # np_version set to jax.numpy allows for auto diff, but uses GPU memory
             if np_version.__name__ == 'jax.numpy':
@@ -651,16 +1337,8 @@ class FEM:
         else:
             values = []
             for i in range(num_cuts):
-                if i < num_cuts - 1:
-                    input_col = jax.tree_map(
-                        lambda x: x[i * batch_size:(i + 1) * batch_size],
-                        input_collection)
-                else:
-                    input_col = jax.tree_map(lambda x: x[i * batch_size:],
-                                             input_collection)
-
-                val = vmap_fn(*input_col)
-                values.append(val)
+                val = vmap_fn(*get_input_col(i))
+                values.append(val[:num_valid[i]])
             values = np_version.vstack(values)
             return values
 
@@ -679,26 +1357,30 @@ class FEM:
 
             return kernel, kernel_jac
 
-        # TODO: Better to move the following to __init__ function?
-        location_fns, value_fns = self.cauchy_bc_info
-        boundary_inds_list = self.get_boundary_conditions_inds(location_fns)
+        _, value_fns = self.cauchy_bc_info
+        boundary_inds_list = self.get_cauchy_boundary_inds_list()
         values = []
         selected_cells = []
         for i, boundary_inds in enumerate(boundary_inds_list):
+            face_geo = self.get_face_geometry(boundary_inds, ('cauchy', i))
             selected_cell_sols = cells_sol[
                 boundary_inds[:, 0]]  # (num_selected_faces, num_nodes, vec))
-            selected_face_shape_vals = self.face_shape_vals[
-                boundary_inds[:,
-                              1]]  # (num_selected_faces, num_face_quads, num_nodes)
-            _, nanson_scale = self.get_face_shape_grads(
-                boundary_inds)  # (num_selected_faces, num_face_quads)
-            kernel, kernel_jac = get_kernel_fn_face(value_fns[i])
-            fn = kernel_jac if jac_flag else kernel
-            vmap_fn = jax.jit(jax.vmap(fn))
+            # (num_selected_faces, num_face_quads, num_nodes)
+            selected_face_shape_vals = face_geo['shape_vals']
+            nanson_scale = face_geo[
+                'nanson_scale']  # (num_selected_faces, num_face_quads)
+
+            def get_fn(cauchy_map=value_fns[i]):
+                kernel, kernel_jac = get_kernel_fn_face(cauchy_map)
+                fn = kernel_jac if jac_flag else kernel
+                return jax.vmap(fn)
+
+            vmap_fn = self.get_cached_kernel(
+                ('face', jac_flag, id(value_fns[i])), get_fn, (value_fns[i], ))
             val = vmap_fn(selected_cell_sols, selected_face_shape_vals,
                           nanson_scale)
             values.append(val)
-            selected_cells.append(self.cells[boundary_inds[:, 0]])
+            selected_cells.append(face_geo['cells'])
 
         values = np_version.vstack(values)
         selected_cells = onp.vstack(selected_cells)
@@ -777,28 +1459,49 @@ class FEM:
         return u_grads
 
     def compute_residual_vars_helper(self, sol, weak_form, **internal_vars):
-        res = np.zeros((self.num_total_nodes, self.vec))
+        res, self.body_force, self.neumann = self.assemble_residual(
+            sol, weak_form, **internal_vars)
+        return res
+
+    def assemble_residual(self, sol, weak_form, **internal_vars):
+        """Add the face and source contributions to the cell residual.
+        Does not set any attribute, so it can be traced by a jitted solver.
+
+        Returns
+        -------
+        res : np.DeviceArray
+            (num_total_nodes, vec)
+        body_force : np.DeviceArray
+            (num_total_nodes, vec)
+        neumann : np.DeviceArray
+            (num_total_nodes, vec)
+        """
         weak_form = weak_form.reshape(-1,
                                       self.vec)  # (num_cells*num_nodes, vec)
-        res = res.at[self.cells.reshape(-1)].add(weak_form)
+        res = self.assemble_nodal(weak_form, self.cells)
+        return self.add_face_and_source_terms(sol, res, **internal_vars)
 
+    def add_face_and_source_terms(self, sol, res, **internal_vars):
+        """Add the Cauchy, source and Neumann terms to the assembled cell
+        residual res (num_total_nodes, vec). See assemble_residual.
+        """
         if self.cauchy_bc_info is not None:
             cells_sol = sol[self.cells]
             values, selected_cells = self.compute_face(cells_sol, np, False)
             values = values.reshape(-1, self.vec)
-            res = res.at[selected_cells.reshape(-1)].add(values)
+            res = res + self.assemble_nodal(values, selected_cells, 'cauchy')
 
-        self.body_force = self.compute_body_force_by_fn()
+        body_force = self.compute_body_force_by_fn()
 
         # TODO: Should be useless since mass_map will handle it.
         if 'body' in internal_vars.keys():
-            self.body_force = self.compute_body_force_by_sol(
+            body_force = self.compute_body_force_by_sol(
                 internal_vars['body'], self.get_body_map())
 
-        self.neumann = self.compute_Neumann_integral_vars(**internal_vars)
+        neumann = self.compute_Neumann_integral_vars(**internal_vars)
 
-        res = res - self.body_force - self.neumann
-        return res
+        res = res - body_force - neumann
+        return res, body_force, neumann
 
     def compute_residual_vars(self, sol, **internal_vars):
         logger.debug(f"Computing cell residual...")
@@ -809,50 +1512,172 @@ class FEM:
         return self.compute_residual_vars_helper(sol, weak_form,
                                                  **internal_vars)
 
-    def compute_newton_vars(self, sol, **internal_vars):
-        logger.debug(f"Computing cell Jacobian and cell residual...")
-        cells_sol = sol[self.cells]  # (num_cells, num_nodes, vec)
-        # (num_cells, num_nodes, vec), (num_cells, num_nodes, vec, num_nodes, vec)
-        weak_form, cells_jac = self.split_and_compute_cell(
-            cells_sol, onp, True, **internal_vars)
-        V = cells_jac.reshape(-1)
-        inds = (self.vec * self.cells[:, :, None] +
-                onp.arange(self.vec)[None, None, :]).reshape(
-                    len(self.cells), -1)
+    def compute_sparsity_pattern(self):
+        """Symbolic assembly of the global Jacobian.
+        The sparsity pattern only depends on the mesh connectivity (and the
+        Cauchy boundary faces), so it is computed once and reused by every
+        Newton iteration. Only the values V need to be scattered afterwards.
+
+        Sets
+        ----
+        I, J : onp.ndarray
+            (num_entries,) COO row and column indices, one entry per cell
+            Jacobian component (duplicates included)
+        csr_indptr, csr_indices : onp.ndarray
+            CSR structure of the assembled global matrix
+        csr_perm : onp.ndarray
+            (num_entries,) position in the CSR data array that each COO entry
+            is summed into
+        """
+        logger.debug(f"Computing sparsity pattern of the global matrix...")
+        cells = self.cells
+        if self.cauchy_bc_info is not None:
+            boundary_inds_list = self.get_cauchy_boundary_inds_list()
+            selected_cells = [self.cells[boundary_inds[:, 0]]
+                              for boundary_inds in boundary_inds_list]
+            cells = onp.vstack([cells] + selected_cells)
+        inds = (self.vec * cells[:, :, None] +
+                onp.arange(self.vec)[None, None, :]).reshape(len(cells), -1)
         I = onp.repeat(inds[:, :, None], self.num_nodes * self.vec,
                        axis=2).reshape(-1)
         J = onp.repeat(inds[:, None, :], self.num_nodes * self.vec,
                        axis=1).reshape(-1)
+        keys = I.astype(onp.int64) * self.num_total_dofs + J
+        unique_keys, csr_perm = onp.unique(keys, return_inverse=True)
+        rows = unique_keys // self.num_total_dofs
         self.I = I
         self.J = J
-        self.V = V  # This is a jax array for now but in CPU memory
-        del V, I, J
+        self.csr_indptr = onp.hstack(
+            (0, onp.cumsum(onp.bincount(rows,
+                                        minlength=self.num_total_dofs))))
+        self.csr_indices = unique_keys % self.num_total_dofs
+        self.csr_perm = csr_perm.reshape(-1)
+        logger.debug(f"Global matrix has {len(self.csr_indices)} nonzeros.")
+
+    def compute_newton_vars(self, sol, **internal_vars):
+        logger.debug(f"Computing cell Jacobian and cell residual...")
+        if not hasattr(self, 'csr_perm'):
+            self.compute_sparsity_pattern()
+        cells_sol = sol[self.cells]  # (num_cells, num_nodes, vec)
+        # (num_cells, num_nodes, vec),
+        # (num_cells, num_nodes, vec, num_nodes, vec)
+        weak_form, cells_jac = self.split_and_compute_cell(
+            cells_sol, onp, True, **internal_vars)
+        # This is a jax array for now but in CPU memory
+        self.V = cells_jac.reshape(-1)
 
         if self.cauchy_bc_info is not None:
             D_face, selected_cells = self.compute_face(cells_sol, onp, True)
             V_face = D_face.reshape(-1)
-            inds_face = (self.vec * selected_cells[:, :, None] +
-                         onp.arange(self.vec)[None, None, :]).reshape(
-                             len(selected_cells), -1)
-            I_face = onp.repeat(inds_face[:, :, None],
-                                self.num_nodes * self.vec,
-                                axis=2).reshape(-1)
-            J_face = onp.repeat(inds_face[:, None, :],
-                                self.num_nodes * self.vec,
-                                axis=1).reshape(-1)
-            self.I = onp.hstack((self.I, I_face))
-            self.J = onp.hstack((self.J, J_face))
             self.V = onp.hstack((self.V, V_face))
 
         return self.compute_residual_vars_helper(sol, weak_form,
                                                  **internal_vars)
 
+    def compute_newton_vars_jittable(self, sol, **internal_vars):
+        """Jittable counterpart of compute_newton_vars.
+        The cell Jacobians stay in device memory and no attribute is set, so
+        the function can be called inside jax.jit or jax.lax.while_loop.
+        problem.compute_sparsity_pattern must be called before.
+
+        Returns
+        -------
+        res : np.DeviceArray
+            (num_total_nodes, vec)
+        V : np.DeviceArray
+            (num_entries,) COO values matching problem.I and problem.J
+        """
+        cells_sol = sol[self.cells]  # (num_cells, num_nodes, vec)
+        weak_form, cells_jac = self.split_and_compute_cell(
+            cells_sol, np, True, **internal_vars)
+        V = cells_jac.reshape(-1)
+
+        if self.cauchy_bc_info is not None:
+            D_face, selected_cells = self.compute_face(cells_sol, np, True)
+            V = np.hstack((V, D_face.reshape(-1)))
+
+        res, _, _ = self.assemble_residual(sol, weak_form, **internal_vars)
+        return res, V
+
+    def compute_linearized_vars(self, sol, **internal_vars):
+        """Matrix-free counterpart of compute_newton_vars.
+        The cell residual is linearized with jax.linearize, so the tangent
+        operator is only available through its action (JVP). Neither the cell
+        Jacobians (num_cells, num_nodes, vec, num_nodes, vec) nor the global
+        sparse matrix are stored.
+
+        Sets
+        ----
+        A_jvp : Callable
+            (num_total_nodes, vec) -> (num_total_nodes, vec)
+            Action of the tangent matrix on an increment
+        A_diag : np.DeviceArray
+            (num_total_dofs,) diagonal of the tangent matrix, used by the
+            Jacobi preconditioner
+        """
+        logger.debug(f"Linearizing cell residual (matrix-free)...")
+        cells_sol = sol[self.cells]  # (num_cells, num_nodes, vec)
+        # No splitting into batches is needed since the cell Jacobians are
+        # never formed. One jitted kernel also keeps the linearized operator
+        # small when it is traced by the Krylov solver.
+        vmap_kernel = self.get_vmap_cell_fn(False)
+        kernal_vars = self.unpack_kernels_vars(**internal_vars)
+        weak_form, cells_jvp = jax.linearize(
+            lambda cells_sol: vmap_kernel(
+                cells_sol, *self.get_geometry_inputs(slice(None)),
+                *kernal_vars),
+            cells_sol)
+        cells_list = [self.cells]
+        keys = ['cells', 'cauchy']
+        jvp_list = [cells_jvp]
+
+        if self.cauchy_bc_info is not None:
+            _, selected_cells = self.compute_face(cells_sol, onp, False)
+            _, face_jvp = jax.linearize(
+                lambda cells_sol: self.compute_face(cells_sol, np, False)[0],
+                cells_sol)
+            cells_list.append(selected_cells)
+            jvp_list.append(face_jvp)
+
+        def A_jvp(inc_sol):
+            inc_cells_sol = inc_sol[self.cells]
+            val = np.zeros((self.num_total_nodes, self.vec))
+            for cells, key, jvp_fn in zip(cells_list, keys, jvp_list):
+                val = val + self.assemble_nodal(jvp_fn(inc_cells_sol), cells,
+                                                key)
+            return val
+
+        # The diagonal is extracted with one cell-batched JVP per local dof,
+        # so only (num_cells, num_nodes*vec) values are held at a time.
+        num_local_dofs = self.num_nodes * self.vec
+        A_diag = np.zeros(self.num_total_dofs)
+        for cells, key, jvp_fn in zip(cells_list, keys, jvp_list):
+            cells_diag = []
+            for k in range(num_local_dofs):
+                basis = np.zeros(num_local_dofs).at[k].set(1.).reshape(
+                    self.num_nodes, self.vec)
+                basis = np.broadcast_to(basis, cells_sol.shape)
+                cells_diag.append(
+                    jvp_fn(basis).reshape(-1, num_local_dofs)[:, k])
+            cells_diag = np.stack(cells_diag, axis=1)
+            A_diag = A_diag + self.assemble_nodal(cells_diag, cells,
+                                                  key).reshape(-1)
+
+        self.A_jvp = A_jvp
+        self.A_diag = A_diag
+
+        return self.compute_residual_vars_helper(sol, weak_form,
+                                                 **internal_vars)
+
     def compute_residual(self, sol):
         return self.compute_residual_vars(sol, **self.internal_vars)
 
     def newton_update(self, sol):
         return self.compute_newton_vars(sol, **self.internal_vars)
 
+    def linearize(self, sol):
+        return self.compute_linearized_vars(sol, **self.internal_vars)
+
     def set_params(self, params):
         """Used for solving inverse problems.
         """
@@ -2,6 +2,8 @@ import os
 import gmsh
 import numpy as onp
 import meshio
+import scipy
+from scipy.sparse.csgraph import reverse_cuthill_mckee
 
 from jax_am.fem.basis import get_elements
 from jax_am.fem.basis import get_face_shape_vals_and_grads
@@ -22,7 +24,141 @@ class Mesh():
         self.cells = cells
         self.ele_type = ele_type
 
-    def count_selected_faces(self, location_fn):
+    def reorder(self, node_ordering='rcm', cell_ordering='morton'):
+        """Renumber nodes and cells for memory locality, in place.
+        Call it before creating the FEM problem. The permutations are kept,
+        so data in the original (file) order can be mapped with
+        from_original_order and results mapped back with to_original_order.
+        save_sol does the latter.
+
+        Parameters
+        ----------
+        node_ordering : str or None
+            'rcm': reverse Cuthill-McKee on the node graph, which reduces the
+            bandwidth of the global matrix
+        cell_ordering : str or None
+            'morton': cells sorted along a Z-order curve through their
+            centroids
+
+        Returns
+        -------
+        self : Mesh
+        """
+        points, cells = onp.asarray(self.points), onp.asarray(self.cells)
+        num_nodes = len(points)
+        node_perm = onp.arange(num_nodes)
+        cell_perm = onp.arange(len(cells))
+        if node_ordering == 'rcm':
+            node_perm = get_rcm_node_order(cells, num_nodes)
+        else:
+            assert node_ordering is None, \
+                f"Unknown node_ordering {node_ordering}"
+        if cell_ordering == 'morton':
+            cell_perm = get_morton_cell_order(points, cells)
+        else:
+            assert cell_ordering is None, \
+                f"Unknown cell_ordering {cell_ordering}"
+
+        # Compose with a previous reordering
+        if hasattr(self, 'node_perm'):
+            self.node_perm = self.node_perm[node_perm]
+            self.cell_perm = self.cell_perm[cell_perm]
+        else:
+            self.node_perm, self.cell_perm = node_perm, cell_perm
+        new_node_inds = onp.argsort(node_perm)
+        self.points = points[node_perm]
+        self.cells = new_node_inds[cells[cell_perm]]
+        return self
+
+    def to_original_order(self, data, location='node'):
+        """Map node (or cell) data of the reordered mesh back to the original
+        order.
+
+        Parameters
+        ----------
+        data : onp.ndarray
+            (num_nodes, ...) or (num_cells, ...)
+        location : str
+            'node' or 'cell'
+
+        Returns
+        -------
+        data : onp.ndarray
+        """
+        if not hasattr(self, 'node_perm'):
+            return data
+        perm = self.node_perm if location == 'node' else self.cell_perm
+        data = onp.asarray(data)
+        original_data = onp.empty_like(data)
+        original_data[perm] = data
+        return original_data
+
+    def from_original_order(self, data, location='node'):
+        """Map node (or cell) data given in the original order, e.g., an
+        initial guess or material parameters, to the reordered mesh.
+        """
+        if not hasattr(self, 'node_perm'):
+            return data
+        perm = self.node_perm if location == 'node' else self.cell_perm
+        return data[perm]
+
+    def get_external_faces(self, ele_type=None):
+        """Faces that belong to a single cell, i.e., the boundary of the mesh.
+        Faces are matched by hashing their sorted node indices with a
+        vectorized onp.unique. The result only depends on the connectivity,
+        so it is cached per element type (and recomputed if self.cells is
+        replaced).
+
+        Parameters
+        ----------
+        ele_type : str
+            Defaults to self.ele_type
+
+        Returns
+        -------
+        external_faces : onp.ndarray
+            (num_external_faces, 2) global cell index and local face index,
+            sorted by cell index then face index
+        """
+        ele_type = self.ele_type if ele_type is None else ele_type
+        if not hasattr(self, 'external_faces_cache'):
+            self.external_faces_cache = {}
+        cells, external_faces = self.external_faces_cache.get(
+            ele_type, (None, None))
+        if cells is not self.cells:
+            _, _, _, _, face_inds = get_face_shape_vals_and_grads(ele_type)
+            num_cells, num_faces = len(self.cells), len(face_inds)
+            # (num_cells, num_faces, num_face_nodes)
+            cell_faces = onp.take(onp.asarray(self.cells), face_inds, axis=1)
+            cell_faces = onp.sort(cell_faces.reshape(num_cells*num_faces, -1),
+                                  axis=1)
+            _, face_ids, counts = onp.unique(cell_faces, axis=0,
+                                             return_inverse=True,
+                                             return_counts=True)
+            inds = onp.flatnonzero(counts[face_ids.reshape(-1)] == 1)
+            external_faces = onp.stack((inds // num_faces, inds % num_faces),
+                                       axis=1)
+            self.external_faces_cache[ele_type] = (self.cells, external_faces)
+        return external_faces
+
+    def get_external_face_points(self, ele_type=None):
+        """Node coordinates of the external faces.
+
+        Returns
+        -------
+        external_faces : onp.ndarray
+            (num_external_faces, 2)
+        face_points : onp.ndarray
+            (num_external_faces, num_face_nodes, dim)
+        """
+        ele_type = self.ele_type if ele_type is None else ele_type
+        _, _, _, _, face_inds = get_face_shape_vals_and_grads(ele_type)
+        external_faces = self.get_external_faces(ele_type)
+        face_nodes = onp.asarray(self.cells)[external_faces[:, 0][:, None],
+                                             face_inds[external_faces[:, 1]]]
+        return external_faces, onp.take(self.points, face_nodes, axis=0)
+
+    def count_selected_faces(self, location_fn, external_only=False):
         """Given location functions, compute the count of faces that satisfy
         the location function. Useful for setting up distributed load
         conditions.
@@ -32,15 +168,21 @@ class Mesh():
         location_fns : List[Callable]
             Callable: a function that inputs a point and returns a boolean
             value describing whether the boundary condition should be applied.
+        external_only : bool
+            Only test the external faces, see get_external_faces
 
         Returns
         -------
         face_count : int
         """
-
-        _, _, _, _, face_inds = get_face_shape_vals_and_grads(self.ele_type)
-        cell_points = onp.take(self.points, self.cells, axis=0)
-        cell_face_points = onp.take(cell_points, face_inds, axis=1)
+        if external_only:
+            _, face_points = self.get_external_face_points()
+        else:
+            _, _, _, _, face_inds = get_face_shape_vals_and_grads(
+                self.ele_type)
+            cell_points = onp.take(self.points, self.cells, axis=0)
+            face_points = onp.take(cell_points, face_inds, axis=1).reshape(
+                -1, face_inds.shape[1], cell_points.shape[-1])
 
         vmap_location_fn = jax.vmap(location_fn)
 
@@ -48,11 +190,47 @@ class Mesh():
             boundary_flag = vmap_location_fn(cell_points)
             return onp.all(boundary_flag)
 
-        vvmap_on_boundary = jax.vmap(jax.vmap(on_boundary))
-        boundary_flags = vvmap_on_boundary(cell_face_points)
-        boundary_inds = onp.argwhere(boundary_flags)
-        return boundary_inds.shape[0]
+        boundary_flags = jax.vmap(on_boundary)(face_points)
+        return int(onp.sum(boundary_flags))
+
 
+def get_rcm_node_order(cells, num_nodes):
+    """Reverse Cuthill-McKee ordering of the graph of nodes sharing a cell.
+
+    Returns
+    -------
+    node_perm : onp.ndarray
+        (num_nodes,) original index of each new node
+    """
+    num_cells, num_nodes_per_cell = cells.shape
+    rows = onp.repeat(cells, num_nodes_per_cell, axis=1).reshape(-1)
+    cols = onp.tile(cells, (1, num_nodes_per_cell)).reshape(-1)
+    graph = scipy.sparse.csr_matrix(
+        (onp.ones(len(rows), dtype=onp.int8), (rows, cols)),
+        shape=(num_nodes, num_nodes))
+    return onp.asarray(reverse_cuthill_mckee(graph, symmetric_mode=True),
+                       dtype=onp.int64)
+
+
+def get_morton_cell_order(points, cells, num_bits=10):
+    """Order cells along a Morton (Z-order) curve through their centroids.
+
+    Returns
+    -------
+    cell_perm : onp.ndarray
+        (num_cells,) original index of each new cell
+    """
+    centroids = onp.mean(onp.take(points, cells, axis=0), axis=1)
+    lower, upper = onp.min(centroids, axis=0), onp.max(centroids, axis=0)
+    scale = onp.where(upper > lower, upper - lower, 1.)
+    grid = ((centroids - lower) / scale * (2**num_bits - 1)).astype(onp.int64)
+    dim = grid.shape[1]
+    keys = onp.zeros(len(cells), dtype=onp.int64)
+    # Interleave the bits of the grid coordinates
+    for bit in range(num_bits):
+        for d in range(dim):
+            keys |= ((grid[:, d] >> bit) & 1) << (bit * dim + d)
+    return onp.argsort(keys, kind='stable')
 
 
 def check_mesh_TET4(points, cells):
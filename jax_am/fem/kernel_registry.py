@@ -0,0 +1,73 @@
+"""Registry of jitted FEM kernels shared between problem instances.
+
+A parameter sweep typically creates many problems of the same class on the
+same kind of mesh. Their cell and face kernels are identical, so they are
+traced and compiled once and looked up here by the problem instance
+(see FEM.get_cached_kernel). JAX further specializes each jitted kernel on
+the shapes of its arguments (batch size, internal variables).
+
+Compiled executables can also be persisted to disk across script starts with
+enable_persistent_kernel_cache, which turns on the JAX compilation cache.
+"""
+import os
+import jax
+
+from jax_am import logger
+
+
+_registry = {}
+
+
+def get_kernel(key, get_fn, refs=()):
+    """Return the jitted kernel registered under key, creating it if needed.
+
+    Parameters
+    ----------
+    key : tuple
+        Hashable description of the kernel, e.g.,
+        (problem class, ele_type, num_quads, vec, dim, ...)
+    get_fn : Callable
+        Returns the (vmapped) function to be jitted. Only called on a miss.
+    refs : tuple
+        Objects identified by id in key, kept alive with the kernel.
+
+    Returns
+    -------
+    fn : Callable
+    """
+    if key not in _registry:
+        logger.debug(f"Registering new kernel, {len(_registry) + 1} kernels "
+                     f"in total")
+        _registry[key] = (jax.jit(get_fn()), refs)
+    return _registry[key][0]
+
+
+def clear_kernel_registry():
+    """Drop all registered kernels.
+    A registered kernel keeps the problem instance that traced it alive, so
+    this also releases the memory held by that instance.
+    """
+    _registry.clear()
+
+
+def enable_persistent_kernel_cache(cache_dir, min_compile_time_secs=0.):
+    """Persist compiled kernels to disk through the JAX compilation cache,
+    so that later script starts skip the XLA compilation of identical
+    kernels. Which backends are supported depends on the JAX version.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Directory of the on-disk cache
+    min_compile_time_secs : float
+        Only executables that took longer than this to compile are stored
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    if 'jax_compilation_cache_dir' in jax.config.values:
+        jax.config.update("jax_compilation_cache_dir", cache_dir)
+    else:
+        from jax.experimental.compilation_cache import compilation_cache
+        compilation_cache.initialize_cache(cache_dir)
+    jax.config.update("jax_persistent_cache_min_compile_time_secs",
+                      min_compile_time_secs)
+    logger.info(f"Persistent kernel cache enabled at {cache_dir}")
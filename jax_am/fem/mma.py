@@ -5,6 +5,9 @@ Under GNU General Public License v3.0
 Original copy from https://github.com/arjendeetman/GCMMA-MMA-Python/blob/master/Code/MMA.py
 
 Improvement is made to avoid N^2 memory operation so that the MMA solver is more scalable.
+
+The MMA subproblem needs double precision. No extra config is needed here:
+importing jax_am.fem.core (below) already enables jax_enable_x64.
 """
 from numpy import diag as diags
 from numpy.linalg import solve
@@ -16,50 +19,125 @@ from functools import partial
 import time
 import scipy
 
-from jax.config import config
-config.update("jax_enable_x64", True)
+from jax_am.fem.core import FEM
+from jax_am.fem.solver import solver, SolverState
+
+
+def get_filter_radius(problem):
+    V = np.sum(problem.JxW)
+    avg_elem_V = V/problem.num_cells
+    avg_elem_size = avg_elem_V**(1./problem.dim)
+    return 1.5*avg_elem_size
 
 
-def compute_filter_kd_tree(problem):
+def compute_filter_kd_tree(problem, rmin=None):
     """This function is created by Tianju. Not from the original code.
     We use k-d tree algorithm to compute the filter.
+    All pairs of flexible cells closer than rmin are found in one query and
+    H is kept sparse, so memory grows linearly with the number of cells.
+
+    Returns
+    -------
+    H : scipy.sparse.csr_array
+        (flex_num_cells, flex_num_cells) weights max(0, rmin - distance)
+    Hs : np.ndarray
+        (flex_num_cells,) row sums of H
     """
     cell_centroids = np.mean(np.take(problem.points, problem.cells, axis=0), axis=1)
     flex_num_cells = len(problem.flex_inds)
     flex_cell_centroids = np.take(cell_centroids, problem.flex_inds, axis=0)
 
-    V = np.sum(problem.JxW)
-    avg_elem_V = V/problem.num_cells
+    rmin = get_filter_radius(problem) if rmin is None else rmin
 
-    avg_elem_size = avg_elem_V**(1./problem.dim)
-    rmin = 1.5*avg_elem_size
-
-    kd_tree = scipy.spatial.KDTree(flex_cell_centroids)
-    I = []
-    J = []
-    V = []
-    for i in range(flex_num_cells):
-        num_nbs = 20
-        dd, ii = kd_tree.query(flex_cell_centroids[i], num_nbs)
-        neighbors = np.take(flex_cell_centroids, ii, axis=0)
-        vals = np.where(rmin - dd > 0., rmin - dd, 0.)
-        I += [i]*num_nbs
-        J += ii.tolist()
-        V += vals.tolist()
-    H_sp = scipy.sparse.csc_array((V, (I, J)), shape=(flex_num_cells, flex_num_cells))
-
-    # TODO(Tianju): No need to create the full matrix. 
-    # Will cause memory issue for large size problem.
-    # High priority!
-
-    H = H_sp.todense()
-    Hs = np.sum(H, 1)
+    kd_tree = scipy.spatial.cKDTree(flex_cell_centroids)
+    # output_type='ndarray' keeps the zero distance of each cell to itself
+    pairs = kd_tree.sparse_distance_matrix(kd_tree, rmin,
+                                           output_type='ndarray')
+    vals = np.maximum(rmin - pairs['v'], 0.)
+    H = scipy.sparse.csr_array((vals, (pairs['i'], pairs['j'])),
+                               shape=(flex_num_cells, flex_num_cells))
+    Hs = np.asarray(H.sum(axis=1)).reshape(-1)
     return H, Hs
 
 
+class HelmholtzFilter(FEM):
+    """PDE filter: -r^2*Laplace(rho_f) + rho_f = rho with natural B.C.
+    Reference: Lazarov and Sigmund, "Filters in topology optimization based
+    on Helmholtz-type differential equations", IJNME, 2011.
+    """
+    def custom_init(self, r):
+        self.r = r
+
+    def get_tensor_map(self):
+        def tensor_map(u_grad):
+            return self.r**2*u_grad
+        return tensor_map
+
+    def get_mass_map(self):
+        def mass_map(u, rho):
+            return u - rho
+        return mass_map
+
+
+def compute_filter_helmholtz(problem, rmin=None):
+    """Filter by solving the Helmholtz PDE on the mesh of problem with the
+    FEM solver. The radius r = rmin/(2*sqrt(3)) matches the support of the
+    k-d tree filter.
+
+    Returns
+    -------
+    filter_fn : Callable
+        (flex_num_cells, num_vecs) -> (flex_num_cells, num_vecs)
+    """
+    rmin = get_filter_radius(problem) if rmin is None else rmin
+    filter_problem = HelmholtzFilter(problem.mesh, vec=1, dim=problem.dim,
+                                     ele_type=problem.ele_type,
+                                     additional_info=(rmin/(2.*np.sqrt(3.)),))
+    cell_vols = np.sum(filter_problem.JxW, axis=1)
+    solver_state = SolverState()
+
+    def filter_fn(x):
+        x = np.asarray(x).reshape(len(problem.flex_inds), -1)
+        filtered = []
+        for i in range(x.shape[1]):
+            rho = np.zeros(filter_problem.num_cells)
+            rho[problem.flex_inds] = x[:, i]
+            rho_quads = np.repeat(rho[:, None, None],
+                                  filter_problem.num_quads, axis=1)
+            filter_problem.internal_vars = {'mass': [rho_quads]}
+            sol = solver(filter_problem, linear=True,
+                         solver_state=solver_state)
+            rho_f_quads = np.asarray(
+                filter_problem.convert_from_dof_to_quad(sol))[:, :, 0]
+            rho_f = np.sum(rho_f_quads*filter_problem.JxW, axis=1)/cell_vols
+            filtered.append(rho_f[problem.flex_inds])
+        return np.stack(filtered, axis=1)
+
+    return filter_fn
+
+
+def get_filter(problem, filter_type='kd_tree'):
+    """Returns the dict ft used by applySensitivityFilter.
+    ft['filter_fn'] applies the normalized filter to
+    (flex_num_cells, num_vecs) arrays.
+    """
+    if filter_type == 'kd_tree':
+        H, Hs = compute_filter_kd_tree(problem)
+        filter_fn = lambda x: H @ (np.asarray(x).reshape(H.shape[0], -1) /
+                                   Hs[:, None])
+        return {'H': H, 'Hs': Hs, 'filter_fn': filter_fn}
+    assert filter_type == 'helmholtz', f"Unknown filter {filter_type}"
+    return {'filter_fn': compute_filter_helmholtz(problem)}
+
+
 def applySensitivityFilter(ft, rho, dJ, dvc):
-    dJ = np.matmul(ft['H'], rho*dJ/np.maximum(1e-3, rho)/ft['Hs'][:, None])
-    dvc = np.matmul(ft['H'][None, :, :], rho[None, :, :]*dvc/np.maximum(1e-3, rho[None, :, :])/ft['Hs'][None, :, None])
+    filter_fn = ft['filter_fn']
+    rho = np.asarray(rho)
+    dJ = filter_fn(rho*np.asarray(dJ)/np.maximum(1e-3, rho)).reshape(rho.shape)
+    dvc = np.asarray(dvc)
+    dvc = rho[None, :, :]*dvc/np.maximum(1e-3, rho[None, :, :])
+    # Filter all constraints together, (num_cons, n, 1) -> (n, num_cons)
+    dvc = filter_fn(dvc.reshape(dvc.shape[0], -1).T).T.reshape(dvc.shape)
     return dJ, dvc
 
 
@@ -414,8 +492,9 @@ def subsolv(m,n,epsimin,low,upp,alfa,beta,p0,q0,P,Q,a0,a,b,c,d):
 def optimize(problem, rho_ini, optimizationParams, objectiveHandle, consHandle, numConstraints):
     # TODO: Scale objective function value to be always within 1-100
     # See comments in https://doi.org/10.1016/j.compstruc.2018.01.008
-    H, Hs = compute_filter_kd_tree(problem)
-    ft = {'H':H, 'Hs':Hs}
+    # 'filter' is 'kd_tree' (density weights within rmin) or 'helmholtz'
+    # (PDE filter)
+    ft = get_filter(problem, optimizationParams.get('filter', 'kd_tree'))
 
     rho = rho_ini
 
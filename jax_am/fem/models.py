@@ -6,6 +6,8 @@ from jax_am.fem.core import FEM
 
 
 class LinearPoisson(FEM):
+    share_kernels = True
+
     def get_tensor_map(self):
         return lambda x: x
 
@@ -102,6 +104,8 @@ class Mechanics(FEM):
 
 
 class LinearElasticity(Mechanics):
+    share_kernels = True
+
     def get_tensor_map(self):
         def stress(u_grad):
             E = 70e3
@@ -115,6 +119,8 @@ class LinearElasticity(Mechanics):
 
 
 class HyperElasticity(Mechanics):
+    share_kernels = True
+
     def get_tensor_map(self):
         def psi(F):
             E = 1e3
@@ -137,6 +143,8 @@ class HyperElasticity(Mechanics):
 
 
 class Plasticity(Mechanics):
+    share_kernels = True
+
     def custom_init(self):
         self.epsilons_old = onp.zeros((len(self.cells), self.num_quads, self.vec, self.dim))
         self.sigmas_old = onp.zeros_like(self.epsilons_old)
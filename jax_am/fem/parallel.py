@@ -0,0 +1,168 @@
+"""Domain decomposed, matrix-free assembly and Krylov solve over the local
+devices, used by solver(..., matrix_free='sharded').
+
+Cells are split into contiguous partitions, one per device (Mesh.reorder
+makes the partitions spatially compact). The cell kernels and their
+linearization run on each partition, and the sums over the nodes shared by
+several partitions (the interface reduction) are inserted by XLA from the
+shardings of jax.sharding. The Krylov vectors are split into blocks of dofs,
+one per device.
+
+On CPU, one device per core is created by setting
+XLA_FLAGS=--xla_force_host_platform_device_count=<num_cores>
+before jax is imported.
+"""
+import jax
+import jax.numpy as np
+import numpy as onp
+from jax.sharding import Mesh, NamedSharding, PartitionSpec as P
+
+from jax_am import logger
+
+
+def get_device_mesh(devices=None):
+    """One-dimensional mesh of devices with a single axis 'parts'.
+
+    Parameters
+    ----------
+    devices : List
+        Defaults to jax.devices()
+    """
+    devices = jax.devices() if devices is None else devices
+    return Mesh(onp.array(devices), ('parts', ))
+
+
+def get_partition(problem):
+    """Cell partition of problem over problem.device_mesh (all local devices
+    if not set). The number of cells is padded to a multiple of the number of
+    devices by repeating the last cell, whose contributions are masked out.
+    Only depends on the mesh, so it is cached on the problem.
+
+    Returns
+    -------
+    partition : dict
+        'inds': (num_padded_cells,) cell indices
+        'cells': (num_padded_cells, num_nodes)
+        'sharding': NamedSharding splitting the leading axis
+        'mask': (num_padded_cells,) 0. for padded cells
+        'geometry_inputs': see FEM.get_geometry_inputs
+    """
+    if not hasattr(problem, 'device_mesh'):
+        problem.device_mesh = get_device_mesh()
+    partition = getattr(problem, 'partition', None)
+    if (partition is None or
+            partition['device_mesh'] is not problem.device_mesh):
+        num_parts = problem.device_mesh.size
+        num_padded_cells = -(-problem.num_cells // num_parts) * num_parts
+        logger.debug(f"Partitioning {problem.num_cells} cells over "
+                     f"{num_parts} devices")
+        inds = onp.minimum(onp.arange(num_padded_cells), problem.num_cells - 1)
+        sharding = NamedSharding(problem.device_mesh, P('parts'))
+        mask = (onp.arange(num_padded_cells) <
+                problem.num_cells).astype(onp.float64)
+        partition = {
+            'device_mesh': problem.device_mesh,
+            'inds': inds,
+            'cells': onp.asarray(problem.cells)[inds],
+            'sharding': sharding,
+            'mask': jax.device_put(np.array(mask), sharding),
+            'geometry_inputs': [jax.device_put(x, sharding)
+                                for x in problem.get_geometry_inputs(inds)]
+        }
+        problem.partition = partition
+    return partition
+
+
+def linearize_sharded(problem, sol):
+    """Sharded counterpart of FEM.linearize: sets problem.A_jvp and
+    problem.A_diag, whose cell parts run on all devices of the partition.
+
+    Parameters
+    ----------
+    sol : np.DeviceArray
+        (num_total_nodes, vec)
+
+    Returns
+    -------
+    res : np.DeviceArray
+        (num_total_nodes, vec)
+    """
+    assert problem.cauchy_bc_info is None, \
+        f"Cauchy B.C. are not supported with sharded assembly yet"
+    partition = get_partition(problem)
+    cells, sharding = partition['cells'], partition['sharding']
+    mask, geometry_inputs = partition['mask'], partition['geometry_inputs']
+    vmap_kernel = problem.get_vmap_cell_fn(False)
+    kernel_vars = jax.tree_map(
+        lambda x: jax.device_put(x[partition['inds']], sharding),
+        problem.unpack_kernels_vars(**problem.internal_vars))
+
+    def cell_residual(cells_sol):
+        weak_form = vmap_kernel(cells_sol, *geometry_inputs, *kernel_vars)
+        return weak_form * mask[:, None, None]
+
+    cells_sol = jax.device_put(np.asarray(sol)[cells], sharding)
+    weak_form, cells_jvp = jax.linearize(cell_residual, cells_sol)
+
+    def A_jvp(inc_sol):
+        inc_cells_sol = jax.lax.with_sharding_constraint(inc_sol[cells],
+                                                         sharding)
+        return problem.assemble_nodal(cells_jvp(inc_cells_sol), cells,
+                                      'partition')
+
+    num_local_dofs = problem.num_nodes * problem.vec
+    cells_diag = []
+    for k in range(num_local_dofs):
+        basis = np.zeros(num_local_dofs).at[k].set(1.).reshape(
+            problem.num_nodes, problem.vec)
+        basis = jax.device_put(np.broadcast_to(basis, cells_sol.shape),
+                               sharding)
+        cells_diag.append(cells_jvp(basis).reshape(-1, num_local_dofs)[:, k])
+    cells_diag = np.stack(cells_diag, axis=1)
+
+    problem.A_jvp = A_jvp
+    problem.A_diag = problem.assemble_nodal(cells_diag, cells,
+                                            'partition').reshape(-1)
+    res = problem.assemble_nodal(weak_form, cells, 'partition')
+    res, problem.body_force, problem.neumann = \
+        problem.add_face_and_source_terms(sol, res, **problem.internal_vars)
+    return res
+
+
+def sharded_bicgstab(problem, A_fn, b, x0, pc, tol=1e-10, atol=1e-10,
+                     maxiter=10000):
+    """BiCGSTAB on vectors split into blocks of dofs over the devices of
+    problem.device_mesh. The vectors are padded to a multiple of the number
+    of devices, the operator is the identity on the padding.
+
+    Returns
+    -------
+    x : np.DeviceArray
+        (num_total_dofs,)
+    """
+    if not hasattr(problem, 'device_mesh'):
+        problem.device_mesh = get_device_mesh()
+    sharding = NamedSharding(problem.device_mesh, P('parts'))
+    num_dofs = len(b)
+    num_pads = -num_dofs % problem.device_mesh.size
+    pad_mask = np.arange(num_dofs + num_pads) >= num_dofs
+
+    def pad(x):
+        return jax.lax.with_sharding_constraint(np.pad(x, (0, num_pads)),
+                                                sharding)
+
+    def A_fn_padded(x):
+        return pad(A_fn(x[:num_dofs])) + np.where(pad_mask, x, 0.)
+
+    def pc_padded(x):
+        return pad(pc(x[:num_dofs]))
+
+    M = None if pc is None else pc_padded
+    x, info = jax.scipy.sparse.linalg.bicgstab(A_fn_padded,
+                                               pad(b),
+                                               x0=pad(x0),
+                                               M=M,
+                                               tol=tol,
+                                               atol=atol,
+                                               maxiter=maxiter)
+    return x[:num_dofs]
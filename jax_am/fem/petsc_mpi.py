@@ -0,0 +1,312 @@
+"""MPI parallel Newton solver with distributed PETSc matrices.
+
+Run a script calling mpi_solver with, e.g., mpirun -n 4 python script.py.
+Every rank builds the same problem, and the cells are partitioned over the
+ranks with a graph partitioner (partition_cells). A rank only evaluates the
+kernels of its own cells and owns the rows of the nodes whose lowest-ranked
+cell it owns, numbered contiguously as PETSc requires. The Jacobian is a
+distributed AIJ (MPIAIJ) matrix whose preallocation comes from the COO
+pattern of the local cells
+(setPreallocationCOO), so that each Newton iteration only sends the per cell
+values V (setValuesCOO). Contributions to rows of other ranks are
+communicated by PETSc.
+
+The mesh and the solution vector are replicated on all ranks, and solutions
+are gathered back to the (num_total_nodes, vec) layout after each solve.
+"""
+import time
+import numpy as onp
+import jax.numpy as np
+import scipy
+from petsc4py import PETSc
+
+from jax_am import logger
+from jax_am.fem.generate_mesh import get_rcm_node_order
+from jax_am.fem.solver import apply_bc_vec, assign_bc, copy_bc
+
+
+def get_dual_graph(cells):
+    """Dual graph of the mesh: cells are adjacent if they share a node.
+
+    Returns
+    -------
+    dual : scipy.sparse.csr_matrix
+        (num_cells, num_cells) without diagonal
+    """
+    cells = onp.asarray(cells)
+    num_cells, num_nodes = cells.shape
+    incidence = scipy.sparse.csr_matrix(
+        (onp.ones(cells.size), (onp.repeat(onp.arange(num_cells), num_nodes),
+                                cells.reshape(-1))))
+    dual = scipy.sparse.csr_matrix(incidence @ incidence.T)
+    dual.setdiag(0)
+    dual.eliminate_zeros()
+    return dual
+
+
+def rcm_partition_cells(cells, num_parts):
+    """Partition of the cells without a graph partitioner: the dual graph
+    is ordered with reverse Cuthill-McKee, whose level sets sweep the mesh,
+    and split into contiguous parts of equal size. Parts are compact, but
+    the edge cut is not minimized.
+
+    Returns
+    -------
+    cell_parts : onp.ndarray
+        (num_cells,) part of each cell
+    """
+    num_cells = len(cells)
+    dual = get_dual_graph(cells)
+    order = get_rcm_node_order(onp.stack((dual.nonzero()), axis=1), num_cells)
+    cell_parts = onp.empty(num_cells, dtype=onp.int64)
+    cell_parts[order] = onp.arange(num_cells) * num_parts // num_cells
+    return cell_parts
+
+
+def partition_cells(cells, comm=None):
+    """Partition of the cells over the ranks of comm, computed by PETSc
+    MatPartitioning on the dual graph with ParMETIS or PT-Scotch, which
+    minimize the edge cut between balanced parts (the type can be changed
+    with -mat_partitioning_type). Each rank passes a contiguous block of
+    rows of the graph, and the parts are gathered on all ranks.
+
+    If PETSc is built with neither, falls back to rcm_partition_cells.
+
+    Returns
+    -------
+    cell_parts : onp.ndarray
+        (num_cells,) part (rank) of each cell
+    """
+    comm = PETSc.COMM_WORLD if comm is None else comm
+    rank, size = comm.getRank(), comm.getSize()
+    num_cells = len(cells)
+    if size == 1:
+        return onp.zeros(num_cells, dtype=onp.int64)
+    part_types = [part_type for part_type in ('parmetis', 'ptscotch')
+                  if PETSc.Sys.hasExternalPackage(part_type)]
+    if len(part_types) == 0:
+        logger.warning(f"PETSc has no graph partitioner (ParMETIS or "
+                       f"PT-Scotch), splitting the cells along an RCM order")
+        return rcm_partition_cells(cells, size)
+
+    start, end = num_cells * rank // size, num_cells * (rank + 1) // size
+    local_dual = get_dual_graph(cells)[start:end]
+    adj = PETSc.Mat().createAdj(
+        ((end - start, num_cells), (None, num_cells)),
+        csr=(local_dual.indptr.astype(PETSc.IntType),
+             local_dual.indices.astype(PETSc.IntType)), comm=comm)
+    part = PETSc.MatPartitioning().create(comm=comm)
+    part.setAdjacency(adj)
+    part.setType(part_types[0])
+    part.setFromOptions()
+    local_parts = PETSc.IS()
+    part.apply(local_parts)
+
+    parts = PETSc.Vec().createMPI((end - start, num_cells), comm=comm)
+    parts.setArray(local_parts.getIndices().astype(PETSc.ScalarType))
+    scatter, parts_all = PETSc.Scatter.toAll(parts)
+    scatter.scatter(parts, parts_all, addv=PETSc.InsertMode.INSERT,
+                    mode=PETSc.ScatterMode.FORWARD)
+    cell_parts = onp.rint(parts_all.getArray().real).astype(onp.int64)
+    for obj in (adj, part, local_parts, parts, scatter, parts_all):
+        obj.destroy()
+    logger.debug(f"Cells partitioned with {part_types[0]}")
+    return cell_parts
+
+
+def get_mpi_partition(problem):
+    """Cell partition, dof ownership and local COO pattern of the ranks of
+    PETSc.COMM_WORLD. Computed once and cached on the problem.
+
+    Returns
+    -------
+    partition : dict
+        'local_cells': (num_local_cells,) cells of this rank
+        'dof_map': (num_total_dofs,) PETSc dof of each dof
+        'dof_perm': (num_total_dofs,) dof of each PETSc dof
+        'ownership': (start, end) PETSc rows of this rank
+        'cell_dofs': (num_local_cells, num_nodes*vec) PETSc dofs of the local
+        cells
+    """
+    if hasattr(problem, 'mpi_partition'):
+        return problem.mpi_partition
+    comm = PETSc.COMM_WORLD
+    rank, size = comm.getRank(), comm.getSize()
+    cells = onp.asarray(problem.cells)
+    cell_parts = partition_cells(cells, comm)
+
+    # A node is owned by the lowest rank among its cells
+    node_owners = onp.full(problem.num_total_nodes, size)
+    onp.minimum.at(node_owners, cells.reshape(-1),
+                   onp.repeat(cell_parts, problem.num_nodes))
+    node_perm = onp.argsort(node_owners, kind='stable')
+    node_map = onp.argsort(node_perm)
+    dof_map = (problem.vec * node_map[:, None] +
+               onp.arange(problem.vec)[None, :]).reshape(-1)
+    num_owned_dofs = onp.bincount(node_owners, minlength=size) * problem.vec
+    start = int(onp.sum(num_owned_dofs[:rank]))
+
+    local_cells = onp.flatnonzero(cell_parts == rank)
+    cell_dofs = dof_map.reshape(problem.num_total_nodes, problem.vec)[
+        cells[local_cells]].reshape(len(local_cells), -1)
+    logger.debug(f"Rank {rank}: {len(local_cells)} cells, "
+                 f"{num_owned_dofs[rank]} dofs")
+    problem.mpi_partition = {
+        'local_cells': local_cells,
+        'dof_map': dof_map.astype(PETSc.IntType),
+        'dof_perm': onp.argsort(dof_map),
+        'ownership': (start, start + int(num_owned_dofs[rank])),
+        'cell_dofs': cell_dofs.astype(PETSc.IntType)
+    }
+    return problem.mpi_partition
+
+
+def create_mpi_matrix(problem):
+    """MPIAIJ matrix preallocated from the COO pattern of the local cells."""
+    partition = get_mpi_partition(problem)
+    start, end = partition['ownership']
+    cell_dofs = partition['cell_dofs']
+    num_local_dofs = cell_dofs.shape[1]
+    I = onp.repeat(cell_dofs[:, :, None], num_local_dofs, axis=2).reshape(-1)
+    J = onp.repeat(cell_dofs[:, None, :], num_local_dofs, axis=1).reshape(-1)
+    A = PETSc.Mat().create(comm=PETSc.COMM_WORLD)
+    A.setSizes(((end - start, problem.num_total_dofs),
+                (end - start, problem.num_total_dofs)))
+    A.setType('aij')
+    A.setPreallocationCOO(I, J)
+    # Dirichlet rows are zeroed in place, the COO pattern must stay valid
+    A.setOption(PETSc.Mat.Option.KEEP_NONZERO_PATTERN, True)
+    return A
+
+
+def gather_vec(x, problem):
+    """Distributed PETSc vector -> (num_total_dofs,) array on all ranks, in
+    the original dof order."""
+    scatter, x_all = PETSc.Scatter.toAll(x)
+    scatter.scatter(x, x_all, addv=PETSc.InsertMode.INSERT,
+                    mode=PETSc.ScatterMode.FORWARD)
+    vec = x_all.getArray()[get_mpi_partition(problem)['dof_map']]
+    scatter.destroy()
+    x_all.destroy()
+    return vec
+
+
+def mpi_newton_update(problem, dofs, A, r):
+    """Assemble the residual into r and the Jacobian into A from the local
+    cells, with Dirichlet rows eliminated.
+
+    Returns
+    -------
+    res_vec : np.DeviceArray
+        (num_total_dofs,) residual on all ranks
+    """
+    partition = get_mpi_partition(problem)
+    local_cells = partition['local_cells']
+    sol = dofs.reshape(problem.num_total_nodes, problem.vec)
+    cells_sol = sol[problem.cells[local_cells]]
+    weak_form, cells_jac = problem.compute_cells(local_cells, cells_sol, onp,
+                                                 True, **problem.internal_vars)
+    A.setValuesCOO(onp.asarray(cells_jac, dtype=PETSc.ScalarType).reshape(-1))
+
+    r.zeroEntries()
+    r.setValues(partition['cell_dofs'].reshape(-1),
+                onp.asarray(weak_form).reshape(-1),
+                addv=PETSc.InsertMode.ADD_VALUES)
+    if PETSc.COMM_WORLD.getRank() == 0:
+        # Source and Neumann terms of the whole mesh are added once
+        other_terms, problem.body_force, problem.neumann = \
+            problem.add_face_and_source_terms(sol, np.zeros_like(sol),
+                                              **problem.internal_vars)
+        r.setValues(partition['dof_map'], onp.asarray(other_terms).reshape(-1),
+                    addv=PETSc.InsertMode.ADD_VALUES)
+    r.assemblyBegin()
+    r.assemblyEnd()
+    res_vec = apply_bc_vec(np.array(gather_vec(r, problem)), dofs, problem)
+
+    bc_rows = onp.hstack(
+        [onp.array(node_inds) * problem.vec + vec_inds
+         for node_inds, vec_inds in zip(problem.node_inds_list,
+                                        problem.vec_inds_list)] +
+        [onp.array([], dtype=onp.int64)]).astype(onp.int64)
+    start, end = partition['ownership']
+    bc_rows = partition['dof_map'][bc_rows]
+    bc_rows = bc_rows[(bc_rows >= start) & (bc_rows < end)]
+    A.zeroRows(bc_rows, diag=1.)
+    return res_vec
+
+
+def mpi_solver(problem, linear=False, precond=True, initial_guess=None,
+               tol=1e-6):
+    """Newton solver with row elimination of Dirichlet B.C. (see
+    solver.solver_row_elimination) on all ranks of PETSc.COMM_WORLD.
+
+    Parameters
+    ----------
+    precond : bool or str
+        True: block Jacobi with ILU blocks; False: none; 'amg': PETSc gamg;
+        'hypre': BoomerAMG
+    initial_guess : np.DeviceArray
+        (num_total_nodes, vec)
+
+    Returns
+    -------
+    sol : np.DeviceArray
+        (num_total_nodes, vec) on all ranks
+    """
+    assert (problem.periodic_bc_info is None and
+            problem.cauchy_bc_info is None), \
+        f"Periodic and Cauchy B.C. are not supported by the MPI solver yet"
+    start_time = time.time()
+    partition = get_mpi_partition(problem)
+    start, end = partition['ownership']
+    A = create_mpi_matrix(problem)
+    x, r = A.createVecs()
+    rhs = r.duplicate()
+
+    ksp = PETSc.KSP().create(comm=PETSc.COMM_WORLD)
+    ksp.setOperators(A)
+    ksp.setType('bcgsl')
+    if precond in ['amg', 'gamg']:
+        ksp.pc.setType('gamg')
+    elif precond == 'hypre':
+        assert PETSc.Sys.hasExternalPackage('hypre'), \
+            f"PETSc is not built with hypre"
+        ksp.pc.setType('hypre')
+    elif precond:
+        ksp.pc.setType('bjacobi')
+    else:
+        ksp.pc.setType('none')
+    ksp.setTolerances(rtol=1e-10, atol=1e-10, max_it=10000)
+    ksp.setFromOptions()
+
+    if initial_guess is None:
+        dofs = assign_bc(np.zeros(problem.num_total_dofs), problem)
+    else:
+        dofs = np.array(initial_guess).reshape(-1)
+
+    res_vec = mpi_newton_update(problem, dofs, A, r)
+    res_val = np.linalg.norm(res_vec)
+    logger.debug(f"Before, res l_2 = {res_val}")
+    while res_val > tol:
+        # Lift: the increment carries the remaining B.C. values
+        x0 = assign_bc(np.zeros_like(dofs), problem) - copy_bc(dofs, problem)
+        rhs.setArray(onp.asarray(-res_vec)[partition['dof_perm'][start:end]])
+        x.setArray(onp.asarray(x0)[partition['dof_perm'][start:end]])
+        ksp.setInitialGuessNonzero(True)
+        ksp.solve(rhs, x)
+        logger.debug(f"PETSc MPI - {ksp.getType()} with "
+                     f"{ksp.pc.getType()} took "
+                     f"{ksp.getIterationNumber()} iterations")
+        dofs = dofs + np.array(gather_vec(x, problem))
+        res_vec = mpi_newton_update(problem, dofs, A, r)
+        res_val = np.linalg.norm(res_vec)
+        logger.debug(f"res l_2 = {res_val}")
+        if linear:
+            break
+
+    for obj in (ksp, A, x, r, rhs):
+        obj.destroy()
+    assert np.all(np.isfinite(dofs)), f"dofs contains NaN, stop the program!"
+    logger.info(f"MPI solve on {PETSc.COMM_WORLD.getSize()} ranks took "
+                f"{time.time() - start_time} [s]")
+    return dofs.reshape(problem.num_total_nodes, problem.vec)
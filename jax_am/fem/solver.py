@@ -1,65 +1,402 @@
+import copy
+import weakref
 import jax
 import jax.numpy as np
 import numpy as onp
 from jax.experimental.sparse import BCOO
 import scipy
+from scipy.sparse.csgraph import connected_components
+from scipy.sparse.linalg import splu
 import time
 
 # petsc4py.init()
 from petsc4py import PETSc
 
 from jax_am import logger
+from jax_am.fem import amg
+from jax_am.fem.parallel import linearize_sharded, sharded_bicgstab
 
 ################################################################################
 # PETSc linear solver or JAX linear solver
 
+# precond options that select a sparse direct solver
+DIRECT_SOLVERS = ('lu', 'cholesky')
 
-def petsc_solve(A, b, ksp_type, pc_type):
-    rhs = PETSc.Vec().createSeq(len(b))
-    rhs.setValues(range(len(b)), onp.array(b))
-    ksp = PETSc.KSP().create()
-    ksp.setOperators(A)
-    ksp.setFromOptions()
-    ksp.setType(ksp_type)
-    ksp.pc.setType(pc_type)
+
+class SolverState:
+    """Linear solver data kept between solves, so that nearly identical
+    systems of successive Newton iterations or time steps are solved faster.
+    Pass the same instance to every call of solver().
+
+    Parameters
+    ----------
+    pc_update_interval : int
+        The preconditioner (JAX, or the PC of the persistent PETSc KSP) is
+        recomputed every pc_update_interval linear solves. 1 recomputes it
+        for every solve.
+    jac_update_interval : int
+        The tangent matrix is recomputed every jac_update_interval Newton
+        iterations (modified Newton if > 1). Only the residual is evaluated
+        in between. The first iteration of every solve computes it.
+    warm_start : bool
+        Start the Krylov solver from the previous increment
+    """
+
+    def __init__(self, pc_update_interval=1, jac_update_interval=1,
+                 warm_start=True):
+        self.pc_update_interval = pc_update_interval
+        self.jac_update_interval = jac_update_interval
+        self.warm_start = warm_start
+        self.pc = None
+        self.pc_age = None
+        self.jac_age = None
+        self.inc = None
+        self.ksp = None
+
+    def pc_needs_update(self):
+        """Count one more use of the preconditioner, return True if it must
+        be recomputed first.
+        """
+        update = self.pc_age is None or self.pc_age >= self.pc_update_interval
+        self.pc_age = 1 if update else self.pc_age + 1
+        return update
+
+    def jac_needs_update(self):
+        """Same as pc_needs_update for the tangent matrix."""
+        update = (self.jac_age is None or
+                  self.jac_age >= self.jac_update_interval)
+        self.jac_age = 1 if update else self.jac_age + 1
+        return update
+
+    def get_jax_pc(self, problem, precond, matrix_free):
+        if self.pc_needs_update():
+            self.pc = get_preconditioner(problem, precond, matrix_free)
+        else:
+            logger.debug(f"Reusing preconditioner")
+        return self.pc
+
+    def get_ksp(self, A, ksp_type, pc_type):
+        if self.ksp is None:
+            self.ksp = PETSc.KSP().create()
+            self.ksp.setFromOptions()
+        self.ksp.setType(ksp_type)
+        if self.ksp.pc.getType() != pc_type:
+            self.ksp.pc.setType(pc_type)
+        self.ksp.setOperators(A)
+        self.ksp.pc.setReusePreconditioner(not self.pc_needs_update())
+        return self.ksp
+
+    def get_initial_guess(self, x0, problem):
+        """Previous increment with the B.C. rows of x0"""
+        if (not self.warm_start or self.inc is None or
+                self.inc.shape != x0.shape):
+            return x0
+        return x0 + assign_zeros_bc(np.array(self.inc), problem)
+
+
+# Work vectors of petsc_solve, one set per system size
+_petsc_work_vecs = {}
+
+
+def get_petsc_work_vecs(size):
+    """Persistent (rhs, x, y) vectors of the given size. petsc_solve places
+    its own arrays in them (placeArray), so they are never filled by copy.
+    """
+    if size not in _petsc_work_vecs:
+        _petsc_work_vecs[size] = [PETSc.Vec().createSeq(size)
+                                  for _ in range(3)]
+    return _petsc_work_vecs[size]
+
+
+def as_petsc_array(x):
+    """x as a contiguous, writable 1D NumPy array of PETSc.ScalarType.
+    NumPy arrays that already qualify are returned without a copy. JAX
+    arrays are read-only when viewed from NumPy and are copied once.
+    """
+    return onp.require(onp.asarray(x).reshape(-1), dtype=PETSc.ScalarType,
+                       requirements=['C', 'W'])
+
+
+def get_petsc_matrix(problem, A_sp_scipy, name='petsc_A'):
+    """PETSc AIJ matrix of A_sp_scipy, stored as attribute name of the
+    problem. The matrix is created once. Since the sparsity pattern is
+    cached (see FEM.compute_sparsity_pattern), later calls only replace its
+    values with setValuesCSR.
+    """
+    indptr = A_sp_scipy.indptr.astype(PETSc.IntType, copy=False)
+    indices = A_sp_scipy.indices.astype(PETSc.IntType, copy=False)
+    A = getattr(problem, name, None)
+    if A is None or A.getSize() != A_sp_scipy.shape:
+        # Index dtypes must match the PETSc build (32/64-bit), see
+        # https://scicomp.stackexchange.com/a/2356
+        A = PETSc.Mat().createAIJ(size=A_sp_scipy.shape,
+                                  csr=(indptr, indices, A_sp_scipy.data))
+        # Zeroed rows must keep their entries for the next setValuesCSR
+        A.setOption(PETSc.Mat.Option.KEEP_NONZERO_PATTERN, True)
+        setattr(problem, name, A)
+    else:
+        logger.debug(f"Reusing PETSc matrix, updating values only")
+        A.setValuesCSR(indptr, indices, A_sp_scipy.data)
+        A.assemble()
+    # The values are no longer those of a Linearization
+    problem.__dict__.pop(name + '_owner', None)
+    return A
+
+
+def petsc_solve(A, b, ksp_type, pc_type, near_nullspace=None, x0=None,
+                solver_state=None, check_residual=False):
+    """Solve A x = b with a PETSc KSP.
+
+    b and x0 are exchanged with PETSc without extra copies: the persistent
+    work vectors wrap their NumPy buffers. The returned solution owns its
+    memory and is not overwritten by later solves.
+
+    Parameters
+    ----------
+    check_residual : bool
+        Compute and log ||A x - b||, which costs one more matrix product
+    """
+    rhs, x, y = get_petsc_work_vecs(len(b))
+    b = as_petsc_array(b)
+    if x0 is None:
+        sol = onp.zeros(len(b), dtype=PETSc.ScalarType)
+    else:
+        sol = onp.array(x0, dtype=PETSc.ScalarType).reshape(-1)
+    if near_nullspace is not None:
+        # PETSc requires orthonormal vectors
+        Q, _ = onp.linalg.qr(near_nullspace)
+        vectors = [PETSc.Vec().createWithArray(onp.array(Q[:, i]))
+                   for i in range(Q.shape[1])]
+        A.setNearNullSpace(PETSc.NullSpace().create(vectors=vectors))
+    if solver_state is None:
+        ksp = PETSc.KSP().create()
+        ksp.setOperators(A)
+        ksp.setFromOptions()
+        ksp.setType(ksp_type)
+        ksp.pc.setType(pc_type)
+    else:
+        ksp = solver_state.get_ksp(A, ksp_type, pc_type)
     logger.debug(
         f'PETSc - Solving with ksp_type = {ksp.getType()}, '
         f'pc = {ksp.pc.getType()}'
     )
-    x = PETSc.Vec().createSeq(len(b))
-    ksp.solve(rhs, x)
+    ksp.setInitialGuessNonzero(x0 is not None)
+    rhs.placeArray(b)
+    x.placeArray(sol)
+    try:
+        ksp.solve(rhs, x)
+        if check_residual:
+            A.mult(x, y)
+            y.axpy(-1., rhs)
+            logger.debug(f"PETSc linear solve res = {y.norm()}")
+    finally:
+        rhs.resetArray()
+        x.resetArray()
 
-    # Verify convergence
-    y = PETSc.Vec().createSeq(len(b))
-    A.mult(x, y)
+    return sol
+
+
+class DirectSolver:
+    """Sparse direct solver of an assembled system.
+
+    The sparsity pattern of the global matrix is fixed, so the symbolic
+    analysis is only done at the first factorization: PETSc keeps it in
+    its persistent preonly KSP, and with SuperLU (scipy) the fill-reducing
+    column ordering is computed once and reused. The numeric factorization
+    is reused as long as the matrix values do not change, e.g., for the
+    transposed (adjoint) solve after a linear forward solve, or across the
+    iterations of a modified Newton solver.
+
+    Parameters
+    ----------
+    factor_type : str
+        'lu' or 'cholesky' (symmetric matrices only). SuperLU always
+        factorizes with LU.
+    use_petsc : bool
+        Factorize with PETSc, with SuperLU otherwise
+    """
+
+    def __init__(self, factor_type='lu', use_petsc=False):
+        self.factor_type = factor_type
+        self.use_petsc = use_petsc
+        self.data = None
+        self.ksp = None
+        self.lu = None
+        self.col_order = None
+        self.lu_col_order = None
+
+    def factorize(self, A_sp_scipy, A_petsc=None):
+        """Factorize A_sp_scipy, or A_petsc (same values) with PETSc,
+        unless the values are those of the current factorization.
+        """
+        if (self.data is not None and self.data.shape == A_sp_scipy.data.shape
+                and onp.array_equal(self.data, A_sp_scipy.data)):
+            logger.debug(f"Reusing numeric factorization")
+            if self.use_petsc:
+                self.ksp.pc.setReusePreconditioner(True)
+            return
+        self.data = onp.array(A_sp_scipy.data)
+        start = time.time()
+        if self.use_petsc:
+            if self.ksp is None:
+                self.ksp = PETSc.KSP().create()
+                self.ksp.setType('preonly')
+                self.ksp.pc.setType(self.factor_type)
+                self.ksp.setFromOptions()
+            self.ksp.setOperators(A_petsc)
+            self.ksp.pc.setReusePreconditioner(False)
+            self.ksp.setUp()
+        else:
+            A_csc = scipy.sparse.csc_matrix(A_sp_scipy)
+            if self.col_order is None:
+                self.lu = splu(A_csc, permc_spec='COLAMD')
+                # L U = P_r A P_c, and A P_c = A[:, argsort(perm_c)]
+                self.col_order = onp.argsort(self.lu.perm_c)
+                self.lu_col_order = None
+            else:
+                self.lu = splu(A_csc[:, self.col_order], permc_spec='NATURAL')
+                self.lu_col_order = self.col_order
+        logger.debug(f"Numeric factorization took {time.time() - start} [s]")
+
+    def solve_host(self, b, transpose=False):
+        b = onp.asarray(b, dtype=onp.float64)
+        if self.use_petsc:
+            return petsc_ksp_solve(self.ksp, b, transpose)
+        trans = 'T' if transpose else 'N'
+        order = self.lu_col_order
+        if order is None:
+            return self.lu.solve(b, trans=trans)
+        if transpose:
+            # (A[:, order])^T = A^T[order, :]
+            return self.lu.solve(b[order], trans=trans)
+        sol = onp.empty_like(b)
+        sol[order] = self.lu.solve(b)
+        return sol
+
+    def solve(self, b, transpose=False):
+        """Solve A x = b (A^T x = b if transpose) with the current
+        factorization. Goes through jax.pure_callback, so b may be traced.
+        """
+        def solve_fn(b):
+            return self.solve_host(b, transpose).astype(b.dtype)
 
-    err = np.linalg.norm(y.getArray() - rhs.getArray())
-    logger.debug(f"PETSc linear solve res = {err}")
-    # assert err < 0.1, f"PETSc linear solver failed to converge, err = {err}"
+        return jax.pure_callback(solve_fn,
+                                 jax.ShapeDtypeStruct(b.shape, b.dtype), b)
 
-    return x.getArray()
+
+def get_direct_solver(problem, factor_type, use_petsc, reduced=False):
+    """DirectSolver of the row eliminated system (of the reduced system if
+    reduced), cached on the problem and factorized for the current tangent.
+    The row eliminated matrix is not symmetric, its Dirichlet columns are
+    kept, so 'cholesky' requires the reduced system.
+    """
+    assert reduced or factor_type != 'cholesky', \
+        f"Cholesky requires a symmetric matrix, use reduced=True or 'lu'"
+    if not hasattr(problem, 'direct_solvers'):
+        problem.direct_solvers = {}
+    key = (factor_type, use_petsc, reduced)
+    if key not in problem.direct_solvers:
+        problem.direct_solvers[key] = DirectSolver(factor_type, use_petsc)
+    direct_solver = problem.direct_solvers[key]
+    if reduced:
+        A_sp_scipy = assemble_reduced_csr(problem)
+        A_petsc = get_petsc_matrix(problem, A_sp_scipy,
+                                   'petsc_A_reduced') if use_petsc else None
+    else:
+        A_sp_scipy = get_row_eliminated_csr(problem)
+        # Row eliminated by get_A_fn
+        A_petsc = problem.petsc_A if use_petsc else None
+    direct_solver.factorize(A_sp_scipy, A_petsc)
+    return direct_solver
+
+
+def petsc_ksp_solve(ksp, b, transpose=False):
+    """Solve with an already set up KSP, see petsc_solve for the array
+    exchange. transpose solves with the transposed operator.
+    """
+    rhs, x, _ = get_petsc_work_vecs(len(b))
+    sol = onp.zeros(len(b), dtype=PETSc.ScalarType)
+    rhs.placeArray(as_petsc_array(b))
+    x.placeArray(sol)
+    try:
+        if transpose:
+            ksp.solveTranspose(rhs, x)
+        else:
+            ksp.solve(rhs, x)
+    finally:
+        rhs.resetArray()
+        x.resetArray()
+    return sol
+
+
+def get_petsc_pc(problem, precond):
+    """PETSc preconditioner type and near-nullspace for the precond option.
+    'amg' selects the smoothed aggregation AMG of PETSc (gamg). Any other
+    option keeps the default ILU.
+    """
+    if precond in ('amg', 'gamg'):
+        return 'gamg', amg.get_near_nullspace(problem)
+    if precond == 'hypre':
+        assert PETSc.Sys.hasExternalPackage('hypre'), \
+            f"PETSc is not built with hypre"
+        return 'hypre', None
+    return 'ilu', None
 
 
-def jax_solve(problem, A_fn, b, x0, precond: bool, pc_matrix=None):
+def get_preconditioner(problem, precond, matrix_free=False):
+    """Preconditioner of the JAX Krylov solver.
+
+    Parameters
+    ----------
+    precond : bool or str
+        False: none, True or 'jacobi': Jacobi, 'amg': smoothed aggregation
+        AMG (see jax_am.fem.amg)
+
+    Returns
+    -------
+    pc : Callable or None
+    """
+    if not precond:
+        return None
+    if precond is True or precond == 'jacobi':
+        return get_jacobi_precond(jacobi_preconditioner(problem, matrix_free))
+    assert precond == 'amg', f"Unknown preconditioner {precond}"
+    assert not matrix_free, f"AMG requires the assembled matrix"
+    return amg.get_amg_precond(problem)
+
+
+def jax_solve(problem, A_fn, b, x0, precond, pc_matrix=None,
+              matrix_free: bool = False, solver_state=None):
     """Solves the equilibrium equation using a JAX solver.
     Is fully traceable and runs on GPU.
 
     Parameters
     ----------
     precond
-        Whether to calculate the preconditioner or not
+        The preconditioner to use, see get_preconditioner
     pc_matrix
         The matrix to use as preconditioner
+    matrix_free
+        If True, the Jacobi preconditioner is built from problem.A_diag
+        instead of the assembled matrix. If 'sharded', the Krylov vectors are
+        also split over the devices, see parallel.sharded_bicgstab
+    solver_state
+        SolverState that keeps the preconditioner between solves
     """
-    pc = get_jacobi_precond(
-        jacobi_preconditioner(problem)) if precond else None
-    x, info = jax.scipy.sparse.linalg.bicgstab(A_fn,
-                                               b,
-                                               x0=x0,
-                                               M=pc,
-                                               tol=1e-10,
-                                               atol=1e-10,
-                                               maxiter=10000)
+    if solver_state is None:
+        pc = get_preconditioner(problem, precond, matrix_free)
+    else:
+        pc = solver_state.get_jax_pc(problem, precond, matrix_free)
+    if matrix_free == 'sharded':
+        x = sharded_bicgstab(problem, A_fn, b, x0, pc)
+    else:
+        x, info = jax.scipy.sparse.linalg.bicgstab(A_fn,
+                                                   b,
+                                                   x0=x0,
+                                                   M=pc,
+                                                   tol=1e-10,
+                                                   atol=1e-10,
+                                                   maxiter=10000)
 
     # Verify convergence
     err = np.linalg.norm(A_fn(x) - b)
@@ -80,7 +417,8 @@ def jax_solve(problem, A_fn, b, x0, precond: bool, pc_matrix=None):
 # "row elimination" solver
 
 
-def apply_bc_vec(res_vec, dofs, problem):
+def apply_bc_vec(res_vec, dofs, problem, vals_list=None):
+    vals_list = problem.vals_list if vals_list is None else vals_list
     sol = dofs.reshape((problem.num_total_nodes, problem.vec))
     res = res_vec.reshape(sol.shape)
     for i in range(len(problem.node_inds_list)):
@@ -88,7 +426,7 @@ def apply_bc_vec(res_vec, dofs, problem):
             sol[problem.node_inds_list[i], problem.vec_inds_list[i]],
             unique_indices=True))
         res = res.at[problem.node_inds_list[i],
-                     problem.vec_inds_list[i]].add(-problem.vals_list[i])
+                     problem.vec_inds_list[i]].add(-vals_list[i])
     return res.reshape(-1)
 
 
@@ -119,11 +457,12 @@ def row_elimination(fn, problem):
     return fn_dofs_row
 
 
-def assign_bc(dofs, problem):
+def assign_bc(dofs, problem, vals_list=None):
+    vals_list = problem.vals_list if vals_list is None else vals_list
     sol = dofs.reshape((problem.num_total_nodes, problem.vec))
     for i in range(len(problem.node_inds_list)):
         sol = sol.at[problem.node_inds_list[i],
-                     problem.vec_inds_list[i]].set(problem.vals_list[i])
+                     problem.vec_inds_list[i]].set(vals_list[i])
     return sol.reshape(-1)
 
 
@@ -154,6 +493,43 @@ def copy_bc(dofs, problem):
     return new_sol.reshape(-1)
 
 
+def get_bc_dofs(problem):
+    """Dofs with a Dirichlet B.C., cached on the problem.
+
+    The cache is keyed on node_inds_list and vec_inds_list, which
+    FEM.update_Dirichlet_boundary_conditions replaces. If the dofs change,
+    the caches built from them (row elimination, reduced pattern and its
+    matrices and factorizations) are dropped.
+
+    Returns
+    -------
+    bc_dofs : onp.ndarray
+        (num_bc_dofs,) may contain duplicates
+    """
+    bc_lists = getattr(problem, 'bc_lists', (None, None))
+    if (bc_lists[0] is not problem.node_inds_list
+            or bc_lists[1] is not problem.vec_inds_list):
+        bc_dofs = onp.hstack(
+            [onp.array(node_inds) * problem.vec + vec_inds
+             for node_inds, vec_inds in zip(problem.node_inds_list,
+                                            problem.vec_inds_list)] +
+            [onp.array([], dtype=onp.int64)]).astype(onp.int64)
+        if (not hasattr(problem, 'bc_dofs')
+                or not onp.array_equal(problem.bc_dofs, bc_dofs)):
+            if hasattr(problem, 'bc_dofs'):
+                logger.debug(f"Dirichlet dofs changed, dropping the caches "
+                             f"built from them")
+            for name in ('bc_csr_inds', 'reduced_pattern',
+                         'petsc_A_reduced'):
+                problem.__dict__.pop(name, None)
+            direct_solvers = getattr(problem, 'direct_solvers', {})
+            for key in [key for key in direct_solvers if key[2]]:
+                del direct_solvers[key]
+            problem.bc_dofs = bc_dofs
+        problem.bc_lists = (problem.node_inds_list, problem.vec_inds_list)
+    return problem.bc_dofs
+
+
 def get_flatten_fn(fn_sol, problem):
 
     def fn_dofs(dofs):
@@ -199,9 +575,12 @@ def operator_to_matrix(operator_fn, problem):
     return J
 
 
-def jacobi_preconditioner(problem):
+def jacobi_preconditioner(problem, matrix_free=False):
     logger.debug(f"Compute and use jacobi preconditioner")
-    jacobi = np.array(problem.A_sp_scipy.diagonal())
+    if matrix_free:
+        jacobi = problem.A_diag
+    else:
+        jacobi = np.array(problem.A_sp_scipy.diagonal())
     jacobi = assign_ones_bc(jacobi.reshape(-1), problem)
     return jacobi
 
@@ -230,33 +609,48 @@ def test_jacobi_precond(problem, jacobi, A_fn):
     logger.debug(f"finish jacobi preconditioner")
 
 
-def linear_guess_solve(problem, A_fn, precond, use_petsc):
+def linear_guess_solve(problem, A_fn, precond, use_petsc, matrix_free=False,
+                       solver_state=None):
     logger.debug(f"Linear guess solve...")
     # b = np.zeros((problem.num_total_nodes, problem.vec))
     b = problem.body_force + problem.neumann
     b = assign_bc(b, problem)
-    if use_petsc:
-        dofs = petsc_solve(A_fn, b, 'bcgsl', 'ilu')
+    if precond in DIRECT_SOLVERS:
+        dofs = get_direct_solver(problem, precond, use_petsc).solve(b)
+    elif use_petsc:
+        dofs = petsc_solve(A_fn, b, 'bcgsl', *get_petsc_pc(problem, precond),
+                           solver_state=solver_state)
     else:
-        dofs = jax_solve(problem, A_fn, b, b, precond)
+        dofs = jax_solve(problem, A_fn, b, b, precond,
+                         matrix_free=matrix_free, solver_state=solver_state)
     return dofs
 
 
 def linear_incremental_solver(problem, res_vec, A_fn, dofs, precond,
-                              use_petsc):
+                              use_petsc, matrix_free=False, solver_state=None):
     """Lift solver
     """
     logger.debug(f"Solving linear system with lift solver...")
     b = -res_vec
-
-    if use_petsc:
-        inc = petsc_solve(A_fn, b, 'bcgsl', 'ilu')
+    x0_1 = assign_bc(np.zeros_like(b), problem)
+    x0_2 = copy_bc(dofs, problem)
+    x0 = x0_1 - x0_2
+
+    if precond in DIRECT_SOLVERS:
+        inc = get_direct_solver(problem, precond, use_petsc).solve(b)
+    elif use_petsc:
+        x0 = None if solver_state is None else solver_state.get_initial_guess(
+            x0, problem)
+        inc = petsc_solve(A_fn, b, 'bcgsl', *get_petsc_pc(problem, precond),
+                          x0=x0, solver_state=solver_state)
     else:
-        x0_1 = assign_bc(np.zeros_like(b), problem)
-        x0_2 = copy_bc(dofs, problem)
-        x0 = x0_1 - x0_2
-        inc = jax_solve(problem, A_fn, b, x0, precond)
+        if solver_state is not None:
+            x0 = solver_state.get_initial_guess(x0, problem)
+        inc = jax_solve(problem, A_fn, b, x0, precond,
+                        matrix_free=matrix_free, solver_state=solver_state)
 
+    if solver_state is not None:
+        solver_state.inc = inc
     dofs = dofs + inc
 
     # dofs = line_search(problem, dofs, inc)
@@ -301,13 +695,74 @@ def line_search(problem, dofs, inc):
     return dofs + alpha*inc
 
 
-def get_A_fn(problem, use_petsc):
-    logger.debug(f"Creating sparse matrix with scipy...")
+def assemble_csr(problem):
+    """Numeric assembly on the cached sparsity pattern.
+    problem.newton_update must be called before so that problem.V is up to
+    date.
+    The COO values are summed into the CSR data array with the precomputed
+    scatter permutation, so no sorting is done here.
+
+    Returns
+    -------
+    A_sp_scipy : scipy.sparse.csr_array
+        (num_total_dofs, num_total_dofs)
+    """
+    data = onp.bincount(problem.csr_perm,
+                        weights=onp.asarray(problem.V),
+                        minlength=len(problem.csr_indices))
     A_sp_scipy = scipy.sparse.csr_array(
-        (onp.array(problem.V), (problem.I, problem.J)),
+        (data, problem.csr_indices, problem.csr_indptr),
         shape=(problem.num_total_dofs, problem.num_total_dofs))
-    # logger.debug(f"Creating sparse matrix from scipy using JAX BCOO...")
-    A_sp = BCOO.from_scipy_sparse(A_sp_scipy).sort_indices()
+    return A_sp_scipy
+
+
+def get_row_eliminated_csr(problem):
+    """problem.A_sp_scipy with the Dirichlet rows replaced by identity rows,
+    the matrix of A_fn (see get_A_fn).
+
+    Returns
+    -------
+    A_sp_scipy : scipy.sparse.csr_array
+        (num_total_dofs, num_total_dofs)
+    """
+    bc_dofs = get_bc_dofs(problem)
+    if not hasattr(problem, 'bc_csr_inds'):
+        is_bc = onp.zeros(problem.num_total_dofs, dtype=bool)
+        is_bc[bc_dofs] = True
+        rows = onp.repeat(onp.arange(problem.num_total_dofs),
+                          onp.diff(problem.csr_indptr))
+        bc_entries = is_bc[rows]
+        problem.bc_csr_inds = (onp.flatnonzero(bc_entries),
+                               onp.flatnonzero(bc_entries &
+                                               (rows == problem.csr_indices)))
+    bc_entries, bc_diag = problem.bc_csr_inds
+    data = onp.array(problem.A_sp_scipy.data)
+    data[bc_entries] = 0.
+    data[bc_diag] = 1.
+    return scipy.sparse.csr_array(
+        (data, problem.csr_indices, problem.csr_indptr),
+        shape=problem.A_sp_scipy.shape)
+
+
+def get_bcoo_indices(problem):
+    """Row and column indices of the global matrix in (sorted) BCOO layout.
+    Cached on the problem and kept on device.
+    """
+    if not hasattr(problem, 'bcoo_indices'):
+        rows = onp.repeat(onp.arange(problem.num_total_dofs),
+                          onp.diff(problem.csr_indptr))
+        problem.bcoo_indices = np.array(
+            onp.stack((rows, problem.csr_indices), axis=1))
+    return problem.bcoo_indices
+
+
+def get_A_fn(problem, use_petsc):
+    logger.debug(f"Creating sparse matrix with scipy...")
+    A_sp_scipy = assemble_csr(problem)
+    A_sp = BCOO((np.array(A_sp_scipy.data), get_bcoo_indices(problem)),
+                shape=A_sp_scipy.shape,
+                indices_sorted=True,
+                unique_indices=True)
     # logger.info(f"Global sparse matrix takes about {A_sp.data.shape[0]*8*3/2**30} G memory to store.")
     problem.A_sp_scipy = A_sp_scipy
 
@@ -315,21 +770,27 @@ def get_A_fn(problem, use_petsc):
         return A_sp @ dofs
 
     if use_petsc:
-        # https://scicomp.stackexchange.com/questions/2355/32bit-64bit-issue-when-working-with-numpy-and-petsc4py/2356#2356
-        A = PETSc.Mat().createAIJ(size=A_sp_scipy.shape, csr=(A_sp_scipy.indptr.astype(PETSc.IntType, copy=False),
-                                                       A_sp_scipy.indices.astype(PETSc.IntType, copy=False), A_sp_scipy.data))
-        for i in range(len(problem.node_inds_list)):
-            row_inds = onp.array(problem.node_inds_list[i] * problem.vec +
-                                 problem.vec_inds_list[i],
-                                 dtype=onp.int32)
-            A.zeroRows(row_inds)
+        A = get_petsc_matrix(problem, A_sp_scipy)
+        A.zeroRows(get_bc_dofs(problem).astype(PETSc.IntType))
     else:
         A = row_elimination(compute_linearized_residual, problem)
 
     return A
 
 
-def solver_row_elimination(problem, linear, precond, initial_guess, use_petsc):
+def get_A_fn_matrix_free(problem):
+    """Tangent operator built from the JVP stored by problem.linearize,
+    with Dirichlet rows eliminated. No matrix is assembled.
+    """
+    def compute_linearized_residual(dofs):
+        sol = dofs.reshape((problem.num_total_nodes, problem.vec))
+        return problem.A_jvp(sol).reshape(-1)
+
+    return row_elimination(compute_linearized_residual, problem)
+
+
+def solver_row_elimination(problem, linear, precond, initial_guess, use_petsc,
+                           matrix_free=False, solver_state=None):
     """The solver imposes Dirichlet B.C. with "row elimination" method.
 
     Some memo:
@@ -346,7 +807,17 @@ def solver_row_elimination(problem, linear, precond, initial_guess, use_petsc):
     A_fn = d(res)/d(u) = D*dr/du + (I - D)
 
     The function newton_update computes r(u) and dr/du
+
+    If matrix_free is True, the function linearize computes r(u) and the
+    action of dr/du only, and the JAX Krylov solver works with the JVP.
+
+    If solver_state is given and the tangent is not stale, only r(u) is
+    computed and the previous A_fn is kept (modified Newton).
     """
+    assert not (matrix_free and use_petsc), \
+        f"Matrix-free mode requires the JAX solver, set use_petsc=False"
+    assert not (matrix_free and precond in DIRECT_SOLVERS), \
+        f"Direct solvers require the assembled matrix"
     logger.debug(
         f"Calling the row elimination solver for imposing Dirichlet B.C.")
     logger.debug("Start timing")
@@ -354,10 +825,29 @@ def solver_row_elimination(problem, linear, precond, initial_guess, use_petsc):
     sol_shape = (problem.num_total_nodes, problem.vec)
     dofs = np.zeros(sol_shape).reshape(-1)
 
-    def newton_update_helper(dofs):
-        res_vec = problem.newton_update(dofs.reshape(sol_shape)).reshape(-1)
+    def newton_update_helper(dofs, A_fn=None):
+        """A_fn is the tangent of the previous call, it may be reused."""
+        # Whether the assembled tangent is the one at dofs, see Linearization
+        problem.fresh_tangent = False
+        if A_fn is None and solver_state is not None:
+            solver_state.jac_age = None
+        if solver_state is not None and not solver_state.jac_needs_update():
+            logger.debug(f"Reusing tangent matrix")
+            res_vec = problem.compute_residual(
+                dofs.reshape(sol_shape)).reshape(-1)
+        elif matrix_free == 'sharded':
+            res_vec = linearize_sharded(problem,
+                                        dofs.reshape(sol_shape)).reshape(-1)
+            A_fn = get_A_fn_matrix_free(problem)
+        elif matrix_free:
+            res_vec = problem.linearize(dofs.reshape(sol_shape)).reshape(-1)
+            A_fn = get_A_fn_matrix_free(problem)
+        else:
+            res_vec = problem.newton_update(
+                dofs.reshape(sol_shape)).reshape(-1)
+            A_fn = get_A_fn(problem, use_petsc)
+            problem.fresh_tangent = True
         res_vec = apply_bc_vec(res_vec, dofs, problem)
-        A_fn = get_A_fn(problem, use_petsc)
         return res_vec, A_fn
 
     if linear:
@@ -365,16 +855,17 @@ def solver_row_elimination(problem, linear, precond, initial_guess, use_petsc):
         res_vec, A_fn = newton_update_helper(dofs)
 
         dofs = linear_incremental_solver(problem, res_vec, A_fn, dofs, precond,
-                                         use_petsc)
+                                         use_petsc, matrix_free, solver_state)
 
-        res_vec, A_fn = newton_update_helper(dofs)
+        res_vec, A_fn = newton_update_helper(dofs, A_fn)
         res_val = np.linalg.norm(res_vec)
         logger.debug(f"Linear solve, res l_2 = {res_val}")
 
     else:
         if initial_guess is None:
             res_vec, A_fn = newton_update_helper(dofs)
-            dofs = linear_guess_solve(problem, A_fn, precond, use_petsc)
+            dofs = linear_guess_solve(problem, A_fn, precond, use_petsc,
+                                      matrix_free, solver_state)
         else:
             dofs = initial_guess.reshape(-1)
 
@@ -384,8 +875,9 @@ def solver_row_elimination(problem, linear, precond, initial_guess, use_petsc):
         tol = 1e-6
         while res_val > tol:
             dofs = linear_incremental_solver(problem, res_vec, A_fn, dofs,
-                                             precond, use_petsc)
-            res_vec, A_fn = newton_update_helper(dofs)
+                                             precond, use_petsc, matrix_free,
+                                             solver_state)
+            res_vec, A_fn = newton_update_helper(dofs, A_fn)
             # test_jacobi_precond(problem, jacobi_preconditioner(problem, dofs), A_fn)
             res_val = np.linalg.norm(res_vec)
             logger.debug(f"res l_2 = {res_val}")
@@ -405,6 +897,430 @@ def solver_row_elimination(problem, linear, precond, initial_guess, use_petsc):
     return sol
 
 
+###############################################################################
+# Reduced system solver
+
+
+def get_dof_representatives(problem):
+    """Group the dofs tied by periodic B.C. (u_A = u_B, possibly chained,
+    e.g., at the edges and corners of an RVE) and pick the representative
+    (master) dof of each group: its Dirichlet dof if it has one, its
+    smallest dof otherwise.
+
+    Returns
+    -------
+    rep : onp.ndarray
+        (num_total_dofs,) representative dof of each dof
+    is_dirichlet : onp.ndarray
+        (num_total_dofs,) whether the group of each dof is fixed by a
+        Dirichlet B.C.
+    """
+    num_dofs = problem.num_total_dofs
+    dofs_A = [onp.array([], dtype=onp.int64)]
+    dofs_B = [onp.array([], dtype=onp.int64)]
+    for node_inds_A, node_inds_B, vec_inds in zip(problem.p_node_inds_list_A,
+                                                  problem.p_node_inds_list_B,
+                                                  problem.p_vec_inds_list):
+        dofs_A.append(problem.vec * node_inds_A + vec_inds)
+        dofs_B.append(problem.vec * node_inds_B + vec_inds)
+    dofs_A, dofs_B = onp.hstack(dofs_A), onp.hstack(dofs_B)
+    graph = scipy.sparse.csr_matrix(
+        (onp.ones(len(dofs_A), dtype=onp.int8), (dofs_A, dofs_B)),
+        shape=(num_dofs, num_dofs))
+    num_groups, labels = connected_components(graph, directed=False)
+
+    group_rep = onp.full(num_groups, num_dofs)
+    onp.minimum.at(group_rep, labels, onp.arange(num_dofs))
+    bc_dofs = get_bc_dofs(problem)
+    group_bc_rep = onp.full(num_groups, num_dofs)
+    onp.minimum.at(group_bc_rep, labels[bc_dofs], bc_dofs)
+    group_is_dirichlet = group_bc_rep < num_dofs
+    group_rep = onp.where(group_is_dirichlet, group_bc_rep, group_rep)
+    return group_rep[labels], group_is_dirichlet[labels]
+
+
+def get_reduced_pattern(problem):
+    """Master-slave elimination of the Dirichlet and periodic B.C.
+
+    The dofs are u = P u_r + u_b, where u_r are the free master dofs, the
+    prolongation P (num_total_dofs, num_reduced_dofs) copies each master to
+    its slaves and u_b holds the Dirichlet values. P only has one unit entry
+    per row and is stored as the map dof_map. The pattern of P^T A P is
+    computed once from the cached sparsity pattern and cached on the
+    problem until the Dirichlet dofs change (see get_bc_dofs). Without
+    periodic B.C., P selects the free dofs.
+
+    Returns
+    -------
+    reduced : dict
+        'dof_map': (num_total_dofs,) reduced dof of each dof, -1 if fixed
+        'rep': (num_total_dofs,) master dof of each dof
+        'mapped_dofs': (num_mapped_dofs,) dofs with dof_map >= 0
+        'masters': (num_reduced_dofs,) master dof of each reduced dof
+        'keep': (nnz,) CSR entries of A that contribute to P^T A P
+        'perm': (num_kept,) entry of P^T A P of each kept entry
+        'indptr', 'indices': CSR pattern of P^T A P
+    """
+    # Drops the pattern if the Dirichlet dofs changed
+    get_bc_dofs(problem)
+    if not hasattr(problem, 'reduced_pattern'):
+        if not hasattr(problem, 'csr_indptr'):
+            problem.compute_sparsity_pattern()
+        rep, is_dirichlet = get_dof_representatives(problem)
+        masters = onp.flatnonzero((rep == onp.arange(len(rep))) &
+                                  ~is_dirichlet)
+        master_map = onp.full(len(rep), -1)
+        master_map[masters] = onp.arange(len(masters))
+        dof_map = master_map[rep]
+        num_reduced_dofs = len(masters)
+
+        rows = onp.repeat(onp.arange(problem.num_total_dofs),
+                          onp.diff(problem.csr_indptr))
+        keep = (dof_map[rows] >= 0) & (dof_map[problem.csr_indices] >= 0)
+        keys = (dof_map[rows[keep]].astype(onp.int64) * num_reduced_dofs +
+                dof_map[problem.csr_indices[keep]])
+        unique_keys, perm = onp.unique(keys, return_inverse=True)
+        problem.reduced_pattern = {
+            'dof_map': dof_map,
+            'rep': rep,
+            'mapped_dofs': onp.flatnonzero(dof_map >= 0),
+            'masters': masters,
+            'keep': keep,
+            'perm': perm.reshape(-1),
+            'indptr': onp.hstack((0, onp.cumsum(onp.bincount(
+                unique_keys // num_reduced_dofs,
+                minlength=num_reduced_dofs)))),
+            'indices': unique_keys % num_reduced_dofs
+        }
+        logger.debug(f"Reduced system has {num_reduced_dofs} of "
+                     f"{problem.num_total_dofs} dofs")
+    return problem.reduced_pattern
+
+
+def restrict(problem, vec):
+    """P^T vec, (num_total_dofs,) -> (num_reduced_dofs,)"""
+    reduced = get_reduced_pattern(problem)
+    mapped_dofs = reduced['mapped_dofs']
+    return np.zeros(len(reduced['masters'])).at[
+        reduced['dof_map'][mapped_dofs]].add(vec[mapped_dofs])
+
+
+def prolong(problem, vec_r):
+    """P vec_r, (num_reduced_dofs,) -> (num_total_dofs,)"""
+    reduced = get_reduced_pattern(problem)
+    mapped_dofs = reduced['mapped_dofs']
+    return np.zeros(problem.num_total_dofs).at[mapped_dofs].set(
+        vec_r[reduced['dof_map'][mapped_dofs]])
+
+
+def assemble_reduced_csr(problem):
+    """Reduced global matrix P^T A P, see assemble_csr.
+
+    Returns
+    -------
+    A_r : scipy.sparse.csr_array
+        (num_reduced_dofs, num_reduced_dofs)
+    """
+    reduced = get_reduced_pattern(problem)
+    A_sp_scipy = assemble_csr(problem)
+    data = onp.bincount(reduced['perm'],
+                        weights=A_sp_scipy.data[reduced['keep']],
+                        minlength=len(reduced['indices']))
+    num_reduced_dofs = len(reduced['masters'])
+    return scipy.sparse.csr_array(
+        (data, reduced['indices'], reduced['indptr']),
+        shape=(num_reduced_dofs, num_reduced_dofs))
+
+
+def reduced_solve(problem, b, precond, use_petsc, matrix_free):
+    """Solve the symmetric reduced system P^T A P x = b with CG.
+
+    precond=True uses Jacobi with JAX (ICC with PETSc), 'amg' uses PETSc
+    gamg. 'lu' and 'cholesky' solve directly, see DirectSolver.
+    """
+    reduced = get_reduced_pattern(problem)
+    if precond in DIRECT_SOLVERS:
+        assert not matrix_free, f"Direct solvers require the assembled matrix"
+        direct_solver = get_direct_solver(problem, precond, use_petsc,
+                                          reduced=True)
+        return direct_solver.solve(b)
+    if use_petsc:
+        A_r = assemble_reduced_csr(problem)
+        A = get_petsc_matrix(problem, A_r, 'petsc_A_reduced')
+        A.setOption(PETSc.Mat.Option.SYMMETRIC, True)
+        pc_type, near_nullspace = get_petsc_pc(problem, precond)
+        if near_nullspace is not None:
+            near_nullspace = near_nullspace[reduced['masters']]
+        pc_type = 'icc' if pc_type == 'ilu' else pc_type
+        return petsc_solve(A, b, 'cg', pc_type, near_nullspace)
+
+    assert precond in (True, False, 'jacobi'), \
+        f"Preconditioner {precond} is not supported by the reduced JAX solver"
+    if matrix_free:
+        def A_fn(x):
+            sol = prolong(problem, x).reshape(
+                (problem.num_total_nodes, problem.vec))
+            return restrict(problem, problem.A_jvp(sol).reshape(-1))
+
+        # Couplings between the dofs of a master and its slaves are
+        # ignored, which is good enough for a preconditioner
+        diag = restrict(problem, problem.A_diag.reshape(-1))
+    else:
+        A_r = assemble_reduced_csr(problem)
+        A_sp = BCOO.from_scipy_sparse(A_r)
+
+        def A_fn(x):
+            return A_sp @ x
+
+        diag = np.array(A_r.diagonal())
+    pc = get_jacobi_precond(diag) if precond else None
+    x, info = jax.scipy.sparse.linalg.cg(A_fn, b, M=pc, tol=1e-10,
+                                         atol=1e-10, maxiter=10000)
+    logger.debug(f"JAX scipy CG linear solve res = "
+                 f"{np.linalg.norm(A_fn(x) - b)}")
+    return x
+
+
+def solver_reduced(problem, linear, precond, initial_guess, use_petsc,
+                   matrix_free=False):
+    """The solver imposes Dirichlet and periodic B.C. by eliminating the
+    constrained dofs, see get_reduced_pattern.
+
+    The dofs u carry the B.C. values, so that the residual r(u) already
+    contains the lifted Dirichlet values. Each Newton step solves the
+    smaller system
+
+    P^T dr/du P * du_r = -P^T r(u), u <- u + P du_r
+
+    which, unlike the row eliminated or the Lagrange multiplier one, is
+    symmetric positive definite for elasticity, Poisson, ... and is solved
+    with CG.
+    """
+    assert matrix_free != 'sharded', \
+        f"Sharded mode is not supported by the reduced solver yet"
+    assert not (matrix_free and use_petsc), \
+        f"Matrix-free mode requires the JAX solver, set use_petsc=False"
+    logger.debug(f"Calling the reduced solver for imposing Dirichlet and "
+                 f"periodic B.C.")
+    start = time.time()
+    sol_shape = (problem.num_total_nodes, problem.vec)
+    rep = get_reduced_pattern(problem)['rep']
+
+    def newton_update_helper(dofs):
+        if matrix_free:
+            res_vec = problem.linearize(dofs.reshape(sol_shape))
+        else:
+            res_vec = problem.newton_update(dofs.reshape(sol_shape))
+        return restrict(problem, res_vec.reshape(-1))
+
+    if initial_guess is None:
+        dofs = np.zeros(problem.num_total_dofs)
+    else:
+        dofs = np.array(initial_guess).reshape(-1)
+    # Slaves take the values of their master
+    dofs = assign_bc(dofs, problem)[rep]
+
+    res_vec = newton_update_helper(dofs)
+    res_val = np.linalg.norm(res_vec)
+    logger.debug(f"Before, res l_2 = {res_val}")
+    tol = 1e-6
+    while res_val > tol:
+        inc = reduced_solve(problem, -res_vec, precond, use_petsc, matrix_free)
+        dofs = dofs + prolong(problem, np.array(inc))
+        res_vec = newton_update_helper(dofs)
+        res_val = np.linalg.norm(res_vec)
+        logger.debug(f"res l_2 = {res_val}")
+        if linear:
+            break
+
+    assert np.all(np.isfinite(dofs)), f"dofs contains NaN, stop the program!"
+    logger.info(f"Solve took {time.time() - start} [s]")
+    return dofs.reshape(sol_shape)
+
+
+###############################################################################
+# Jittable "row elimination" solver
+
+
+def get_csr_diag_inds(problem):
+    """Position of each diagonal entry in the CSR data array.
+    Cached on the problem and kept on device.
+    """
+    if not hasattr(problem, 'csr_diag_inds'):
+        rows = onp.repeat(onp.arange(problem.num_total_dofs),
+                          onp.diff(problem.csr_indptr))
+        keys = (rows.astype(onp.int64) * problem.num_total_dofs +
+                problem.csr_indices)
+        diag_keys = onp.arange(problem.num_total_dofs,
+                               dtype=onp.int64) * (problem.num_total_dofs + 1)
+        problem.csr_diag_inds = np.array(onp.searchsorted(keys, diag_keys))
+    return problem.csr_diag_inds
+
+
+def get_jit_solver(problem, precond=True, tol=1e-6, max_iter=20):
+    """Build a Newton solver that is traceable end to end.
+
+    The global matrix is assembled on device: the cell Jacobians are summed
+    into the data array of the cached CSR pattern with jax.ops.segment_sum and
+    wrapped as a BCOO matrix. The Newton loop is a jax.lax.while_loop (like
+    solver_nonlinear in the CFD module) and the linear systems are solved with
+    the JAX bicgstab solver, so no value is sent back to the host.
+    The returned function can be jitted, vmapped or called within
+    jax.lax.scan for time stepping.
+
+    Parameters
+    ----------
+    problem : FEM
+    precond : bool
+        Whether to use a Jacobi preconditioner
+    tol : float
+        Tolerance on the l_2 norm of the residual
+    max_iter : int
+        Maximum number of Newton iterations
+
+    Returns
+    -------
+    newton_solve : Callable
+        newton_solve(initial_sol, internal_vars, vals_list) -> (sol, num_iters)
+        initial_sol: (num_total_nodes, vec), Dirichlet values are imposed on
+        it.
+        internal_vars: dict like problem.internal_vars.
+        vals_list: Dirichlet values like problem.vals_list.
+        A non converged solve is not reported, compare num_iters with max_iter.
+    """
+    if not hasattr(problem, 'csr_perm'):
+        problem.compute_sparsity_pattern()
+    sol_shape = (problem.num_total_nodes, problem.vec)
+    shape = (problem.num_total_dofs, problem.num_total_dofs)
+    indices = get_bcoo_indices(problem)
+    diag_inds = get_csr_diag_inds(problem)
+    csr_perm = np.array(problem.csr_perm)
+    nnz = len(problem.csr_indices)
+
+    def newton_solve(initial_sol, internal_vars, vals_list):
+
+        def newton_update_helper(dofs):
+            res, V = problem.compute_newton_vars_jittable(
+                dofs.reshape(sol_shape), **internal_vars)
+            data = jax.ops.segment_sum(V, csr_perm, num_segments=nnz)
+            res_vec = apply_bc_vec(res.reshape(-1), dofs, problem, vals_list)
+            return res_vec, data
+
+        def linear_incremental_solve(dofs, res_vec, data):
+            A_sp = BCOO((data, indices),
+                        shape=shape,
+                        indices_sorted=True,
+                        unique_indices=True)
+            A_fn = row_elimination(lambda x: A_sp @ x, problem)
+            pc = get_jacobi_precond(assign_ones_bc(
+                data[diag_inds], problem)) if precond else None
+            inc, _ = jax.scipy.sparse.linalg.bicgstab(A_fn,
+                                                      -res_vec,
+                                                      x0=np.zeros_like(dofs),
+                                                      M=pc,
+                                                      tol=1e-10,
+                                                      atol=1e-10,
+                                                      maxiter=10000)
+            return dofs + inc
+
+        def cond_fun(carry):
+            dofs, res_vec, data, it = carry
+            return np.logical_and(np.linalg.norm(res_vec) > tol,
+                                  it < max_iter)
+
+        def body_fun(carry):
+            dofs, res_vec, data, it = carry
+            dofs = linear_incremental_solve(dofs, res_vec, data)
+            res_vec, data = newton_update_helper(dofs)
+            return dofs, res_vec, data, it + 1
+
+        dofs = assign_bc(initial_sol.reshape(-1), problem, vals_list)
+        res_vec, data = newton_update_helper(dofs)
+        dofs, res_vec, data, it = jax.lax.while_loop(
+            cond_fun, body_fun, (dofs, res_vec, data, 0))
+        return dofs.reshape(sol_shape), it
+
+    return newton_solve
+
+
+def batched_solver(problem,
+                   params_batch,
+                   initial_guess=None,
+                   precond=True,
+                   tol=1e-6,
+                   max_iter=20,
+                   batch_size=None):
+    """Solve the problem for a stack of parameter sets together.
+
+    problem.set_params is called eagerly for each parameter set to collect
+    the internal variables and Dirichlet values of every instance. All
+    instances then share the sparsity pattern and the jitted solver of
+    get_jit_solver, which is vmapped so that the assembly and the Krylov
+    solves of all instances run as one batched computation.
+
+    Parameters
+    ----------
+    problem : FEM
+    params_batch : pytree
+        Parameters of problem.set_params, stacked along a leading axis of
+        size num_params
+    initial_guess : np.DeviceArray
+        (num_params, num_total_nodes, vec)
+    precond, tol, max_iter
+        See get_jit_solver
+    batch_size : int
+        Number of instances solved at once, all of them if None. The memory
+        of the cell Jacobians grows linearly with it.
+
+    Returns
+    -------
+    sols : np.DeviceArray
+        (num_params, num_total_nodes, vec)
+        problem is left set to the last parameter set.
+    """
+    num_params = len(jax.tree_util.tree_leaves(params_batch)[0])
+    batch_size = (num_params if batch_size is None else
+                  min(batch_size, num_params))
+    logger.info(f"Solving {num_params} instances in batches of "
+                f"{batch_size}...")
+    start = time.time()
+
+    internal_vars_list = []
+    vals_lists = []
+    for i in range(num_params):
+        problem.set_params(jax.tree_map(lambda x: x[i], params_batch))
+        # set_params may update the containers in place, keep copies
+        internal_vars_list.append(jax.tree_map(np.asarray,
+                                               problem.internal_vars))
+        vals_lists.append(jax.tree_map(np.asarray, problem.vals_list))
+
+    def stack(trees):
+        return jax.tree_map(lambda *xs: np.stack(xs), *trees)
+
+    if initial_guess is None:
+        initial_guess = np.zeros(
+            (num_params, problem.num_total_nodes, problem.vec))
+
+    newton_solve = jax.jit(
+        jax.vmap(get_jit_solver(problem, precond, tol, max_iter)))
+    sols = []
+    for i in range(0, num_params, batch_size):
+        # The last batch is padded by repeating its final instance, so the
+        # solver is compiled once.
+        inds = onp.minimum(onp.arange(i, i + batch_size), num_params - 1)
+        sol, num_iters = newton_solve(
+            initial_guess[inds], stack([internal_vars_list[j] for j in inds]),
+            stack([vals_lists[j] for j in inds]))
+        logger.debug(f"Batch starting at {i}, max Newton iterations = "
+                     f"{np.max(num_iters)}")
+        sols.append(sol[:min(batch_size, num_params - i)])
+
+    sols = np.vstack(sols)
+    assert np.all(np.isfinite(sols)), f"sols contains NaN, stop the program!"
+    logger.info(f"Batched solve took {time.time() - start} [s]")
+    return sols
+
+
 ################################################################################
 # Lagrangian multiplier solver
 
@@ -564,10 +1480,11 @@ def get_A_fn_and_res_aug(problem, dofs_aug, res_vec, p_num_eps, use_petsc):
 
     if use_petsc:
 
-        A = PETSc.Mat().createAIJ(size=A_sp_scipy_aug.shape,
-                                  csr=(A_sp_scipy_aug.indptr.astype(PETSc.IntType, copy=False),
-                                       A_sp_scipy_aug.indices.astype(PETSc.IntType, copy=False),
-                                       A_sp_scipy_aug.data))
+        A_aug = PETSc.Mat().createAIJ(
+            size=A_sp_scipy_aug.shape,
+            csr=(A_sp_scipy_aug.indptr.astype(PETSc.IntType, copy=False),
+                 A_sp_scipy_aug.indices.astype(PETSc.IntType, copy=False),
+                 A_sp_scipy_aug.data))
 
         # A_aug = PETSc.Mat().createAIJ(size=A_sp_scipy_aug.shape,
         #                               csr=(A_sp_scipy_aug.indptr,
@@ -661,18 +1578,9 @@ def solver_lagrange_multiplier(problem, linear, use_petsc=True):
 def assembleCSR(problem, dofs):
     problem.newton_update(dofs.reshape(
         (problem.num_total_nodes, problem.vec))).reshape(-1)
-    A_sp_scipy = scipy.sparse.csr_array(
-        (problem.V, (problem.I, problem.J)),
-        shape=(problem.num_total_dofs, problem.num_total_dofs))
-
-    A = PETSc.Mat().createAIJ(size=A_sp_scipy.shape,
-                              csr=(A_sp_scipy.indptr, A_sp_scipy.indices,
-                                   A_sp_scipy.data))
-    for i in range(len(problem.node_inds_list)):
-        row_inds = onp.array(problem.node_inds_list[i] * problem.vec +
-                             problem.vec_inds_list[i],
-                             dtype=onp.int32)
-        A.zeroRows(row_inds)
+    A_sp_scipy = assemble_csr(problem)
+    A = get_petsc_matrix(problem, A_sp_scipy)
+    A.zeroRows(get_bc_dofs(problem).astype(PETSc.IntType))
 
     row, col, val = A.getValuesCSR()
     A_sp_scipy.data = val
@@ -837,16 +1745,53 @@ def solver(problem,
            linear=False,
            precond=True,
            initial_guess=None,
-           use_petsc=False):
+           use_petsc=False,
+           matrix_free=False,
+           solver_state=None,
+           reduced=False):
     """periodic B.C. is a special form of adding a linear constraint.
     Lagrange multiplier seems to be convenient to impose this constraint.
+
+    matrix_free=True never assembles the tangent matrix: the JAX Krylov solver
+    only uses its action (JVP) and a Jacobi preconditioner built from its
+    diagonal. This cuts peak memory for high order elements.
+    matrix_free='sharded' further partitions the cells over all local devices
+    (problem.device_mesh if set) and splits the Krylov vectors between them,
+    see jax_am.fem.parallel.
+
+    precond=True uses a Jacobi preconditioner with the JAX solver (ILU with
+    PETSc). precond='amg' uses smoothed aggregation AMG with rigid body modes,
+    in JAX or with PETSc gamg. precond='hypre' selects BoomerAMG with PETSc.
+
+    solver_state (see SolverState) keeps the preconditioner, the PETSc KSP and
+    the last increment between calls, e.g., across time steps.
+
+    reduced=True eliminates the Dirichlet dofs and the slave dofs of
+    periodic B.C. from the linear systems instead of replacing rows or adding
+    Lagrange multipliers, which keeps symmetric tangents symmetric: the
+    systems are solved with CG, see solver_reduced.
+
+    precond='lu' or 'cholesky' replaces the Krylov solver by a sparse direct
+    solver (SuperLU, or PETSc if use_petsc), whose symbolic analysis is
+    done once and whose factorization is reused while the tangent does not
+    change, see DirectSolver. 'cholesky' requires reduced=True.
     """
     # TODO: print platform jax.lib.xla_bridge.get_backend().platform
     # and suggest PETSc or jax solver
+    problem.fresh_tangent = False
+    if reduced:
+        assert solver_state is None, \
+            f"Solver state is not supported by the reduced solver yet"
+        return solver_reduced(problem, linear, precond, initial_guess,
+                              use_petsc, matrix_free)
     if problem.periodic_bc_info is None:
         return solver_row_elimination(problem, linear, precond, initial_guess,
-                                      use_petsc)
+                                      use_petsc, matrix_free, solver_state)
     else:
+        assert not matrix_free, \
+            f"Matrix-free mode does not support periodic B.C. yet"
+        assert solver_state is None, \
+            f"Solver state is not supported with periodic B.C. yet"
         return solver_lagrange_multiplier(problem, linear, use_petsc)
 
 
@@ -854,7 +1799,141 @@ def solver(problem,
 # Implicit differentiation with the adjoint method
 
 
-def implicit_vjp(problem, sol, params, v, use_petsc):
+@jax.tree_util.register_pytree_node_class
+class Linearization:
+    """Row eliminated tangent of the residual at the solution of a forward
+    solve, with what is needed to solve with it and with its transpose: the
+    assembled matrix and the JAX preconditioner, the PETSc matrix, or the
+    direct factorization. Built right after solver(), whose last Newton
+    iteration assembled the tangent at the solution, so that adjoint (VJP)
+    and tangent (JVP) solves do not assemble it again. See
+    get_linearization for when this holds.
+
+    The PETSc matrix and the PETSc factorization are shared with the
+    problem, so that the next forward solve reuses them. If it changed
+    their values in the meantime, solve() puts the values of this tangent
+    back and refactorizes with the cached symbolic analysis. SuperLU
+    factors are not modified in place and are shared as they are. It is an
+    opaque pytree without leaves, so that it can be a residual of
+    jax.custom_vjp.
+    """
+
+    def __init__(self, problem, precond=True, use_petsc=False):
+        self.problem = problem
+        self.precond = precond
+        self.use_petsc = use_petsc
+        self.A_sp_scipy = get_row_eliminated_csr(problem)
+        self.A_sp = BCOO((np.array(self.A_sp_scipy.data),
+                          get_bcoo_indices(problem)),
+                         shape=self.A_sp_scipy.shape,
+                         indices_sorted=True,
+                         unique_indices=True)
+        self.A_petsc = None
+        self.ksp = None
+        self.pc = None
+        self.direct_solver = None
+        if use_petsc:
+            # Row eliminated by get_A_fn at the solution
+            self.A_petsc = problem.petsc_A
+            problem.petsc_A_owner = weakref.ref(self)
+        if precond in DIRECT_SOLVERS:
+            self.direct_solver = get_direct_solver(problem, precond,
+                                                   use_petsc)
+            if not use_petsc:
+                self.direct_solver = copy.copy(self.direct_solver)
+        elif not use_petsc:
+            self.pc = get_preconditioner(problem, precond)
+
+    def tree_flatten(self):
+        return (), self
+
+    @classmethod
+    def tree_unflatten(cls, aux_data, children):
+        return aux_data
+
+    def matvec(self, x):
+        return self.A_sp @ x
+
+    def sync_petsc_matrix(self):
+        """Put the values of this tangent into problem.petsc_A, unless they
+        are still there.
+        """
+        owner = getattr(self.problem, 'petsc_A_owner', None)
+        if owner is None or owner() is not self:
+            logger.debug(f"Restoring the tangent of the forward solve")
+            self.A_petsc = get_petsc_matrix(self.problem, self.A_sp_scipy)
+            self.problem.petsc_A_owner = weakref.ref(self)
+
+    def get_ksp(self):
+        if self.ksp is not None:
+            # The matrix may have been created again by sync_petsc_matrix
+            self.ksp.setOperators(self.A_petsc)
+        else:
+            pc_type, near_nullspace = get_petsc_pc(self.problem, self.precond)
+            if near_nullspace is not None:
+                Q, _ = onp.linalg.qr(near_nullspace)
+                vectors = [PETSc.Vec().createWithArray(onp.array(Q[:, i]))
+                           for i in range(Q.shape[1])]
+                self.A_petsc.setNearNullSpace(
+                    PETSc.NullSpace().create(vectors=vectors))
+            # GMRES, since the KSP must also solve with the transpose
+            self.ksp = PETSc.KSP().create()
+            self.ksp.setOperators(self.A_petsc)
+            self.ksp.setType('gmres')
+            self.ksp.pc.setType(pc_type)
+            self.ksp.setTolerances(rtol=1e-10, atol=1e-10, max_it=10000)
+            self.ksp.setFromOptions()
+        return self.ksp
+
+    def solve(self, b, transpose=False):
+        """Solve A x = b (A^T x = b if transpose). b may be traced."""
+        if self.direct_solver is not None and not self.use_petsc:
+            return self.direct_solver.solve(b, transpose)
+        if self.use_petsc:
+            def solve_fn(b):
+                self.sync_petsc_matrix()
+                if self.direct_solver is not None:
+                    self.direct_solver.factorize(self.A_sp_scipy,
+                                                 self.A_petsc)
+                    return self.direct_solver.solve_host(
+                        b, transpose).astype(b.dtype)
+                return petsc_ksp_solve(self.get_ksp(), b,
+                                       transpose).astype(b.dtype)
+
+            return jax.pure_callback(
+                solve_fn, jax.ShapeDtypeStruct(b.shape, b.dtype), b)
+        A_sp = self.A_sp.T if transpose else self.A_sp
+        x, info = jax.scipy.sparse.linalg.bicgstab(lambda x: A_sp @ x,
+                                                   b,
+                                                   M=self.pc,
+                                                   tol=1e-10,
+                                                   atol=1e-10,
+                                                   maxiter=10000)
+        return x
+
+
+def get_linearization(problem, precond=True, use_petsc=False):
+    """Linearization of the last forward solve, or None if the assembled
+    tangent is not the one at its solution: periodic B.C. (Lagrange
+    multipliers), reduced or matrix-free solves, or a tangent reused
+    through a SolverState. The adjoint and tangent solves then assemble
+    it again.
+    """
+    if getattr(problem, 'fresh_tangent', False):
+        return Linearization(problem, precond, use_petsc)
+    logger.debug(f"No tangent at the solution, it will be assembled again")
+    return None
+
+
+def implicit_vjp(problem, sol, params, v, use_petsc, precond=True,
+                 linearization=None):
+    """With precond='lu' or 'cholesky', the adjoint is solved with the
+    transposed factorization of the forward solve when the tangent has not
+    changed since, see DirectSolver.
+
+    If the Linearization of the forward solve is given, the adjoint is
+    solved with its transpose and the tangent is not assembled again.
+    """
 
     def constraint_fn(dofs, params):
         """c(u, p)
@@ -898,12 +1977,21 @@ def implicit_vjp(problem, sol, params, v, use_petsc):
 
         return vjp_linear_fn
 
-    problem.set_params(params)
-    problem.newton_update(sol)
-    A_fn = get_A_fn(problem, use_petsc)
+    if linearization is None:
+        problem.set_params(params)
+        problem.newton_update(sol)
+        A_fn = get_A_fn(problem, use_petsc)
 
-    if use_petsc:
-        A_transpose = A_fn.transpose()
+    if linearization is not None:
+        adjoint = linearization.solve(np.array(v).reshape(-1), transpose=True)
+
+    elif precond in DIRECT_SOLVERS:
+        direct_solver = get_direct_solver(problem, precond, use_petsc)
+        adjoint = direct_solver.solve(np.array(v).reshape(-1), transpose=True)
+
+    elif use_petsc:
+        # Out of place, A_fn is the matrix cached on the problem
+        A_transpose = A_fn.transpose(PETSc.Mat())
 
         # Remark: Eliminating rows seems to make A better conditioned.
         # If Dirichlet B.C. is part of the design variable, the following should NOT be implemented.
@@ -926,22 +2014,25 @@ def implicit_vjp(problem, sol, params, v, use_petsc):
     return vjp_result
 
 
-def ad_wrapper(problem, linear=False, use_petsc=False):
+def ad_wrapper(problem, linear=False, use_petsc=False, precond=True):
 
     @jax.custom_vjp
     def fwd_pred(params):
         problem.set_params(params)
-        sol = solver(problem, linear=linear, use_petsc=use_petsc)
+        sol = solver(problem, linear=linear, precond=precond,
+                     use_petsc=use_petsc)
         return sol
 
     def f_fwd(params):
         sol = fwd_pred(params)
-        return sol, (params, sol)
+        linearization = get_linearization(problem, precond, use_petsc)
+        return sol, (params, sol, linearization)
 
     def f_bwd(res, v):
         logger.info("Running backward and solving the adjoint problem...")
-        params, sol = res
-        vjp_result = implicit_vjp(problem, sol, params, v, use_petsc)
+        params, sol, linearization = res
+        vjp_result = implicit_vjp(problem, sol, params, v, use_petsc,
+                                  precond, linearization)
         return (vjp_result, )
 
     fwd_pred.defvjp(f_fwd, f_bwd)
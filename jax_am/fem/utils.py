@@ -6,22 +6,33 @@ from jax_am.fem.generate_mesh import get_meshio_cell_type
 
 
 def save_sol(problem, sol, sol_file, cell_infos=None, point_infos=None):
+    """Save the solution as a meshio file. If the mesh was reordered
+    (Mesh.reorder), everything is written in the original node and cell order.
+    """
     cell_type = get_meshio_cell_type(problem.ele_type)
     sol_dir = os.path.dirname(sol_file)
     os.makedirs(sol_dir, exist_ok=True)
-    out_mesh = meshio.Mesh(points=problem.points, cells={cell_type: problem.cells})
-    out_mesh.point_data['sol'] = onp.array(sol, dtype=onp.float32)
+    mesh = problem.mesh
+    points = mesh.to_original_order(problem.points)
+    cells = mesh.to_original_order(problem.cells, 'cell')
+    if hasattr(mesh, 'node_perm'):
+        cells = mesh.node_perm[cells]
+    out_mesh = meshio.Mesh(points=points, cells={cell_type: cells})
+    out_mesh.point_data['sol'] = onp.array(mesh.to_original_order(sol),
+                                           dtype=onp.float32)
     if cell_infos is not None:
         for cell_info in cell_infos:
             name, data = cell_info
             # TODO: vector-valued cell data
             assert data.shape == (problem.num_cells,), f"cell data wrong shape, get {data.shape}, while num_cells = {problem.num_cells}"
-            out_mesh.cell_data[name] = [onp.array(data, dtype=onp.float32)]
+            out_mesh.cell_data[name] = [onp.array(
+                mesh.to_original_order(data, 'cell'), dtype=onp.float32)]
     if point_infos is not None:
         for point_info in point_infos:
             name, data = point_info
             assert len(data) == len(sol), "point data wrong shape!"
-            out_mesh.point_data[name] = onp.array(data, dtype=onp.float32)
+            out_mesh.point_data[name] = onp.array(
+                mesh.to_original_order(data), dtype=onp.float32)
     out_mesh.write(sol_file)
 
 
@@ -0,0 +1,243 @@
+"""Testing the global assembly
+1. The cached CSR pattern reproduces the COO -> CSR conversion of scipy
+2. Splitting the cells into padded batches does not change the residual
+3. Kernels are shared between instances through the kernel registry
+4. All geometry storage modes give the same residual and Jacobian
+5. The gather assembly backend matches the scatter-add one
+6. Reassigning an array read by a cached kernel re-traces it
+7. New parameters or load steps (internal variables) do not re-trace
+"""
+import numpy as onp
+import jax.numpy as np
+import scipy
+import pytest
+from tests_for_fem.elasticity2d_code import Elasticity
+from jax_am.fem.generate_mesh import get_meshio_cell_type, Mesh
+from jax_am.common import rectangle_mesh, box_mesh
+from jax_am.fem.models import LinearPoisson, HyperElasticity, Plasticity
+from jax_am.fem.solver import assemble_csr, solver
+from jax_am.fem import kernel_registry
+
+
+def get_problem(problem_cls=Elasticity, **kwargs):
+    ele_type = 'QUAD4'
+    cell_type = get_meshio_cell_type(ele_type)
+    Lx, Ly = 4., 2.
+    meshio_mesh = rectangle_mesh(Nx=4, Ny=2, domain_x=Lx, domain_y=Ly)
+    mesh = Mesh(meshio_mesh.points, meshio_mesh.cells_dict[cell_type])
+
+    def fixed_location(point):
+        return np.isclose(point[0], 0., atol=1e-5)
+
+    def dirichlet_val(point):
+        return 0.
+
+    dirichlet_bc_info = [[fixed_location]*2, [0, 1], [dirichlet_val]*2]
+    problem = problem_cls(mesh, vec=2, dim=2, ele_type=ele_type,
+                          dirichlet_bc_info=dirichlet_bc_info, **kwargs)
+    problem.set_params(np.ones((problem.num_cells, 1))*0.5)
+    return problem
+
+
+def test_csr_pattern():
+    problem = get_problem()
+    sol = np.ones((problem.num_total_nodes, problem.vec))
+    problem.newton_update(sol)
+    A_ref = scipy.sparse.csr_array(
+        (onp.array(problem.V), (problem.I, problem.J)),
+        shape=(problem.num_total_dofs, problem.num_total_dofs))
+    A = assemble_csr(problem)
+    onp.testing.assert_allclose(A.toarray(), A_ref.toarray(), atol=1e-10)
+
+    # The pattern is reused by later Newton iterations
+    csr_perm = problem.csr_perm
+    problem.newton_update(2.*sol)
+    assert problem.csr_perm is csr_perm
+
+
+def test_batched_cell_kernel():
+    problem = get_problem()
+    sol = np.ones((problem.num_total_nodes, problem.vec))
+    problem.batch_memory_budget = 0.
+    assert problem.get_batch_size(False) == 1
+    res_ref = problem.compute_residual(sol)
+    # 3 cells per batch, the last batch is padded
+    cell_bytes = problem.num_quads*problem.num_nodes*problem.vec*problem.dim*8
+    problem.batch_memory_budget = 3.*cell_bytes
+    assert problem.get_batch_size(False) == 3
+    res = problem.compute_residual(sol)
+    onp.testing.assert_allclose(res, res_ref, atol=1e-10)
+    problem.compute_residual(2.*sol)
+    assert len(problem.kernel_cache) == 1
+
+
+def test_kernel_registry():
+    kernel_registry.clear_kernel_registry()
+    meshio_mesh = rectangle_mesh(Nx=4, Ny=2, domain_x=4., domain_y=2.)
+    mesh = Mesh(meshio_mesh.points, meshio_mesh.cells_dict['quad'])
+    problems = [LinearPoisson(mesh, vec=1, dim=2, ele_type='QUAD4')
+                for _ in range(2)]
+    fns = [problem.get_vmap_cell_fn(True) for problem in problems]
+    assert fns[0] is fns[1]
+
+    # Also with the array attributes of the stress and strain history
+    meshio_mesh = box_mesh(2, 2, 2, 1., 1., 1.)
+    mesh = Mesh(meshio_mesh.points, meshio_mesh.cells_dict['hexahedron'])
+    problems = [Plasticity(mesh, vec=3, dim=3) for _ in range(2)]
+    fns = [problem.get_vmap_cell_fn(True) for problem in problems]
+    assert fns[0] is fns[1]
+    assert not hasattr(problems[0], 'kernel_cache')
+
+    # Kernels of classes that do not opt in stay on the instance
+    problem = get_problem()
+    problem.get_vmap_cell_fn(True)
+    assert len(problem.kernel_cache) == 1
+
+
+def test_geometry_modes():
+    meshio_mesh = box_mesh(3, 2, 2, 1., 1., 1.)
+    points = meshio_mesh.points.copy()
+    # Distort one node so that the cells do not all have the same shape
+    points[onp.argmax(onp.sum(points, axis=1) == 1.5)] += 0.05
+    mesh = Mesh(points, meshio_mesh.cells_dict['hexahedron'])
+    sol = 0.01*onp.random.default_rng(0).random((len(points), 3))
+    vars_ref = None
+    for mode in ['full', 'jacobian', 'points', 'unique']:
+        problem = HyperElasticity(mesh, vec=3, dim=3, ele_type='HEX8',
+                                  geometry_mode=mode)
+        res = problem.compute_residual(sol)
+        problem.newton_update(sol)
+        if vars_ref is None:
+            vars_ref = (res, onp.array(problem.V), problem.shape_grads)
+            continue
+        onp.testing.assert_allclose(res, vars_ref[0], atol=1e-10)
+        onp.testing.assert_allclose(problem.V, vars_ref[1], atol=1e-10)
+        onp.testing.assert_allclose(problem.shape_grads, vars_ref[2],
+                                    atol=1e-10)
+        # Built once in the compact modes
+        assert problem.v_grads_JxW is problem.v_grads_JxW
+        with pytest.raises(AttributeError):
+            problem.shape_grads = vars_ref[2]
+    assert onp.max(problem.cell_shape_ids) + 1 < problem.num_cells
+
+
+def test_gather_assembly():
+    def right(point):
+        return np.isclose(point[0], 4., atol=1e-5)
+
+    def traction(point):
+        return np.array([point[1], -1.])
+
+    def source(point):
+        return np.array([0., point[0]])
+
+    kwargs = {'neumann_bc_info': [[right], [traction]], 'source_info': source}
+    sol = onp.random.default_rng(0).random((15, 2))
+    vals = []
+    for backend in ['scatter', 'gather']:
+        problem = get_problem(assembly_backend=backend, **kwargs)
+        res = problem.compute_residual(sol)
+        problem.linearize(sol)
+        vals.append((res, problem.A_diag, problem.A_jvp(sol)))
+    for val, val_ref in zip(vals[1], vals[0]):
+        onp.testing.assert_allclose(val, val_ref, atol=1e-10)
+    # The gather table is computed once
+    assert len(problem.gather_tables) == 2
+    table = problem.gather_tables['cells']['table']
+    onp.testing.assert_array_equal(problem.compute_residual(sol), vals[1][0])
+    assert problem.gather_tables['cells']['table'] is table
+
+
+class AnisotropicPoisson(LinearPoisson):
+    """Conductivity read from the instance, as the macroscopic strain of the
+    RVE problem of the multi-scale application
+    """
+    share_kernels = False
+    kernel_state_attrs = ('conductivity',)
+
+    def custom_init(self):
+        self.conductivity = np.eye(self.dim)
+
+    def get_tensor_map(self):
+        return lambda u_grad: u_grad @ self.conductivity
+
+
+def test_kernel_array_attribute():
+    meshio_mesh = rectangle_mesh(Nx=4, Ny=2, domain_x=4., domain_y=2.)
+    mesh = Mesh(meshio_mesh.points, meshio_mesh.cells_dict['quad'])
+
+    def walls(point):
+        return np.isclose(point[0], 0., atol=1e-5) | np.isclose(
+            point[0], 4., atol=1e-5)
+
+    dirichlet_bc_info = [[walls], [0], [lambda point: 0.]]
+    problem = AnisotropicPoisson(mesh, vec=1, dim=2, ele_type='QUAD4',
+                                 dirichlet_bc_info=dirichlet_bc_info,
+                                 source_info=lambda point: np.array([1.]))
+    sol = onp.random.default_rng(0).random((problem.num_total_nodes, 1))
+    res_ref = problem.compute_residual(sol) + problem.body_force
+    sol_ref = solver(problem, linear=True)
+    assert onp.max(onp.abs(sol_ref)) > 0.1
+
+    # The conductivity is reassigned between solves, as the RVE problem does
+    # with its macroscopic strain
+    problem.conductivity = 2.*np.eye(problem.dim)
+    res = problem.compute_residual(sol) + problem.body_force
+    onp.testing.assert_allclose(res, 2.*res_ref, atol=1e-10)
+    onp.testing.assert_allclose(solver(problem, linear=True), 0.5*sol_ref,
+                                atol=1e-8)
+    assert len(problem.kernel_cache) <= problem.max_kernel_cache_size
+
+
+class CountedElasticity(Elasticity):
+    """Counts the traces of its stress function"""
+    num_traces = 0
+
+    def get_tensor_map(self):
+        stress = super().get_tensor_map()
+
+        def counted_stress(u_grad, theta):
+            CountedElasticity.num_traces += 1
+            return stress(u_grad, theta)
+        return counted_stress
+
+
+class CountedPlasticity(Plasticity):
+    """Counts the traces of its stress return map"""
+    share_kernels = True
+    num_traces = 0
+
+    def get_tensor_map(self):
+        stress_return_map = super().get_tensor_map()
+
+        def counted_stress_return_map(u_grad, sigma_old, epsilon_old):
+            CountedPlasticity.num_traces += 1
+            return stress_return_map(u_grad, sigma_old, epsilon_old)
+        return counted_stress_return_map
+
+
+def test_kernel_internal_vars():
+    # set_params only changes the internal variables
+    problem = get_problem(CountedElasticity)
+    sol = onp.random.default_rng(0).random((problem.num_total_nodes, 2))
+    problem.compute_residual(sol)
+    problem.newton_update(sol)
+    num_traces = CountedElasticity.num_traces
+    assert num_traces > 0
+    problem.set_params(np.ones((problem.num_cells, 1))*0.8)
+    problem.compute_residual(sol)
+    problem.newton_update(sol)
+    assert CountedElasticity.num_traces == num_traces
+
+    # So does a load step of a plasticity problem
+    kernel_registry.clear_kernel_registry()
+    meshio_mesh = box_mesh(2, 2, 2, 1., 1., 1.)
+    mesh = Mesh(meshio_mesh.points, meshio_mesh.cells_dict['hexahedron'])
+    problem = CountedPlasticity(mesh, vec=3, dim=3)
+    sol = 1e-3*onp.random.default_rng(0).random((problem.num_total_nodes, 3))
+    problem.newton_update(sol)
+    num_traces = CountedPlasticity.num_traces
+    assert num_traces > 0
+    problem.update_stress_strain(sol)
+    problem.newton_update(2.*sol)
+    assert CountedPlasticity.num_traces == num_traces
@@ -0,0 +1,177 @@
+"""Testing the setup of boundary conditions
+1. Periodic node pairs found with the k-d tree
+2. Face geometry of Neumann and Cauchy B.C. is cached
+3. Boundary faces can be searched among the external faces of the mesh only
+4. Periodic and Dirichlet B.C. eliminated by the reduced solver
+"""
+import pytest
+import numpy as onp
+import jax.numpy as np
+from jax_am.fem.generate_mesh import Mesh
+from jax_am.common import rectangle_mesh
+from jax_am.fem.models import LinearPoisson
+from jax_am.fem.solver import solver, restrict
+
+
+def get_mesh():
+    meshio_mesh = rectangle_mesh(Nx=8, Ny=4, domain_x=2., domain_y=1.)
+    return Mesh(meshio_mesh.points, meshio_mesh.cells_dict['quad'])
+
+
+def left(point):
+    return np.isclose(point[0], 0., atol=1e-5)
+
+
+def right(point):
+    return np.isclose(point[0], 2., atol=1e-5)
+
+
+def test_periodic_matching():
+    mesh = get_mesh()
+
+    def mapping_x(point_A):
+        return point_A + np.array([2., 0.])
+
+    periodic_bc_info = [[left], [right], [mapping_x], [0]]
+    problem = LinearPoisson(mesh, vec=1, dim=2, ele_type='QUAD4',
+                            periodic_bc_info=periodic_bc_info)
+    node_inds_A, = problem.p_node_inds_list_A
+    node_inds_B, = problem.p_node_inds_list_B
+    assert len(node_inds_A) == 5
+    onp.testing.assert_allclose(mesh.points[node_inds_B],
+                                mesh.points[node_inds_A] + onp.array([2., 0.]))
+
+    # A mapping without images on B is reported
+    def wrong_mapping_x(point_A):
+        return point_A + np.array([2., 0.1])
+
+    periodic_bc_info = [[left], [right], [wrong_mapping_x], [0]]
+    with pytest.raises(AssertionError, match="have no image on boundary B"):
+        LinearPoisson(mesh, vec=1, dim=2, ele_type='QUAD4',
+                      periodic_bc_info=periodic_bc_info)
+
+
+def test_face_geometry_cache():
+    mesh = get_mesh()
+
+    def neumann_val(point):
+        return np.array([point[1]])
+
+    def cauchy_map(u):
+        return 2.*u
+
+    problem = LinearPoisson(mesh, vec=1, dim=2, ele_type='QUAD4',
+                            neumann_bc_info=[[right], [neumann_val]],
+                            cauchy_bc_info=[[left], [cauchy_map]])
+    # The flux y over the right edge x = 2, y in [0, 1] integrates to 1/2
+    neumann = problem.compute_Neumann_integral_vars()
+    onp.testing.assert_allclose(np.sum(neumann), 0.5, rtol=1e-10)
+    face_geo = problem.face_geometry_cache[('neumann', 0)]
+    problem.compute_Neumann_integral_vars()
+    assert problem.face_geometry_cache[('neumann', 0)] is face_geo
+
+    # A new subset replaces the entry
+    problem.neumann_boundary_inds_list = [
+        problem.neumann_boundary_inds_list[0][:2]]
+    onp.testing.assert_allclose(
+        np.sum(problem.compute_Neumann_integral_vars()), 0.5*(0.5**2),
+        rtol=1e-10)
+
+    # Cauchy faces are located once, u = 1 integrates to 2 over the left edge
+    sol = np.ones((problem.num_total_nodes, problem.vec))
+    values, _ = problem.compute_face(sol[problem.cells], np, False)
+    onp.testing.assert_allclose(np.sum(values), 2., rtol=1e-10)
+    boundary_inds_list = problem.cauchy_boundary_inds_list
+    problem.compute_face(sol[problem.cells], np, True)
+    assert problem.cauchy_boundary_inds_list is boundary_inds_list
+
+
+def test_external_faces():
+    mesh = get_mesh()
+    mesh.ele_type = 'QUAD4'
+    external_faces = mesh.get_external_faces()
+    assert len(external_faces) == 2*(8 + 4)
+    assert mesh.get_external_faces() is external_faces
+    assert mesh.count_selected_faces(left, external_only=True) == 4
+
+    def interface(point):
+        return np.isclose(point[0], 1., atol=1e-5)
+
+    assert mesh.count_selected_faces(interface) == 8
+    assert mesh.count_selected_faces(interface, external_only=True) == 0
+
+    # Same boundary faces as testing every face of every cell
+    problems = [LinearPoisson(mesh, vec=1, dim=2, ele_type='QUAD4',
+                              external_faces_only=external_faces_only)
+                for external_faces_only in (False, True)]
+    cell_face_points = mesh.points[mesh.cells][:, problems[0].face_inds]
+    flags = onp.all(onp.isclose(cell_face_points[..., 0], 2., atol=1e-5),
+                    axis=-1)
+    for problem in problems:
+        boundary_inds, interface_inds = \
+            problem.get_boundary_conditions_inds([right, interface])
+        onp.testing.assert_array_equal(boundary_inds, onp.argwhere(flags))
+    # Internal interfaces are only found among all faces
+    assert len(problems[0].get_boundary_conditions_inds([interface])[0]) == 8
+    assert len(interface_inds) == 0
+
+
+def test_periodic_elimination():
+    mesh = get_mesh()
+
+    def bottom(point):
+        return np.isclose(point[1], 0., atol=1e-5)
+
+    def top(point):
+        return np.isclose(point[1], 1., atol=1e-5)
+
+    def corner(point):
+        return np.isclose(np.linalg.norm(point), 0., atol=1e-5)
+
+    def zero_val(point):
+        return 0.
+
+    def mapping_x(point_A):
+        return point_A + np.array([2., 0.])
+
+    def mapping_y(point_A):
+        return point_A + np.array([0., 1.])
+
+    def source_y(point):
+        return np.array([10.*point[1]])
+
+    # A source independent of x gives the solution with natural B.C. on the
+    # left and right sides
+    dirichlet_bc_info = [[bottom, top], [0, 0], [zero_val]*2]
+    problem_ref = LinearPoisson(mesh, vec=1, dim=2, ele_type='QUAD4',
+                                dirichlet_bc_info=dirichlet_bc_info,
+                                source_info=source_y)
+    problem = LinearPoisson(mesh, vec=1, dim=2, ele_type='QUAD4',
+                            dirichlet_bc_info=dirichlet_bc_info,
+                            periodic_bc_info=[[left], [right], [mapping_x],
+                                              [0]],
+                            source_info=source_y)
+    onp.testing.assert_allclose(solver(problem, linear=True, reduced=True),
+                                solver(problem_ref, linear=True), atol=1e-6)
+
+    # Chained periodic B.C. in x and y tie the four corners to the fixed one
+    def source(point):
+        return np.array([10.*np.sin(np.pi*point[0])*point[1]])
+
+    problem = LinearPoisson(mesh, vec=1, dim=2, ele_type='QUAD4',
+                            dirichlet_bc_info=[[corner], [0], [zero_val]],
+                            periodic_bc_info=[[left, bottom], [right, top],
+                                              [mapping_x, mapping_y], [0, 0]],
+                            source_info=source)
+    for kwargs in ({}, {'use_petsc': True, 'precond': 'cholesky'}):
+        sol = solver(problem, linear=True, reduced=True, **kwargs)
+        for node_inds_A, node_inds_B in zip(problem.p_node_inds_list_A,
+                                            problem.p_node_inds_list_B):
+            onp.testing.assert_allclose(sol[node_inds_A], sol[node_inds_B],
+                                        atol=1e-12)
+        corners = onp.flatnonzero(onp.all(
+            onp.isclose(mesh.points % onp.array([2., 1.]), 0.), axis=1))
+        assert len(corners) == 4 and onp.all(sol[corners] == 0.)
+        res = restrict(problem, problem.compute_residual(sol).reshape(-1))
+        assert np.max(np.abs(res)) < 1e-8
+        assert np.max(np.abs(sol)) > 0.1
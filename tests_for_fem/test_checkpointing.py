@@ -0,0 +1,112 @@
+"""Testing the checkpointed rollout against plain reverse-mode AD
+1. Split points and repetitions of the binomial schedule
+2. Gradients and number of stored checkpoints, in memory and on disk
+3. Disk checkpoints removed when the VJP is never pulled
+"""
+import gc
+import os
+import numpy as onp
+import jax
+import jax.numpy as np
+import jax_am.fem.checkpointing
+from jax_am.fem.checkpointing import (get_checkpointed_rollout, get_split,
+                                      num_repetitions, CheckpointStore)
+
+
+def step_fn(state, params, step):
+    u, objective = state
+    u = u + 0.1*np.sin(params['k']*u) + 0.01*step*params['f']
+    return u, objective + np.sum(u**2)
+
+
+def record_stores(monkeypatch):
+    """Keep the checkpoint stores created by the rollouts"""
+    stores = []
+
+    @jax.tree_util.register_pytree_node_class
+    class RecordedStore(CheckpointStore):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            stores.append(self)
+
+    monkeypatch.setattr(jax_am.fem.checkpointing, 'CheckpointStore',
+                        RecordedStore)
+    return stores
+
+
+def get_inputs():
+    state = (np.linspace(0., 1., 5), np.array(0.))
+    params = {'k': np.array(1.5), 'f': np.linspace(1., 2., 5)}
+    return state, params
+
+
+def test_schedule():
+    # binomial(3 + 2, 2) = 10 steps are reversed with 3 slots, 2 repetitions
+    assert num_repetitions(10, 3) == 2 and num_repetitions(11, 3) == 3
+    for num_steps in range(2, 30):
+        for num_slots in range(1, 5):
+            split = get_split(num_steps, num_slots)
+            assert 0 < split < num_steps
+            t = num_repetitions(num_steps, num_slots)
+            assert num_repetitions(num_steps - split, num_slots - 1) <= t
+            assert num_repetitions(split, num_slots) <= t - 1
+
+
+def test_checkpointed_rollout(tmp_path, monkeypatch):
+    num_steps = 20
+    stores = record_stores(monkeypatch)
+    state, params = get_inputs()
+
+    def objective(rollout, state, params):
+        u, objective = rollout(state, params)
+        return objective + np.sum(u)
+
+    def plain_rollout(state, params):
+        for step in range(num_steps):
+            state = step_fn(state, params, step)
+        return state
+
+    grads_ref = jax.grad(objective, argnums=(1, 2))(plain_rollout, state,
+                                                    params)
+    num_calls = []
+
+    def counted_step_fn(state, params, step):
+        num_calls.append(step)
+        return step_fn(state, params, step)
+
+    for num_slots, num_memory_slots in [(None, None), (2, 2), (3, 1)]:
+        num_calls.clear()
+        stores.clear()
+        rollout = get_checkpointed_rollout(counted_step_fn, num_steps,
+                                           num_slots, num_memory_slots,
+                                           disk_dir=str(tmp_path))
+        onp.testing.assert_allclose(rollout(state, params)[1],
+                                    plain_rollout(state, params)[1])
+        grads = jax.grad(objective, argnums=(1, 2))(rollout, state, params)
+        for x, x_ref in zip(jax.tree_util.tree_leaves(grads),
+                            jax.tree_util.tree_leaves(grads_ref)):
+            onp.testing.assert_allclose(x, x_ref, rtol=1e-6, atol=1e-8)
+        # Each step is run at most once per repetition, plus its VJP
+        slots = 5 if num_slots is None else num_slots
+        t = num_repetitions(num_steps, slots)
+        assert len(num_calls) <= num_steps*(t + 2)
+        # At most num_slots checkpoints besides the initial state
+        assert len(stores) == 1
+        assert stores[0].max_num_stored <= slots + 1
+        # Disk checkpoints are removed after the backward pass
+        assert len(os.listdir(tmp_path)) == 0
+
+
+def test_unpulled_vjp(monkeypatch):
+    num_steps = 10
+    state, params = get_inputs()
+    stores = record_stores(monkeypatch)
+    rollout = get_checkpointed_rollout(step_fn, num_steps, num_slots=3,
+                                       num_memory_slots=1)
+    _, rollout_vjp = jax.vjp(rollout, state, params)
+    disk_dir = stores[0].disk_dir
+    assert len(os.listdir(disk_dir)) > 0
+    del rollout_vjp
+    stores.clear()
+    gc.collect()
+    assert not os.path.exists(disk_dir)
@@ -0,0 +1,51 @@
+"""Testing the density filters of topology optimization
+1. The sparse k-d tree filter reproduces the dense distance weights
+2. The sensitivity filter matches its dense version
+3. The Helmholtz filter preserves a uniform density
+"""
+import numpy as onp
+from tests_for_fem.elasticity2d_code import Elasticity
+from jax_am.fem.generate_mesh import Mesh
+from jax_am.common import rectangle_mesh
+from jax_am.fem.mma import (compute_filter_kd_tree, get_filter,
+                            get_filter_radius, applySensitivityFilter)
+
+
+def get_problem():
+    meshio_mesh = rectangle_mesh(Nx=12, Ny=6, domain_x=2., domain_y=1.)
+    mesh = Mesh(meshio_mesh.points, meshio_mesh.cells_dict['quad'])
+    return Elasticity(mesh, vec=2, dim=2, ele_type='QUAD4')
+
+
+def test_kd_tree_filter():
+    problem = get_problem()
+    H, Hs = compute_filter_kd_tree(problem)
+    centroids = onp.mean(problem.points[problem.cells], axis=1)
+    dist = onp.linalg.norm(centroids[:, None, :] - centroids[None, :, :],
+                           axis=-1)
+    H_ref = onp.maximum(get_filter_radius(problem) - dist, 0.)
+    onp.testing.assert_allclose(H.toarray(), H_ref, atol=1e-10)
+    onp.testing.assert_allclose(Hs, onp.sum(H_ref, axis=1), atol=1e-10)
+
+
+def test_sensitivity_filter():
+    problem = get_problem()
+    ft = get_filter(problem, 'kd_tree')
+    H, Hs = ft['H'].toarray(), ft['Hs']
+    rng = onp.random.default_rng(0)
+    rho = rng.random((problem.num_cells, 1))
+    dJ = rng.random((problem.num_cells, 1))
+    dvc = rng.random((2, problem.num_cells, 1))
+    dJ_f, dvc_f = applySensitivityFilter(ft, rho, dJ, dvc)
+    dJ_ref = H @ (rho*dJ/onp.maximum(1e-3, rho)/Hs[:, None])
+    dvc_ref = onp.matmul(H[None, :, :], rho[None, :, :]*dvc/onp.maximum(
+        1e-3, rho[None, :, :])/Hs[None, :, None])
+    onp.testing.assert_allclose(dJ_f, dJ_ref, rtol=1e-10)
+    onp.testing.assert_allclose(dvc_f, dvc_ref, rtol=1e-10)
+
+
+def test_helmholtz_filter():
+    problem = get_problem()
+    filter_fn = get_filter(problem, 'helmholtz')['filter_fn']
+    ones = onp.ones((problem.num_cells, 2))
+    onp.testing.assert_allclose(filter_fn(ones), ones, atol=1e-6)
@@ -0,0 +1,74 @@
+"""Testing the locality reordering of Mesh
+1. RCM reduces the bandwidth of a shuffled mesh
+2. The solution on the reordered mesh maps back to the original one
+3. save_sol writes in the original order
+"""
+import numpy as onp
+import jax.numpy as np
+import meshio
+from jax_am.fem.generate_mesh import Mesh
+from jax_am.fem.models import LinearElasticity
+from jax_am.fem.solver import solver
+from jax_am.fem.utils import save_sol
+from jax_am.common import box_mesh
+
+
+def get_shuffled_mesh():
+    meshio_mesh = box_mesh(4, 3, 3, 1., 1., 1.)
+    points, cells = meshio_mesh.points, meshio_mesh.cells_dict['hexahedron']
+    rng = onp.random.default_rng(0)
+    node_perm = rng.permutation(len(points))
+    cell_perm = rng.permutation(len(cells))
+    return Mesh(points[node_perm], onp.argsort(node_perm)[cells[cell_perm]],
+                ele_type='HEX8')
+
+
+def get_bandwidth(cells):
+    return onp.max(onp.max(cells, axis=1) - onp.min(cells, axis=1))
+
+
+def get_sol(mesh):
+    def left(point):
+        return np.isclose(point[0], 0., atol=1e-5)
+
+    def right(point):
+        return np.isclose(point[0], 1., atol=1e-5)
+
+    def zero_val(point):
+        return 0.
+
+    def pull_val(point):
+        return 0.01
+
+    dirichlet_bc_info = [[left]*3 + [right], [0, 1, 2, 0],
+                         [zero_val]*3 + [pull_val]]
+    problem = LinearElasticity(mesh, vec=3, dim=3, ele_type='HEX8',
+                               dirichlet_bc_info=dirichlet_bc_info)
+    return problem, solver(problem, linear=True)
+
+
+def test_reorder(tmp_path):
+    mesh = get_shuffled_mesh()
+    original_points, original_cells = mesh.points.copy(), mesh.cells.copy()
+    _, sol_ref = get_sol(mesh)
+
+    mesh = get_shuffled_mesh().reorder()
+    assert get_bandwidth(mesh.cells) < get_bandwidth(original_cells) / 1.5
+    onp.testing.assert_allclose(mesh.to_original_order(mesh.points),
+                                original_points)
+    onp.testing.assert_allclose(mesh.from_original_order(original_points),
+                                mesh.points)
+    problem, sol = get_sol(mesh)
+    onp.testing.assert_allclose(mesh.to_original_order(sol), sol_ref,
+                                atol=1e-8)
+
+    sol_file = str(tmp_path / 'u.vtu')
+    save_sol(problem, sol, sol_file,
+             cell_infos=[('id', onp.arange(problem.num_cells))])
+    out_mesh = meshio.read(sol_file)
+    onp.testing.assert_allclose(out_mesh.points, original_points)
+    onp.testing.assert_array_equal(out_mesh.cells_dict['hexahedron'],
+                                   original_cells)
+    onp.testing.assert_allclose(out_mesh.point_data['sol'], sol_ref, atol=1e-6)
+    onp.testing.assert_array_equal(out_mesh.cell_data['id'][0],
+                                   onp.argsort(mesh.cell_perm))
@@ -0,0 +1,61 @@
+"""Testing the sharded matrix-free solver against the default solver
+1. On the devices of the test process
+2. On 4 host devices, in a subprocess since the device count is fixed when
+jax is imported
+"""
+import os
+import subprocess
+import sys
+import numpy as onp
+import jax
+import jax.numpy as np
+from jax_am.fem.generate_mesh import Mesh
+from jax_am.fem.models import HyperElasticity
+from jax_am.fem.solver import solver
+from jax_am.common import box_mesh
+
+
+def check_sharded_solve(num_devices):
+    assert jax.device_count() == num_devices
+    meshio_mesh = box_mesh(5, 3, 3, 1., 1., 1.)
+    mesh = Mesh(meshio_mesh.points,
+                meshio_mesh.cells_dict['hexahedron']).reorder()
+
+    def left(point):
+        return np.isclose(point[0], 0., atol=1e-5)
+
+    def right(point):
+        return np.isclose(point[0], 1., atol=1e-5)
+
+    def zero_val(point):
+        return 0.
+
+    def pull_val(point):
+        return 0.1
+
+    dirichlet_bc_info = [[left]*3 + [right], [0, 1, 2, 0],
+                         [zero_val]*3 + [pull_val]]
+    problem = HyperElasticity(mesh, vec=3, dim=3, ele_type='HEX8',
+                              dirichlet_bc_info=dirichlet_bc_info)
+    sol_ref = solver(problem)
+    for precond in (True, False):
+        sol = solver(problem, matrix_free='sharded', precond=precond)
+        onp.testing.assert_allclose(sol, sol_ref, atol=1e-6)
+    assert len(problem.partition['cells']) % num_devices == 0
+    assert len(problem.partition['mask'].sharding.device_set) == num_devices
+
+
+def test_sharded_solve():
+    check_sharded_solve(jax.device_count())
+
+
+def test_sharded_solve_multi_device():
+    env = dict(os.environ)
+    env['XLA_FLAGS'] = '--xla_force_host_platform_device_count=4'
+    env['JAX_PLATFORMS'] = 'cpu'
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    script = ("from tests_for_fem.test_parallel import check_sharded_solve\n"
+              "check_sharded_solve(4)")
+    result = subprocess.run([sys.executable, '-c', script], cwd=root, env=env,
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr[-3000:]
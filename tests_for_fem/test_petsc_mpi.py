@@ -0,0 +1,94 @@
+"""Testing the MPI PETSc solver against the default solver
+1. Partition of the cells (RCM fallback on one rank, graph partitioner on
+the ranks of mpirun)
+2. On the ranks of the test process (usually one)
+3. On 2 ranks with mpirun, if available
+"""
+import os
+import shutil
+import subprocess
+import sys
+import numpy as onp
+import jax.numpy as np
+import pytest
+from petsc4py import PETSc
+from jax_am.fem.generate_mesh import Mesh
+from jax_am.fem.models import HyperElasticity
+from jax_am.fem.solver import solver
+from jax_am.fem.petsc_mpi import (mpi_solver, partition_cells,
+                                  rcm_partition_cells)
+from jax_am.common import box_mesh
+
+
+def get_problem():
+    meshio_mesh = box_mesh(5, 3, 3, 1., 1., 1.)
+    mesh = Mesh(meshio_mesh.points, meshio_mesh.cells_dict['hexahedron'])
+
+    def left(point):
+        return np.isclose(point[0], 0., atol=1e-5)
+
+    def right(point):
+        return np.isclose(point[0], 1., atol=1e-5)
+
+    def zero_val(point):
+        return 0.
+
+    def pull_val(point):
+        return 0.1
+
+    dirichlet_bc_info = [[left]*3 + [right], [0, 1, 2, 0],
+                         [zero_val]*3 + [pull_val]]
+    return HyperElasticity(mesh, vec=3, dim=3, ele_type='HEX8',
+                           dirichlet_bc_info=dirichlet_bc_info)
+
+
+def check_mpi_solve():
+    problem = get_problem()
+    sol = mpi_solver(problem)
+    sol_ref = solver(problem)
+    onp.testing.assert_allclose(sol, sol_ref, atol=1e-6)
+    sol = mpi_solver(problem, precond=False)
+    onp.testing.assert_allclose(sol, sol_ref, atol=1e-6)
+    # Graph partitioners balance the parts up to a few percent
+    num_local_cells = len(problem.mpi_partition['local_cells'])
+    num_ranks = PETSc.COMM_WORLD.getSize()
+    assert abs(num_local_cells - problem.num_cells / num_ranks) < \
+        0.1*problem.num_cells + 1.
+
+
+def test_partition_cells():
+    meshio_mesh = box_mesh(4, 4, 4, 1., 1., 1.)
+    cells = meshio_mesh.cells_dict['hexahedron']
+    assert onp.all(partition_cells(cells) == 0)
+    cell_parts = rcm_partition_cells(cells, 4)
+    assert onp.all(onp.bincount(cell_parts) == 16)
+    # Each part shares fewer nodes with the others than a random split
+    def num_interface_nodes(parts):
+        node_parts = [set() for _ in range(cells.max() + 1)]
+        for cell, part in zip(cells, parts):
+            for node in cell:
+                node_parts[node].add(part)
+        return sum(len(p) > 1 for p in node_parts)
+    random_parts = onp.random.default_rng(0).permutation(cell_parts)
+    assert num_interface_nodes(cell_parts) < \
+        0.75*num_interface_nodes(random_parts)
+
+
+def test_mpi_solve():
+    check_mpi_solve()
+
+
+@pytest.mark.skipif(shutil.which('mpirun') is None,
+                    reason="mpirun is not available")
+def test_mpi_solve_two_ranks():
+    env = dict(os.environ)
+    env['OMPI_ALLOW_RUN_AS_ROOT'] = '1'
+    env['OMPI_ALLOW_RUN_AS_ROOT_CONFIRM'] = '1'
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = root + os.pathsep + env.get('PYTHONPATH', '')
+    script = ("from tests_for_fem.test_petsc_mpi import check_mpi_solve\n"
+              "check_mpi_solve()")
+    result = subprocess.run(['mpirun', '--oversubscribe', '-n', '2',
+                             sys.executable, '-c', script],
+                            cwd=root, env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr[-3000:]
@@ -0,0 +1,99 @@
+"""Testing the quadrature policy
+1. Minimal exact orders per element type
+2. The 'exact' rule gives the same cell Jacobians as a higher order rule
+3. Selective integration adds a term integrated with the 'reduced' rule
+4. Face terms are integrated exactly with the 'exact' rule
+"""
+import numpy as onp
+import jax.numpy as np
+from jax_am.fem.basis import get_gauss_order, get_shape_vals_and_grads
+from jax_am.fem.generate_mesh import Mesh
+from jax_am.fem.core import FEM
+from jax_am.common import box_mesh
+
+
+def deviatoric_stress(u_grad):
+    epsilon = 0.5*(u_grad + u_grad.T)
+    return 2.*(epsilon - np.trace(epsilon)/3.*np.eye(3))
+
+
+def volumetric_stress(u_grad):
+    return 10.*np.trace(u_grad)*np.eye(3)
+
+
+class Deviatoric(FEM):
+    def get_tensor_map(self):
+        return deviatoric_stress
+
+
+class Volumetric(FEM):
+    def get_tensor_map(self):
+        return volumetric_stress
+
+
+class Selective(Deviatoric):
+    def get_reduced_tensor_map(self):
+        return volumetric_stress
+
+
+def get_mesh():
+    meshio_mesh = box_mesh(2, 2, 2, 1., 1., 1.)
+    return Mesh(meshio_mesh.points, meshio_mesh.cells_dict['hexahedron'])
+
+
+def test_gauss_order():
+    assert get_gauss_order('HEX8', 'exact') == 2
+    assert get_gauss_order('HEX8', 'reduced') == 0
+    assert get_gauss_order('TET4', 'exact') == 0
+    assert get_gauss_order('TET4', 'exact', mass=True) == 2
+    assert get_gauss_order('HEX27', 'exact') == 4
+    assert get_gauss_order('HEX27') == 10
+    assert get_gauss_order('HEX27', 7) == 7
+    shape_vals, _, _ = get_shape_vals_and_grads(
+        'HEX27', get_gauss_order('HEX27', 'exact'))
+    assert shape_vals.shape == (27, 27)
+
+
+def test_exact_quadrature():
+    mesh = get_mesh()
+    sol = 0.01*onp.random.default_rng(0).random((len(mesh.points), 3))
+    Vs = []
+    for quadrature in ['exact', 6]:
+        problem = Volumetric(mesh, vec=3, dim=3, quadrature=quadrature)
+        problem.newton_update(sol)
+        Vs.append(onp.array(problem.V))
+    assert problem.num_quads == 64
+    onp.testing.assert_allclose(Vs[0], Vs[1], atol=1e-10)
+
+
+def test_selective_integration():
+    mesh = get_mesh()
+    sol = 0.01*onp.random.default_rng(0).random((len(mesh.points), 3))
+    res = Selective(mesh, vec=3, dim=3).compute_residual(sol)
+    res_ref = (Deviatoric(mesh, vec=3, dim=3).compute_residual(sol) +
+               Volumetric(mesh, vec=3, dim=3,
+                          quadrature='reduced').compute_residual(sol))
+    onp.testing.assert_allclose(res, res_ref, atol=1e-10)
+
+
+def test_face_quadrature():
+    # A single tetrahedron, loaded on its face x = 0 by a linear traction
+    points = onp.array([[0., 0., 0.], [1., 0., 0.], [0., 1., 0.],
+                        [0., 0., 1.]])
+    mesh = Mesh(points, onp.array([[0, 1, 2, 3]]))
+
+    def left(point):
+        return np.isclose(point[0], 0., atol=1e-5)
+
+    def traction(point):
+        return np.array([point[1], point[2], 1.])
+
+    sol = onp.zeros((4, 3))
+    problems = [Volumetric(mesh, vec=3, dim=3, ele_type='TET4',
+                           neumann_bc_info=[[left], [traction]],
+                           quadrature=quadrature)
+                for quadrature in ['exact', 4]]
+    assert problems[0].gauss_order == 0
+    assert problems[0].face_gauss_order == 2
+    onp.testing.assert_allclose(problems[0].compute_residual(sol),
+                                problems[1].compute_residual(sol), atol=1e-10)
@@ -0,0 +1,322 @@
+"""Testing the options of the FEM solver against the default solver
+1. Matrix-free tangent operator
+2. Jittable Newton solver
+3. Batched solves over parameter sets
+4. AMG preconditioner (JAX and PETSc)
+5. Solver state kept between solves (modified Newton, warm start)
+6. PETSc matrix and work vectors reused between solves
+7. Reduced system with the Dirichlet dofs eliminated (CG)
+8. Direct solvers with cached factorizations, forward and adjoint
+9. Adjoint solved with the tangent saved by the forward solve
+10. Caches built from the Dirichlet dofs follow updated B.C.
+"""
+import numpy as onp
+import pytest
+import jax
+import jax.numpy as np
+from tests_for_fem.elasticity2d_code import Elasticity
+from jax_am.fem.generate_mesh import get_meshio_cell_type, Mesh
+from jax_am.common import rectangle_mesh, box_mesh
+from jax_am.fem.models import HyperElasticity
+from jax_am.fem.solver import (solver, assemble_csr, get_jit_solver,
+                               batched_solver, SolverState, get_A_fn,
+                               petsc_solve, get_bc_dofs,
+                               assemble_reduced_csr, ad_wrapper,
+                               implicit_vjp, get_linearization)
+from jax_am.fem.amg import (get_near_nullspace, setup_hierarchy,
+                            standard_aggregation)
+
+_A_TOL_SOL = 1e-6
+
+
+def get_problem():
+    ele_type = 'QUAD4'
+    cell_type = get_meshio_cell_type(ele_type)
+    Lx, Ly = 20., 10.
+    meshio_mesh = rectangle_mesh(Nx=20, Ny=10, domain_x=Lx, domain_y=Ly)
+    mesh = Mesh(meshio_mesh.points, meshio_mesh.cells_dict[cell_type])
+
+    def fixed_location(point):
+        return np.isclose(point[0], 0., atol=1e-5)
+
+    def load_location(point):
+        return np.logical_and(np.isclose(point[0], Lx, atol=1e-5),
+                              np.isclose(point[1], 0., atol=0.1*Ly + 1e-5))
+
+    def dirichlet_val(point):
+        return 0.
+
+    def neumann_val(point):
+        return np.array([0., -100.])
+
+    dirichlet_bc_info = [[fixed_location]*2, [0, 1], [dirichlet_val]*2]
+    neumann_bc_info = [[load_location], [neumann_val]]
+    problem = Elasticity(mesh, vec=2, dim=2, ele_type=ele_type,
+                         dirichlet_bc_info=dirichlet_bc_info,
+                         neumann_bc_info=neumann_bc_info)
+    problem.set_params(np.ones((problem.num_cells, 1))*0.5)
+    return problem
+
+
+def test_matrix_free():
+    problem = get_problem()
+    sol_ref = solver(problem, linear=True)
+    sol = solver(problem, linear=True, matrix_free=True)
+    onp.testing.assert_allclose(sol, sol_ref, atol=_A_TOL_SOL)
+
+    # The extracted diagonal matches the assembled matrix
+    problem.newton_update(sol_ref)
+    problem.linearize(sol_ref)
+    onp.testing.assert_allclose(problem.A_diag,
+                                assemble_csr(problem).diagonal(), rtol=1e-10)
+
+
+def test_jit_solver():
+    problem = get_problem()
+    sol_ref = solver(problem, linear=True)
+    newton_solve = jax.jit(get_jit_solver(problem))
+    sol, num_iters = newton_solve(np.zeros_like(sol_ref),
+                                  problem.internal_vars, problem.vals_list)
+    onp.testing.assert_allclose(sol, sol_ref, atol=_A_TOL_SOL)
+    assert num_iters == 1
+
+
+def test_batched_solver():
+    problem = get_problem()
+    params_batch = np.linspace(0.4, 0.8, 3)[:, None, None]*np.ones(
+        (3, problem.num_cells, 1))
+    sols = batched_solver(problem, params_batch, batch_size=2)
+    for params, sol in zip(params_batch, sols):
+        problem.set_params(params)
+        sol_ref = solver(problem, linear=True)
+        onp.testing.assert_allclose(sol, sol_ref, atol=_A_TOL_SOL)
+
+
+def test_amg():
+    problem = get_problem()
+    sol_ref = solver(problem, linear=True)
+    sol = solver(problem, linear=True, precond='amg')
+    onp.testing.assert_allclose(sol, sol_ref, atol=_A_TOL_SOL)
+    sol = solver(problem, linear=True, precond='amg', use_petsc=True)
+    onp.testing.assert_allclose(sol, sol_ref, atol=_A_TOL_SOL)
+
+    # Rigid body modes are in the kernel of the matrix without B.C.
+    B = get_near_nullspace(problem)
+    A = assemble_csr(problem)
+    assert onp.max(onp.abs(A @ B)) < 1e-8*onp.max(onp.abs(A))
+
+    # Each node is in one aggregate, and the roots of the aggregates (the
+    # nodes with all their neighbors in the same one) cover all of them
+    graph = (abs(A) > 0.)[::problem.vec, ::problem.vec].tocsr()
+    aggregates, num_aggs = standard_aggregation(graph)
+    assert onp.all(aggregates >= 0)
+    assert onp.array_equal(onp.unique(aggregates), onp.arange(num_aggs))
+    is_root = onp.array([onp.all(aggregates[graph.indices[
+        graph.indptr[i]:graph.indptr[i + 1]]] == aggregates[i])
+        for i in range(graph.shape[0])])
+    assert onp.array_equal(onp.unique(aggregates[is_root]),
+                           onp.arange(num_aggs))
+
+    # The aggregation is computed once and reused by later setups
+    cache = []
+    levels, A_coarse = setup_hierarchy(A, B, problem.vec, cache, max_coarse=50)
+    assert len(levels) > 1 and A_coarse.shape[0] <= 50
+    tentatives = list(cache)
+    setup_hierarchy(2.*A, B, problem.vec, cache, max_coarse=50)
+    assert all(T is T_ref for T, T_ref in zip(cache, tentatives))
+
+
+def test_solver_state():
+    meshio_mesh = box_mesh(3, 3, 3, 1., 1., 1.)
+    mesh = Mesh(meshio_mesh.points, meshio_mesh.cells_dict['hexahedron'])
+
+    def left(point):
+        return np.isclose(point[0], 0., atol=1e-5)
+
+    def right(point):
+        return np.isclose(point[0], 1., atol=1e-5)
+
+    def zero_dirichlet_val(point):
+        return 0.
+
+    def pull_dirichlet_val(point):
+        return 0.1
+
+    dirichlet_bc_info = [[left]*3 + [right], [0, 1, 2, 0],
+                         [zero_dirichlet_val]*3 + [pull_dirichlet_val]]
+    problem = HyperElasticity(mesh, vec=3, dim=3, ele_type='HEX8',
+                              dirichlet_bc_info=dirichlet_bc_info)
+    sol_ref = solver(problem)
+
+    solver_state = SolverState(pc_update_interval=2, jac_update_interval=2)
+    sol = solver(problem, solver_state=solver_state)
+    onp.testing.assert_allclose(sol, sol_ref, atol=_A_TOL_SOL)
+    assert solver_state.inc is not None
+
+    # PETSc keeps its KSP between solves
+    solver_state = SolverState(pc_update_interval=2)
+    for _ in range(2):
+        sol = solver(problem, use_petsc=True, solver_state=solver_state)
+        onp.testing.assert_allclose(sol, sol_ref, atol=1e-5)
+    ksp = solver_state.ksp
+    solver(problem, use_petsc=True, solver_state=solver_state)
+    assert solver_state.ksp is ksp
+
+
+def test_petsc_reuse():
+    problem = get_problem()
+    sol_ref = solver(problem, linear=True)
+    sol = solver(problem, linear=True, use_petsc=True)
+    onp.testing.assert_allclose(sol, sol_ref, atol=_A_TOL_SOL)
+
+    # The matrix is created once, later assemblies only update its values
+    A = problem.petsc_A
+    problem.newton_update(sol_ref)
+    assert get_A_fn(problem, use_petsc=True) is A
+    A_sp_scipy = problem.A_sp_scipy
+    b = onp.ones(A.getSize()[0])
+    x1 = petsc_solve(A, b, 'preonly', 'lu', check_residual=True)
+    x2 = petsc_solve(A, 2.*b, 'preonly', 'lu')
+    # Solutions own their memory, b is untouched
+    onp.testing.assert_allclose(x2, 2.*x1, rtol=1e-8)
+    assert onp.all(b == 1.)
+    row_inds = onp.setdiff1d(onp.arange(len(b)), get_bc_dofs(problem))
+    onp.testing.assert_allclose((A_sp_scipy @ x1)[row_inds], b[row_inds],
+                                atol=1e-8)
+
+
+def test_reduced():
+    problem = get_problem()
+    sol_ref = solver(problem, linear=True)
+    sol = solver(problem, linear=True, reduced=True)
+    onp.testing.assert_allclose(sol, sol_ref, atol=_A_TOL_SOL)
+    sol = solver(problem, linear=True, reduced=True, matrix_free=True)
+    onp.testing.assert_allclose(sol, sol_ref, atol=_A_TOL_SOL)
+    for precond in (True, 'cholesky'):
+        sol = solver(problem, linear=True, reduced=True, use_petsc=True,
+                     precond=precond)
+        onp.testing.assert_allclose(sol, sol_ref, atol=_A_TOL_SOL)
+
+    # The reduced matrix is the symmetric free block of the global one
+    A_ff = assemble_reduced_csr(problem)
+    free_dofs = problem.reduced_pattern['masters']
+    A = assemble_csr(problem)
+    onp.testing.assert_allclose(A_ff.toarray(),
+                                A[free_dofs][:, free_dofs].toarray())
+    assert abs(A_ff - A_ff.T).max() < 1e-8*abs(A_ff).max()
+
+
+def test_direct_solver():
+    problem = get_problem()
+    sol_ref = solver(problem, linear=True)
+    for use_petsc in (False, True):
+        sol = solver(problem, linear=True, precond='lu', use_petsc=use_petsc)
+        onp.testing.assert_allclose(sol, sol_ref, atol=_A_TOL_SOL)
+    for precond in ('lu', 'cholesky'):
+        sol = solver(problem, linear=True, reduced=True, precond=precond)
+        onp.testing.assert_allclose(sol, sol_ref, atol=_A_TOL_SOL)
+    # The row eliminated matrix is not symmetric
+    for use_petsc in (False, True):
+        with pytest.raises(AssertionError):
+            solver(problem, linear=True, precond='cholesky',
+                   use_petsc=use_petsc)
+
+    # The factorization is reused while the matrix does not change, and the
+    # column ordering by the next factorizations
+    direct_solver = problem.direct_solvers[('lu', False, False)]
+    lu = direct_solver.lu
+    assert direct_solver.lu_col_order is None
+    solver(problem, linear=True, precond='lu')
+    assert direct_solver.lu is lu
+    problem.set_params(np.ones((problem.num_cells, 1))*0.3)
+    solver(problem, linear=True, precond='lu')
+    assert direct_solver.lu is not lu
+    assert direct_solver.lu_col_order is not None
+
+    # The adjoint solve reuses the factorization of the forward solve
+    def J(params):
+        return np.sum(fwd_pred(params)**2)
+
+    params = np.ones((problem.num_cells, 1))*0.5
+    fwd_pred = ad_wrapper(problem, linear=True)
+    grad_ref = jax.grad(J)(params)
+    fwd_pred = ad_wrapper(problem, linear=True, precond='lu')
+    grad = jax.grad(J)(params)
+    onp.testing.assert_allclose(grad, grad_ref, rtol=1e-5,
+                                atol=1e-8*onp.max(onp.abs(grad_ref)))
+    lu = direct_solver.lu
+    jax.grad(J)(params)
+    assert direct_solver.lu is lu
+
+
+def test_linearization():
+    problem = get_problem()
+    params = np.ones((problem.num_cells, 1))*0.5
+    newton_update = problem.newton_update
+    calls = []
+
+    def counted_newton_update(sol):
+        calls.append(sol)
+        return newton_update(sol)
+
+    problem.newton_update = counted_newton_update
+    for use_petsc in (False, True):
+        fwd_pred = ad_wrapper(problem, linear=True, use_petsc=use_petsc)
+
+        def J(params):
+            return np.sum(fwd_pred(params)**2)
+
+        calls.clear()
+        grad = jax.grad(J)(params)
+        # Only the assemblies of the forward solve
+        assert len(calls) == 2
+
+        sol = fwd_pred(params)
+        grad_ref = implicit_vjp(problem, sol, params, 2.*sol, use_petsc=False)
+        onp.testing.assert_allclose(grad, grad_ref, rtol=1e-5,
+                                    atol=1e-8*onp.max(onp.abs(grad_ref)))
+    del problem.newton_update
+
+    # PETSc objects stay on the problem for the next forward solves. A later
+    # forward solve changes their values, which are restored for the
+    # backward pass of an earlier one.
+    fwd_pred = ad_wrapper(problem, linear=True, use_petsc=True,
+                          precond='lu')
+    sol_1, f_vjp_1 = jax.vjp(fwd_pred, params)
+    A = problem.petsc_A
+    direct_solver = problem.direct_solvers[('lu', True, False)]
+    ksp = direct_solver.ksp
+    jax.vjp(fwd_pred, 0.5*params)
+    assert problem.petsc_A is A and direct_solver.ksp is ksp
+    grad, = f_vjp_1(2.*sol_1)
+    grad_ref = implicit_vjp(problem, sol_1, params, 2.*sol_1,
+                            use_petsc=False)
+    onp.testing.assert_allclose(grad, grad_ref, rtol=1e-5,
+                                atol=1e-8*onp.max(onp.abs(grad_ref)))
+
+    # Without the tangent at the solution, the backward pass assembles it
+    solver(problem, linear=True, reduced=True)
+    assert get_linearization(problem) is None
+
+
+def test_updated_bc():
+    def top(point):
+        return np.isclose(point[1], 10., atol=1e-5)
+
+    dirichlet_bc_info = [[top]*2, [0, 1], [lambda point: 0.]*2]
+    problem_ref = get_problem()
+    problem_ref.update_Dirichlet_boundary_conditions(dirichlet_bc_info)
+    sol_ref = solver(problem_ref, linear=True)
+
+    options = [{'reduced': True}, {'reduced': True, 'use_petsc': True},
+               {'precond': 'lu'}, {'use_petsc': True},
+               {'precond': 'lu', 'use_petsc': True}]
+    problem = get_problem()
+    for kwargs in options:
+        solver(problem, linear=True, **kwargs)
+    problem.update_Dirichlet_boundary_conditions(dirichlet_bc_info)
+    for kwargs in options:
+        sol = solver(problem, linear=True, **kwargs)
+        onp.testing.assert_allclose(sol, sol_ref, atol=_A_TOL_SOL)
+    onp.testing.assert_array_equal(get_bc_dofs(problem),
+                                   get_bc_dofs(problem_ref))
@@ -0,0 +1,54 @@
+"""Testing the sum factorized laplace kernel of tensor product elements
+against the default kernel, for the residual and the cell Jacobians
+"""
+import numpy as onp
+import pytest
+from jax_am.fem.generate_mesh import Mesh, box_mesh
+from jax_am.fem.basis import get_tensor_product_tables
+from jax_am.fem.models import HyperElasticity, LinearPoisson
+from jax_am.common import rectangle_mesh
+
+
+def check_sum_factorization(problem_cls, mesh, ele_type, vec, dim):
+    sol = 0.01*onp.random.default_rng(0).random((len(mesh.points), vec))
+    problem = problem_cls(mesh, vec=vec, dim=dim, ele_type=ele_type)
+    res_ref = problem.compute_residual(sol)
+    problem.newton_update(sol)
+    V_ref = onp.array(problem.V)
+    for geometry_mode in ['jacobian', 'points']:
+        problem = problem_cls(mesh, vec=vec, dim=dim, ele_type=ele_type,
+                              geometry_mode=geometry_mode,
+                              sum_factorization=True)
+        res = problem.compute_residual(sol)
+        onp.testing.assert_allclose(res, res_ref, atol=1e-10)
+        problem.newton_update(sol)
+        onp.testing.assert_allclose(problem.V, V_ref, atol=1e-10)
+
+
+def test_hex(tmp_path):
+    for ele_type in ['HEX8', 'HEX27']:
+        meshio_mesh = box_mesh(2, 2, 1, 1., 1., 0.5, tmp_path,
+                               ele_type=ele_type)
+        cell_type = 'hexahedron' if ele_type == 'HEX8' else 'hexahedron27'
+        points = meshio_mesh.points.copy()
+        # Distort the mesh so that the cells are not affine
+        points[:, 2] += 0.1*points[:, 0]*points[:, 1]
+        mesh = Mesh(points, meshio_mesh.cells_dict[cell_type])
+        check_sum_factorization(HyperElasticity, mesh, ele_type, 3, 3)
+
+
+def test_quad():
+    meshio_mesh = rectangle_mesh(Nx=3, Ny=2, domain_x=1., domain_y=1.)
+    mesh = Mesh(meshio_mesh.points, meshio_mesh.cells_dict['quad'])
+    check_sum_factorization(LinearPoisson, mesh, 'QUAD4', 1, 2)
+
+
+def test_unsupported():
+    meshio_mesh = rectangle_mesh(Nx=3, Ny=2, domain_x=1., domain_y=1.)
+    mesh = Mesh(meshio_mesh.points, meshio_mesh.cells_dict['quad'])
+    # The gradient tables of the default geometry_mode are not used
+    with pytest.raises(AssertionError):
+        LinearPoisson(mesh, vec=1, dim=2, ele_type='QUAD4',
+                      sum_factorization=True)
+    with pytest.raises(AssertionError):
+        get_tensor_product_tables('HEX20')